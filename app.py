@@ -1,10 +1,22 @@
 import streamlit as st
-import joblib
 import pandas as pd
-import numpy as np
-from PIL import Image
-from io import BytesIO
-import requests
+import uuid
+
+from sleep_analyzer.assets import Asset, AssetStore, stylesheet
+from sleep_analyzer.batcher import batcher_from_env
+from sleep_analyzer.cache import cache_from_env
+from sleep_analyzer.charts import RESOLUTIONS, chart_series
+from sleep_analyzer.clusters import open_clusters
+from sleep_analyzer.features import RAW_COLUMNS, field_labels, screen_time_category
+from sleep_analyzer.forest import LOW_CONFIDENCE_WIDTH
+from sleep_analyzer.importer import import_export
+from sleep_analyzer.metrics import cache_collector, metrics_from_env
+from sleep_analyzer.registry import load_in_background
+from sleep_analyzer.rules import RuleSet, profile_inputs
+from sleep_analyzer.service import ServiceError, client_from_env
+from sleep_analyzer.sleeplog import SAMPLE_ENTRIES, SleepLog
+from sleep_analyzer.timing import PREDICTION_STAGES, TRACKER_STAGES, StageTimer, progress_enabled
+from sleep_analyzer.whatif import rank as rank_changes, what_if
 
 # Configure page
 st.set_page_config(
@@ -18,287 +30,118 @@ st.set_page_config(
     }
 )
 
-# Helper functions
-def load_online_image(url):
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()  # Raise error for bad status codes
-        return Image.open(BytesIO(response.content))
-    except Exception as e:
-        st.error(f"Failed to load online image: {str(e)}")
-        # Create a placeholder image
-        placeholder = Image.new('RGB', (400, 200), color='#4a8cff')
-        from PIL import ImageDraw, ImageFont
-        draw = ImageDraw.Draw(placeholder)
-        font = ImageFont.load_default()
-        draw.text((50, 80), "Sleep Analysis App", fill="white")
-        return placeholder
-
-# Function definitions for data transformations 
-def extract_screen_time(value):
-    if value == '0-1 hrs':
-        return 0.5
-    elif value == '1-2 hrs':
-        return 1.5
-    elif value == '2-3 hrs':
-        return 2.5
-    elif value == '3-4 hrs':
-        return 3.5
-    elif value == '4-5 hrs':
-        return 4.5
-    else:  # 'more than 5'
-        return 5.5
-
-meal_mapping = {
-    'one': 1,
-    'two': 2,
-    'three': 3,
-    'four': 4,
-    'five': 5,
-    'more than 5': 6
-}
-
-exercise_mapping = {
-    'no': 0,
-    'sometimes': 0.5,
-    'yes': 1
-}
-
 # Replace with your online image URLs
 sleep_img_url = "https://ysm-res.cloudinary.com/image/upload/c_limit,f_auto,h_630,q_auto,w_1200/v1/yms/prod/5d491542-079c-4d25-bfeb-2364229534f7"
 logo_img_url = "https://img.freepik.com/premium-vector/sleeping-sticker-logo-icon-vector-pillow-sleep-image-person-having-dreamful-slumber-bed-pillow-with-some-sleeping-sound-rest-relaxation-restoration-vector-eps-10_399089-1071.jpg"
 
-# Load images
-sleep_img = load_online_image(sleep_img_url)
-logo_img = load_online_image(logo_img_url)
+# Images are downloaded once per process in the background; until then (or
+# without network access) the bundled copies in assets/ are shown
+@st.cache_resource
+def load_assets():
+    store = AssetStore({
+        'sleep': Asset(sleep_img_url, 'assets/sleep.png'),
+        'logo': Asset(logo_img_url, 'assets/logo.png'),
+    })
+    store.prefetch()
+    return store
+
+assets = load_assets()
+sleep_img = assets.image('sleep')
 
+# Stage latencies and prediction counters for this process, exported in the
+# Prometheus text format when SLEEP_ANALYZER_METRICS_PORT/_FILE is set
 @st.cache_resource
-def load_model():
-    model = joblib.load('sleep_model.pkl')
-    preprocessor = joblib.load('preprocessor.pkl')
-    return model, preprocessor
-
-try:
-    model, preprocessor = load_model()
-    model_loaded = True
-except Exception as e:
-    st.warning("⚠️ Model files not found. Running in demo mode.")
-    model_loaded = False
-
-# Custom CSS with enhanced styling
-st.markdown("""
-<style>
-    /* Main Theme */
-    :root {
-        --primary: #3a86ff;
-        --primary-light: #83b7ff;
-        --secondary: #6c757d;
-        --success: #28a745;
-        --warning: #ffc107;
-        --danger: #dc3545;
-        --light: #f8f9fa;
-        --dark: #343a40;
-    }
-    
-    /* Page Layout */
-    .main {
-        background-color: #f8f9fa;
-        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-    }
-    
-    /* Header Styling */
-    h1, h2, h3 {
-        color: white !important;  /* Change from #2b5797 to black */
-        font-weight: 600;
-    }
- p, li, div {
-        color: aqua;
-    }
-    
-    /* Form Elements */
-    .stButton>button {
-        background-color: var(--primary);
-        color: white;
-        border-radius: 10px;
-        padding: 12px 24px;
-        font-weight: 600;
-        border: none;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        transition: all 0.3s ease;
-    }
-    
-    .stButton>button:hover {
-        background-color: var(--primary-light);
-        box-shadow: 0 6px 8px rgba(0,0,0,0.15);
-        transform: translateY(-2px);
-    }
-    
-    .stSelectbox, .stNumberInput {
-        border-radius: 8px;
-    }
-    
-    /* Cards */
-    .card {
-        background-color: gray;
-        border-radius: 15px;
-        padding: 20px;
-        box-shadow: 0 4px 12px rgba(0,0,0,0.08);
-        margin: 15px 0;
-        border-left: 5px solid var(--primary);
-    }
-    
-    .info-card {
-        background-color: #339933;
-        border-radius: 10px;
-        padding: 15px;
-        margin: 10px 0;
-        border-left: 4px solid #3a86ff;
-    }
-    
-    .warning-card {
-        background-color: #fff8e1;
-        border-radius: 10px;
-        padding: 15px;
-        margin: 10px 0;
-        border-left: 4px solid #ffc107;
-    }
-    
-    .success-card {
-        background-color: #e8f5e9;
-        border-radius: 10px;
-        padding: 15px;
-        margin: 10px 0;
-        border-left: 4px solid #28a745;
-    }
-    
-    .danger-card {
-        background-color: #ffebee;
-        border-radius: 10px;
-        padding: 15px;
-        margin: 10px 0;
-        border-left: 4px solid #dc3545;
-    }
-    
-    /* Recommendation Cards */
-    .recommendation-container {
-        display: flex;
-        flex-wrap: wrap;
-        gap: 15px;
-        margin-top: 20px;
-    }
-    
-    .recommendation-card {
-        background-color: #339933;
-        border-radius: 12px;
-        padding: 15px;
-        box-shadow: 0 4px 8px rgba(0,0,0,0.05);
-        flex: 1;
-        min-width: 200px;
-        border-top: 5px solid var(--primary);
-        transition: transform 0.3s ease;
-    }
-    
-    .recommendation-card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 6px 12px rgba(0,0,0,0.1);
-    }
-    
-    /* Progress Bars */
-    .progress-container {
-        margin: 20px 0;
-    }
-    
-    .progress-bar {
-        height: 10px;
-        border-radius: 5px;
-        background-color: #339933;
-        margin-bottom: 10px;
-        overflow: hidden;
-    }
-    
-    .progress-value {
-        height: 100%;
-        border-radius: 5px;
-        transition: width 1s ease-in-out;
-    }
-    
-    /* Animations */
-    @keyframes fadeIn {
-        from { opacity: 0; }
-        to { opacity: 1; }
-    }
-    
-    .fade-in {
-        animation: fadeIn 0.5s ease-in;
-    }
-    
-    /* Custom Tabs */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 8px;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        background-color: #339933;
-        border-radius: 6px 6px 0 0;
-        padding: 10px 16px;
-        box-shadow: 0 -2px 5px rgba(0,0,0,0.05);
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background-color: #3a86ff !important;
-        color: white !important;
-    }
-    
-    /* Additional Utilities */
-    .text-center {
-        text-align: center;
-    }
-    
-    .mt-4 {
-        margin-top: 1.5rem;
-    }
-    
-    .mb-4 {
-        margin-bottom: 1.5rem;
-    }
-    
-    /* Tooltip customization */
-    .tooltip {
-        position: relative;
-        display: inline-block;
-    }
-    
-    .tooltip .tooltiptext {
-        visibility: hidden;
-        width: 200px;
-        background-color: #339933;
-        color: #fff;
-        text-align: center;
-        border-radius: 6px;
-        padding: 5px;
-        position: absolute;
-        z-index: 1;
-        bottom: 125%;
-        left: 50%;
-        margin-left: -100px;
-        opacity: 0;
-        transition: opacity 0.3s;
-    }
-    
-    .tooltip:hover .tooltiptext {
-        visibility: visible;
-        opacity: 1;
-    }
-</style>
-""", unsafe_allow_html=True)
+def load_metrics():
+    return metrics_from_env()
+
+metrics = load_metrics()
+
+# With SLEEP_ANALYZER_PREDICTION_SERVICE set, predictions come from a separate
+# `python -m sleep_analyzer.service` process and the model is never loaded here
+@st.cache_resource
+def load_prediction_client():
+    return client_from_env()
+
+prediction_client = load_prediction_client()
+
+# One registry per server process: loads and warms up the model once, then
+# swaps in a retrained sleep_model.pkl (or rebuilt prediction table) on its own.
+# Loading starts in the background here and is waited on after the header renders
+@st.cache_resource
+def load_registry():
+    return load_in_background()
+
+registry_future = load_registry() if prediction_client is None else None
+
+# Predictions shared by all sessions, keyed on the normalized profile and
+# invalidated whenever the registry publishes a new model version
+@st.cache_resource
+def load_prediction_cache():
+    cache = cache_from_env()
+    metrics.collect(cache_collector(cache))
+    return cache
+
+prediction_cache = load_prediction_cache()
+
+# Optional micro-batching of model calls across sessions (SLEEP_ANALYZER_BATCH_SIZE > 1)
+@st.cache_resource
+def load_batcher():
+    return batcher_from_env(metrics)
+
+prediction_batcher = load_batcher()
+
+# Factor and recommendation rules, compiled (and their HTML rendered) once
+@st.cache_resource
+def load_rules():
+    return RuleSet()
+
+rules = load_rules()
+
+# Sleep-pattern clusters fitted offline (`python -m sleep_analyzer.clusters fit`)
+@st.cache_resource
+def load_clusters():
+    return open_clusters()
+
+clusters = load_clusters()
+
+# Durable sleep history, shared by all sessions of this process
+@st.cache_resource
+def load_sleep_log():
+    return SleepLog()
+
+sleep_log = load_sleep_log()
+
+# Downsampled chart series per user and range; any write bumps the user's
+# revision, so new entries miss the cache
+@st.cache_data(max_entries=1000)
+def load_chart_series(user_id, window_days, revision):
+    window_start, window_end = sleep_log.window(user_id, window_days)
+    return chart_series(sleep_log.entries(user_id, window_start, window_end))
+
+# Rolling windows per user, recomputed only after a write bumps the revision
+@st.cache_data(max_entries=1000)
+def load_rolling_stats(user_id, revision):
+    return sleep_log.rolling(user_id)
+
+# Identify the user by a query parameter so their log survives a page refresh
+if 'user' not in st.query_params:
+    st.query_params['user'] = uuid.uuid4().hex
+user_id = st.query_params['user']
+
+# Styles are kept in assets/app.css and minified once per process
+@st.cache_resource
+def load_stylesheet():
+    return stylesheet('assets/app.css')
+
+st.markdown(load_stylesheet(), unsafe_allow_html=True)
 
 # App header
-st.markdown("""
+st.markdown(f"""
 <div style="padding: 20px; margin-bottom: 20px; border-radius: 15px; 
             background: linear-gradient(90deg, #3a86ff 0%, #83b7ff 100%); 
             box-shadow: 0 4px 12px rgba(0,0,0,0.15); display: flex; align-items: center;">
     <div style="margin-right: 20px;">
-        <img src="https://img.freepik.com/premium-vector/sleeping-sticker-logo-icon-vector-pillow-sleep-image-person-having-dreamful-slumber-bed-pillow-with-some-sleeping-sound-rest-relaxation-restoration-vector-eps-10_399089-1071.jpg" width="80px" style="border-radius: 50%; background: white; padding: 5px;">
+        <img src="{assets.data_uri('logo')}" width="80px" style="border-radius: 50%; background: white; padding: 5px;">
     </div>
     <div>
         <h1 style="color: white; margin: 0; padding: 0;">Sleep Pattern Analyzer</h1>
@@ -307,6 +150,19 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+def wait_for_registry():
+    try:
+        return registry_future.result()
+    except Exception:
+        st.warning("⚠️ Model files not found. Running in demo mode.")
+        metrics.inc('demo_fallbacks_total')
+        # Retry the load on the next run instead of caching the failure
+        load_registry.clear()
+        return None
+
+registry = wait_for_registry() if registry_future is not None else None
+model_loaded = registry is not None or prediction_client is not None
+
 # Main content area
 tab1, tab2, tab3 = st.tabs(["💤 Sleep Prediction", "📊 Track Progress", "📚 Sleep Resources"])
 
@@ -351,19 +207,7 @@ with tab1:
                                      help="Hours spent on electronic devices before sleeping")
                 
                 # Convert slider value to categories for model prediction
-                screen_time_category = '0-1 hrs'
-                if screen_time <= 1:
-                    screen_time_category = '0-1 hrs'
-                elif screen_time <= 2:
-                    screen_time_category = '1-2 hrs'
-                elif screen_time <= 3:
-                    screen_time_category = '2-3 hrs'
-                elif screen_time <= 4:
-                    screen_time_category = '3-4 hrs'
-                elif screen_time <= 5:
-                    screen_time_category = '4-5 hrs'
-                else:
-                    screen_time_category = 'more than 5'
+                screen_time_bucket = screen_time_category(screen_time)
                 
                 bluelight = st.toggle('Use blue light filter on devices', 
                                    help="Do you use blue light filters on electronic devices?")
@@ -408,61 +252,83 @@ with tab1:
 
     # Prediction and results
     if submitted:
+        # Progress advances only when a real stage of the pipeline finishes
+        progress_bar = st.progress(0, text=PREDICTION_STAGES['features']) if progress_enabled() else None
+        def show_progress(fraction, next_label):
+            if progress_bar is not None:
+                progress_bar.progress(fraction, text=next_label or "Done")
+        timer = StageTimer(PREDICTION_STAGES, on_progress=show_progress)
+        habit_changes = None
+        attributions = None
+        interval = None
+        
         with st.spinner("Analyzing your sleep factors..."):
-            # Progress bar animation
-            import time
-            progress_bar = st.progress(0)
-            for i in range(100):
-                time.sleep(0.01)
-                progress_bar.progress(i + 1)
+            with timer.stage('features'):
+                profile = dict(zip(RAW_COLUMNS, [age, gender, meals, physical_illness, screen_time_bucket,
+                                                 bluelight_val, sleep_direction, exercise, smoke_drink, beverage]))
             
             # Simulate model prediction if model not loaded
             if not model_loaded:
-                # Demo prediction based on inputs
-                if screen_time > 3 or smoke_drink == 'yes':
-                    prediction = 5.5 + (0.5 if bluelight_val == 'yes' else 0) + (0.5 if exercise == 'yes' else 0)
-                elif exercise == 'yes' and screen_time < 2:
-                    prediction = 7.5
-                else:
-                    prediction = 6.5
+                prediction_source = 'demo'
+                with timer.stage('predict'):
+                    # Demo prediction based on inputs
+                    if screen_time > 3 or smoke_drink == 'yes':
+                        prediction = 5.5 + (0.5 if bluelight_val == 'yes' else 0) + (0.5 if exercise == 'yes' else 0)
+                    elif exercise == 'yes' and screen_time < 2:
+                        prediction = 7.5
+                    else:
+                        prediction = 6.5
+            elif prediction_client is not None:
+                prediction_source = 'service'
+                with timer.stage('predict'):
+                    try:
+                        result = prediction_client.predict(profile, screen_hours=screen_time)
+                        prediction = result['prediction']
+                        interval = result.get('interval')
+                        if 'attributions' in result:
+                            attributions = result['baseline'], result['attributions']
+                    except ServiceError as e:
+                        metrics.inc('service_errors_total')
+                        if progress_bar is not None:
+                            progress_bar.empty()
+                        st.error(f"⚠️ The prediction service is unavailable, please try again shortly. ({e})")
+                        st.stop()
             else:
-                # Real prediction with model
-                input_data = pd.DataFrame({
-                    'Age': [age],
-                    'Gender': [gender],
-                    'meals/day': [meals],
-                    'physical illness': [physical_illness],
-                    'screen time': [screen_time_category],
-                    'bluelight filter': [bluelight_val],
-                    'sleep direction': [sleep_direction],
-                    'exercise': [exercise],
-                    'smoke/drink': [smoke_drink],
-                    'beverage': [beverage],
-                    'screen_time_numeric': [0],
-                    'meals_numeric': [0],
-                    'exercise_numeric': [0],
-                    'screen_exercise_interaction': [0],
-                    'meals_screen_interaction': [0]
-                })
-                
-                # Apply transformations
-                input_data['screen_time_numeric'] = input_data['screen time'].apply(lambda x: extract_screen_time(x))
-                input_data['meals_numeric'] = input_data['meals/day'].map(meal_mapping)
-                input_data['physical illness'] = input_data['physical illness'].map({'yes': 1, 'no': 0})
-                input_data['bluelight filter'] = input_data['bluelight filter'].map({'yes': 1, 'no': 0})
-                input_data['smoke/drink'] = input_data['smoke/drink'].map({'yes': 1, 'no': 0})
-                input_data['exercise_numeric'] = input_data['exercise'].map(exercise_mapping)
-                input_data['screen_exercise_interaction'] = input_data['screen_time_numeric'] * input_data['exercise_numeric']
-                input_data['meals_screen_interaction'] = input_data['meals_numeric'] * input_data['screen_time_numeric']
-                
-                features_for_prediction = input_data[['Age', 'Gender', 'meals_numeric', 'physical illness', 'screen_time_numeric',
-                                                'bluelight filter', 'sleep direction', 'exercise_numeric', 'smoke/drink',
-                                                'beverage', 'screen_exercise_interaction', 'meals_screen_interaction']]
-                
-                prediction = model.predict(features_for_prediction)[0]
+                model_version = registry.current()
+                with timer.stage('preprocess'):
+                    encoded_profile = model_version.flat.encode_profile(profile)
+                with timer.stage('predict'):
+                    prediction_source = 'cache'
+                    # Cache and table entries carry the interval, so a hit walks no trees
+                    answer = prediction_cache.get(model_version.sha256, profile)
+                    if answer is None:
+                        table = model_version.table
+                        prediction_source = 'table'
+                        answer = table.lookup_interval(profile) if table is not None else None
+                        if answer is None:
+                            # Real prediction with model; the compiled pipeline builds its own features
+                            prediction_source = 'model'
+                            if prediction_batcher is not None:
+                                answer = prediction_batcher((model_version.flat, encoded_profile))
+                            else:
+                                answer = model_version.flat.predict_interval_vector(encoded_profile)
+                        prediction_cache.put(model_version.sha256, profile, answer)
+                    prediction, *interval = answer
+                if model_version.explainer is not None:
+                    with timer.stage('explain'):
+                        # Exact tree attributions from path data compiled when the model loaded
+                        attributions = (model_version.explainer.expected_value,
+                                        model_version.explainer.explain_profile(profile, encoded=encoded_profile))
+                with timer.stage('whatif'):
+                    # Every one- and two-habit change, scored in a single forest pass
+                    _, habit_variants = what_if(model_version.flat, profile)
+                    habit_changes = rank_changes(habit_variants, limit=5)
         
-        # Remove progress bar after completion
-        progress_bar.empty()
+        low_confidence = interval is not None and interval[1] - interval[0] > LOW_CONFIDENCE_WIDTH
+        if low_confidence:
+            metrics.inc('low_confidence_predictions_total')
+        
+        timer.start('render')
         
         # Results section with enhanced UI
         st.markdown("""
@@ -487,6 +353,17 @@ with tab1:
             </div>
             """, unsafe_allow_html=True)
             
+            # Middle 80% of the forest's per-tree predictions
+            if interval is not None:
+                confidence_note = ('<br><span style="color: #dc3545;">⚠️ Low confidence: the model\'s trees '
+                                   'disagree on profiles like yours</span>' if low_confidence else '')
+                st.markdown(f"""
+                <div style="text-align: center; margin-bottom: 10px;">
+                    Likely range: <b>{interval[0]:.1f}–{interval[1]:.1f} hours</b>
+                    {confidence_note}
+                </div>
+                """, unsafe_allow_html=True)
+            
             # Quality indicator
             quality_label = "Excellent" if prediction >= 7 else "Moderate" if prediction >= 6 else "Poor"
             quality_color = "#28a745" if prediction >= 7 else "#ffc107" if prediction >= 6 else "#dc3545"
@@ -521,30 +398,11 @@ with tab1:
                 <ul style="margin-top: 5px; padding-left: 20px;">
             """, unsafe_allow_html=True)
             
-            # Dynamically generate factors
-            factors = []
-            if screen_time > 3:
-                factors.append(f"<li>High screen time ({screen_time} hours) before bed</li>")
-            if smoke_drink == 'yes':
-                factors.append("<li>Smoking or alcohol consumption</li>")
-            if exercise == 'no':
-                factors.append("<li>Lack of regular exercise</li>")
-            if bluelight_val == 'no' and screen_time > 2:
-                factors.append("<li>Extended screen use without blue light filter</li>")
-            if beverage in ['Coffee', 'Tea and Coffee both']:
-                factors.append("<li>Evening caffeine consumption</li>")
-            
-            # If no negative factors, add positive ones
-            if not factors:
-                if exercise == 'yes':
-                    factors.append("<li>Regular exercise is helping your sleep quality</li>")
-                if bluelight_val == 'yes':
-                    factors.append("<li>Using blue light filter is beneficial</li>")
-                if screen_time < 2:
-                    factors.append("<li>Limited screen time before bed is ideal</li>")
-            
-            for factor in factors:
-                st.markdown(factor, unsafe_allow_html=True)
+            # Factors from the shared rule table; the slider's exact hours stand in for the bucket
+            rule_inputs = profile_inputs(profile, screen_hours=screen_time)
+            matched = rules.matches(rule_inputs)[0]
+            for rule in matched['factor'] or matched['strength']:
+                st.markdown(rule.render(rule_inputs), unsafe_allow_html=True)
             
             st.markdown("</ul></div>", unsafe_allow_html=True)
         
@@ -560,77 +418,65 @@ with tab1:
             <div class="recommendation-container">
         """, unsafe_allow_html=True)
         
-        # Screen time recommendations
-        if screen_time > 2:
-            st.markdown("""
-            <div class="recommendation-card">
-                <div style="font-size: 24px; margin-bottom: 10px;">📱</div>
-                <h3 style="margin-top: 0;">Reduce Screen Time</h3>
-                <ul>
-                    <li>Aim to put devices away 1 hour before bed</li>
-                    <li>Enable night mode/blue light filters</li>
-                    <li>Try reading a physical book instead</li>
-                </ul>
-            </div>
-            """, unsafe_allow_html=True)
+        # Recommendation cards are pre-rendered by the rule table
+        for rule in matched['recommendation']:
+            st.markdown(rule.html, unsafe_allow_html=True)
         
-        # Exercise recommendations
-        if exercise != 'yes':
-            st.markdown("""
-            <div class="recommendation-card">
-                <div style="font-size: 24px; margin-bottom: 10px;">🏃</div>
-                <h3 style="margin-top: 0;">Increase Physical Activity</h3>
-                <ul>
-                    <li>Start with 20-30 minutes daily</li>
-                    <li>Morning exercise can improve sleep quality</li>
-                    <li>Even light activities like walking help</li>
-                </ul>
+        # Close recommendations container
+        st.markdown("</div></div>", unsafe_allow_html=True)
+        
+        # Hours each answer adds or removes relative to the average prediction
+        if attributions is not None:
+            baseline, contributions = attributions
+            ranked = sorted(contributions.items(), key=lambda item: -abs(item[1]))
+            attribution_items = "".join(
+                f"<li><span style=\"color: {'#28a745' if hours > 0 else '#dc3545'}; font-weight: bold;\">{hours:+.2f} h</span> "
+                f"{field_labels[column]}: {profile[column]}</li>"
+                for column, hours in ranked if abs(hours) >= 0.01)
+            st.markdown(f"""
+            <div class="info-card fade-in" style="margin-top: 30px;">
+                <h3 style="margin-top: 0;">🔍 Why This Prediction</h3>
+                <p style="color: black;">Starting from the average prediction of {baseline:.1f} hours, your answers add or remove:</p>
+                <ul style="color: black;">{attribution_items or "<li>Your answers keep you at the average.</li>"}</ul>
             </div>
             """, unsafe_allow_html=True)
         
-        # Nutrition recommendations
-        if meal_mapping.get(meals, 3) > 3 or beverage in ['Coffee', 'Tea and Coffee both']:
-            st.markdown("""
-            <div class="recommendation-card">
-                <div style="font-size: 24px; margin-bottom: 10px;">🍽️</div>
-                <h3 style="margin-top: 0;">Adjust Eating Habits</h3>
-                <ul>
-                    <li>Finish dinner 2-3 hours before bed</li>
-                    <li>Avoid caffeine after 2 PM</li>
-                    <li>Consider lighter evening meals</li>
-                </ul>
+        # Habit changes ranked by predicted hours gained (needs the model, not demo mode)
+        if habit_changes is not None:
+            if habit_changes:
+                change_items = "".join(f"<li><b>+{change.gain:.2f} h</b> ({prediction + change.gain:.1f} hours): {change.describe()}</li>"
+                                       for change in habit_changes)
+            else:
+                change_items = "<li>No single or paired habit change is predicted to add sleep for you.</li>"
+            st.markdown(f"""
+            <div class="info-card fade-in" style="margin-top: 30px;">
+                <h3 style="margin-top: 0;">📈 What Would Help Most</h3>
+                <p style="color: black;">Predicted sleep gained by changing one or two habits:</p>
+                <ul style="color: black;">{change_items}</ul>
             </div>
             """, unsafe_allow_html=True)
         
-        # Substance recommendations
-        if smoke_drink == 'yes':
-            st.markdown("""
-            <div class="recommendation-card">
-                <div style="font-size: 24px; margin-bottom: 10px;">🚭</div>
-                <h3 style="margin-top: 0;">Limit Substances</h3>
-                <ul>
-                    <li>Reduce alcohol, especially before bed</li>
-                    <li>Avoid smoking near bedtime</li>
-                    <li>Consider herbal tea alternatives</li>
-                </ul>
+        # Nearest sleep group by centroid distance; nothing is fitted per request
+        if clusters is not None:
+            # Centroids were fitted on the bucketed screen-time answers, not the exact slider hours
+            cluster_inputs = profile_inputs(profile, sleep_time=prediction)
+            cluster = int(clusters.assign(cluster_inputs)[0])
+            group = clusters.profile(cluster)
+            group_advice = "".join(f"<li>{message}</li>" for message in clusters.advice(cluster_inputs, cluster))
+            st.markdown(f"""
+            <div class="info-card fade-in" style="margin-top: 30px;">
+                <h3 style="margin-top: 0;">👥 Your Sleep Group</h3>
+                <p style="color: black;">You are most similar to group {cluster + 1} of {clusters.k} ({clusters.sizes[cluster]} survey respondents), who average {group['sleep time']:.1f} hours of sleep.</p>
+                <ul style="color: black;">{group_advice}</ul>
             </div>
             """, unsafe_allow_html=True)
         
-        # Sleep hygiene recommendations (always show)
-        st.markdown("""
-        <div class="recommendation-card">
-            <div style="font-size: 24px; margin-bottom: 10px;">🛏️</div>
-            <h3 style="margin-top: 0;">Sleep Environment</h3>
-            <ul>
-                <li>Keep bedroom cool (65-68°F/18-20°C)</li>
-                <li>Use blackout curtains for darkness</li>
-                <li>Maintain a consistent sleep schedule</li>
-            </ul>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Close recommendations container
-        st.markdown("</div></div>", unsafe_allow_html=True)
+        timer.stop('render')
+        metrics.record(timer, 'predict')
+        metrics.inc('predictions_total', source=prediction_source)
+        if progress_bar is not None:
+            progress_bar.empty()
+        st.caption(f"Analysis took {timer.summary()}")
         
         # Sleep tracking suggestion
         st.markdown("""
@@ -651,33 +497,34 @@ with tab2:
     
     # Sample tracking interface
     with st.expander("Sleep Tracking Dashboard", expanded=True):
-        # Placeholder for tracking data (would be saved in a real app)
-        if 'sleep_data' not in st.session_state:
-            st.session_state.sleep_data = [
-                {'date': '2025-03-24', 'hours': 6.2, 'quality': 3},
-                {'date': '2025-03-25', 'hours': 6.5, 'quality': 3},
-                {'date': '2025-03-26', 'hours': 6.8, 'quality': 4},
-                {'date': '2025-03-27', 'hours': 7.0, 'quality': 4},
-                {'date': '2025-03-28', 'hours': 7.2, 'quality': 4},
-                {'date': '2025-03-29', 'hours': 7.5, 'quality': 5},
-                {'date': '2025-03-30', 'hours': 7.3, 'quality': 4},
-            ]
+        range_col, resolution_col = st.columns(2)
+        with range_col:
+            window_days = st.selectbox("Show", [7, 30, 90, 365, None], index=1,
+                                       format_func=lambda days: f"Last {days} days" if days else "All time")
+        with resolution_col:
+            resolution = st.selectbox("Resolution", list(RESOLUTIONS), format_func=str.capitalize)
+        tracker_timer = StageTimer(TRACKER_STAGES)
+        tracker_timer.start('load')
+        window_start, window_end = sleep_log.window(user_id, window_days)
+        if window_end is None:
+            # Nothing logged yet: show the sample week without storing it
+            sleep_data = pd.DataFrame(SAMPLE_ENTRIES)
+            series = chart_series(sleep_data)
+            st.caption("Showing sample data. Add an entry to start your own sleep log.")
+        else:
+            series = load_chart_series(user_id, window_days, sleep_log.revision(user_id))
+        tracker_timer.stop('load')
         
         track_col1, track_col2 = st.columns([2, 1])
         
         with track_col1:
-            # Create chart data
-            chart_data = pd.DataFrame(
-                st.session_state.sleep_data,
-                columns=['date', 'hours', 'quality']
-            )
-            
             # Display line chart
-            st.line_chart(
-                chart_data.set_index('date')['hours'], 
-                use_container_width=True,
-                height=250
-            )
+            with tracker_timer.stage('chart'):
+                st.line_chart(
+                    series[resolution], 
+                    use_container_width=True,
+                    height=250
+                )
         
         with track_col2:
             # Add new sleep entry form
@@ -688,14 +535,23 @@ with tab2:
             sleep_quality = st.slider("Sleep quality (1-5)", min_value=1, max_value=5, value=4)
             
             if st.button("Add Entry", use_container_width=True):
-                new_entry = {
-                    'date': sleep_date.strftime('%Y-%m-%d'),
-                    'hours': sleep_hours,
-                    'quality': sleep_quality
-                }
-                st.session_state.sleep_data.append(new_entry)
+                sleep_log.add(user_id, sleep_date, sleep_hours, sleep_quality)
                 st.success("Sleep entry added!")
                 st.rerun()
+            
+            # Bulk import: the whole file is written before a single rerun
+            st.markdown("### Import From a Tracker")
+            export_file = st.file_uploader("Sleep export (CSV or JSON)", type=['csv', 'json', 'jsonl', 'ndjson'])
+            if export_file is not None and st.button("Import", use_container_width=True):
+                try:
+                    report = import_export(sleep_log, user_id, export_file)
+                except ValueError as e:
+                    st.error(f"Could not import {export_file.name}: {e}")
+                else:
+                    st.session_state.import_message = f"Import complete: {report}"
+                    st.rerun()
+            if 'import_message' in st.session_state:
+                st.success(st.session_state.pop('import_message'))
     
     # Weekly sleep stats
     st.markdown("""
@@ -704,21 +560,44 @@ with tab2:
     </div>
     """, unsafe_allow_html=True)
     
+    # Rolling aggregates over the last week logged, compared with the week before
+    tracker_timer.start('stats')
+    if window_end is None:
+        stats = {'nights': len(sleep_data), 'avg_hours': sleep_data['hours'].mean(),
+                 'avg_quality': sleep_data['quality'].mean(), 'good_nights': int((sleep_data['hours'] >= 7).sum()),
+                 'delta_hours': None, 'delta_quality': None, 'delta_good_nights': None}
+        rolling = None
+    else:
+        rolling = load_rolling_stats(user_id, sleep_log.revision(user_id))
+        stats = rolling[7]
+        # All-time figures come straight from the running totals the triggers maintain
+        totals = sleep_log.totals(user_id)
+    
     stat_col1, stat_col2, stat_col3 = st.columns(3)
     with stat_col1:
-        avg_hours = sum(entry['hours'] for entry in st.session_state.sleep_data) / len(st.session_state.sleep_data)
-        st.metric("Average Sleep", f"{avg_hours:.1f} hours", delta="+0.6 hrs", delta_color="normal")
+        avg_hours = stats['avg_hours']
+        delta_hours = f"{stats['delta_hours']:+.1f} hrs" if stats['delta_hours'] is not None else None
+        st.metric("Average Sleep", f"{avg_hours:.1f} hours", delta=delta_hours, delta_color="normal")
     
     with stat_col2:
-        avg_quality = sum(entry['quality'] for entry in st.session_state.sleep_data) / len(st.session_state.sleep_data)
-        st.metric("Average Quality", f"{avg_quality:.1f}/5", delta="+0.8", delta_color="normal")
+        avg_quality = stats['avg_quality']
+        delta_quality = f"{stats['delta_quality']:+.1f}" if stats['delta_quality'] is not None else None
+        st.metric("Average Quality", f"{avg_quality:.1f}/5", delta=delta_quality, delta_color="normal")
                                         
 
 
     
     with stat_col3:
-        good_nights = sum(1 for entry in st.session_state.sleep_data if entry['hours'] >= 7)
-        st.metric("Good Sleep Nights", f"{good_nights}/{len(st.session_state.sleep_data)}", delta="+2", delta_color="normal")
+        st.metric("Good Sleep Nights", f"{stats['good_nights']}/{stats['nights']}",
+                  delta=stats['delta_good_nights'], delta_color="normal")
+    
+    if rolling is not None:
+        st.caption(" · ".join([f"{days}-day average {summary['avg_hours']:.1f} hrs ({summary['nights']} nights)"
+                               for days, summary in rolling.items()]
+                              + [f"all-time average {totals['avg_hours']:.1f} hrs ({totals['nights']} nights, "
+                                 f"{totals['good_nights']} good)"]))
+    tracker_timer.stop('stats')
+    metrics.record(tracker_timer, 'tracker')
     
     # Sleep improvement tips based on data
     if avg_hours < 7:
@@ -894,33 +773,8 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Add a floating help button
+# Add a floating help button (styled in assets/app.css)
 st.markdown("""
-<style>
-.floating-help-button {
-    position: fixed;
-    bottom: 20px;
-    right: 20px;
-    width: 60px;
-    height: 60px;
-    border-radius: 50%;
-    background-color: #3a86ff;
-    box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-    display: flex;
-    justify-content: center;
-    align-items: center;
-    color: white;
-    font-size: 24px;
-    cursor: pointer;
-    z-index: 9999;
-    transition: all 0.3s ease;
-}
-.floating-help-button:hover {
-    transform: scale(1.1);
-    background-color: #2a76ef;
-}
-</style>
-
 <div class="floating-help-button" onclick="alert('Need help? Email support@sleeppredictor.app')">
     ?
 </div>
@@ -0,0 +1 @@
+"""Importable building blocks behind the Sleep Pattern Analyzer app."""
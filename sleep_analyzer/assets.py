@@ -0,0 +1,186 @@
+"""Image assets fetched once in the background and cached in memory and on disk.
+
+``AssetStore.image`` never blocks on the network: it returns the freshest
+copy it has (memory, then the on-disk cache, then the bundled fallback in
+``assets/``) and schedules a background download when the copy is missing or
+older than the TTL. Downloads for all assets run concurrently on a small
+thread pool, so on hosts without internet access the app renders straight
+from the bundled files.
+
+Images are kept as their encoded bytes, which ``st.image`` serves as is.
+``requests`` and PIL are imported only when a download actually runs (PIL to
+check that the response is an image), not when the app starts.
+
+The page stylesheet lives in ``assets/app.css``; ``stylesheet`` minifies it
+into the ``<style>`` block the app injects, so the CSS is not a string literal
+re-parsed with the script on every rerun.
+"""
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CACHE_DIR = Path(os.environ.get('SLEEP_ANALYZER_ASSET_CACHE', ROOT / '.cache' / 'assets'))
+DEFAULT_TTL = 24 * 60 * 60
+# After a failed download, wait this long before trying that asset again
+RETRY_DELAY = 5 * 60
+# Leading bytes of the image formats the assets come in
+SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+    b'\xff\xd8\xff': 'image/jpeg',
+    b'GIF8': 'image/gif',
+    b'RIFF': 'image/webp',
+}
+
+# CSS comments, and whitespace that CSS does not need around punctuation
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_SPACE = re.compile(r'\s*([{};,>])\s*|(:)\s+|\s+')
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Asset:
+    url: str
+    fallback: str  # path of the bundled copy, relative to the repo root
+
+
+class AssetStore:
+    """Process-wide image cache for a fixed set of named assets."""
+
+    def __init__(self, assets, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, timeout=5, max_workers=4):
+        self.assets = dict(assets)
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.timeout = timeout
+        self._images = {}       # name -> (fetched_at, encoded bytes)
+        self._data_uris = {}    # name -> (encoded bytes, data uri)
+        self._pending = {}      # name -> Future
+        self._failed_at = {}    # name -> time of the last failed download
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='assets')
+
+    def cache_path(self, name):
+        digest = hashlib.sha256(self.assets[name].url.encode()).hexdigest()[:16]
+        return self.cache_dir / f"{name}-{digest}"
+
+    def prefetch(self):
+        """Start background downloads for every asset that is missing or stale."""
+        for name in self.assets:
+            self._entry(name)
+
+    def image(self, name):
+        """Return the encoded bytes of the best available copy without waiting on the network."""
+        return self._entry(name)[1]
+
+    def data_uri(self, name):
+        """The asset as a ``data:`` URI, for HTML that would otherwise hot-link the URL."""
+        _, content = self._entry(name)
+        with self._lock:
+            cached = self._data_uris.get(name)
+        if cached is None or cached[0] is not content:
+            cached = (content, f"data:{mime_type(content)};base64,{base64.b64encode(content).decode()}")
+            with self._lock:
+                self._data_uris[name] = cached
+        return cached[1]
+
+    def wait(self, timeout=None):
+        """Block until in-flight downloads finish (for scripts and tests)."""
+        with self._lock:
+            pending = list(self._pending.values())
+        for future in pending:
+            future.exception(timeout=timeout)
+
+    def _entry(self, name):
+        with self._lock:
+            entry = self._images.get(name)
+        if entry is None:
+            entry = self._load_local(name)
+        if time.time() - entry[0] > self.ttl:
+            self._refresh(name)
+        return entry
+
+    def _load_local(self, name):
+        """Memory miss: use the disk cache if present, else the bundled fallback."""
+        path = self.cache_path(name)
+        if path.exists():
+            try:
+                content = path.read_bytes()
+                entry = (path.stat().st_mtime, content)
+            except OSError:
+                content = None
+            if content is not None and mime_type(content) is not None:
+                self._store(name, entry)
+                return entry
+            logger.warning("ignoring unreadable cached asset %s", path)
+        # Fallbacks are stamped as already stale so the real image is fetched
+        entry = (0.0, (ROOT / self.assets[name].fallback).read_bytes())
+        self._store(name, entry)
+        return entry
+
+    def _store(self, name, entry):
+        with self._lock:
+            self._images[name] = entry
+
+    def _refresh(self, name):
+        with self._lock:
+            if name in self._pending or time.time() - self._failed_at.get(name, 0.0) < RETRY_DELAY:
+                return
+            self._pending[name] = self._pool.submit(self._fetch, name)
+
+    def _fetch(self, name):
+        try:
+            import requests
+
+            response = requests.get(self.assets[name].url, timeout=self.timeout)
+            response.raise_for_status()
+            decode(response.content)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path(name).with_suffix('.tmp')
+            tmp.write_bytes(response.content)
+            os.replace(tmp, self.cache_path(name))
+            self._store(name, (time.time(), response.content))
+        except Exception as e:
+            logger.warning("failed to fetch asset %r: %s", name, e)
+            with self._lock:
+                self._failed_at[name] = time.time()
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+
+def decode(content):
+    """Decode image bytes fully; raises if a download is not a readable image."""
+    from PIL import Image
+
+    image = Image.open(BytesIO(content))
+    image.load()
+    return image
+
+
+def mime_type(content):
+    """MIME type of encoded image bytes from their signature, or ``None`` if unrecognised."""
+    for signature, mime in SIGNATURES.items():
+        if content.startswith(signature):
+            return mime
+    return None
+
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet."""
+    css = CSS_COMMENT.sub('', css)
+    css = CSS_SPACE.sub(lambda m: m.group(1) or m.group(2) or ' ', css)
+    return css.replace(';}', '}').strip()
+
+
+def stylesheet(path):
+    """The stylesheet at ``path`` (relative to the repo root) as a minified ``<style>`` block."""
+    return f"<style>{minify_css((ROOT / path).read_text(encoding='utf-8'))}</style>"
@@ -0,0 +1,215 @@
+"""Headless batch scoring of survey cohorts through the sleep model.
+
+Usage::
+
+    python -m sleep_analyzer.batch Sleep_Analysis.csv -o predictions.csv
+
+The input is a CSV or Parquet file (or a DataFrame when used as a library)
+with the ``Sleep_Analysis.csv`` columns. Features are built column-wise for
+the whole cohort by the pipeline's ``SleepFeatureTransformer`` and
+``model.predict`` runs once per chunk of rows.
+
+``--attributions`` adds a ``<field> attribution`` column per form field (the
+hours that answer adds or removes) and the ``baseline sleep time`` they start
+from, computed with ``TreeExplainer`` on the model's compiled forest.
+``--intervals`` adds ``prediction lower``/``prediction upper`` (quantiles of
+the per-tree predictions, from the same walk of the compiled forest that
+gives the prediction) and a ``low confidence`` flag for intervals wider than
+``--low-confidence-width`` hours.
+"""
+import argparse
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from sleep_analyzer.explain import TreeExplainer
+from sleep_analyzer.features import RAW_COLUMNS
+from sleep_analyzer.forest import DEFAULT_QUANTILES, LOW_CONFIDENCE_WIDTH, FlatForest
+from sleep_analyzer.lookup import open_table
+from sleep_analyzer.rules import RuleSet, rule_inputs
+
+DEFAULT_MODEL_PATH = Path(__file__).resolve().parent.parent / 'sleep_model.pkl'
+DEFAULT_CHUNK_SIZE = 50_000
+
+
+@dataclass
+class BatchReport:
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds > 0 else float('inf')
+
+    def __str__(self):
+        return f"scored {self.rows} rows in {self.seconds:.3f} s ({self.rows_per_sec:,.0f} rows/s)"
+
+
+def load_model(path=DEFAULT_MODEL_PATH):
+    return joblib.load(path)
+
+
+def read_survey(path):
+    """Read a survey file; ``.parquet``/``.pq`` files go through pyarrow, anything else is CSV."""
+    path = Path(path)
+    if path.suffix.lower() in ('.parquet', '.pq'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def write_predictions(frame, path):
+    path = Path(path)
+    if path.suffix.lower() in ('.parquet', '.pq'):
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+
+
+def predict_batch(model, data, chunk_size=DEFAULT_CHUNK_SIZE, table=None, model_path=DEFAULT_MODEL_PATH):
+    """Predict sleep hours for every raw survey row in ``data``.
+
+    With a ``PredictionTable`` rows are answered from the table and only rows
+    outside it go through the model; ``model`` may then be ``None`` and is
+    loaded from ``model_path`` on demand. Returns a float array aligned
+    with ``data``'s rows.
+    """
+    rows = data[RAW_COLUMNS]
+    if table is None:
+        predictions = np.empty(len(rows), dtype=float)
+        pending = np.arange(len(rows))
+    else:
+        predictions = table.predict(rows)
+        pending = np.flatnonzero(np.isnan(predictions))
+
+    if len(pending) and model is None:
+        model = load_model(model_path)
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        predictions[chunk] = model.predict(rows.iloc[chunk])
+    return predictions
+
+
+def predict_interval_batch(model, data, chunk_size=DEFAULT_CHUNK_SIZE, table=None, model_path=DEFAULT_MODEL_PATH,
+                           quantiles=DEFAULT_QUANTILES):
+    """``(predictions, lower, upper)`` for every raw survey row, from one walk of the trees.
+
+    The model is compiled once into a ``FlatForest`` and each chunk goes
+    through ``FlatForest.predict_interval``, the kernel the app and the
+    service use, so the predictions are identical to ``model.predict``. As in
+    ``predict_batch``, rows a ``PredictionTable`` covers are answered from it
+    (it stores the interval too) and ``model`` is loaded only if needed.
+    """
+    rows = data[RAW_COLUMNS]
+    if table is None:
+        predictions, lower, upper = np.full((3, len(rows)), np.nan)
+        pending = np.arange(len(rows))
+    else:
+        predictions, lower, upper = table.predict_interval(rows)
+        pending = np.flatnonzero(np.isnan(predictions))
+
+    if not len(pending):
+        return predictions, lower, upper
+    forest = FlatForest.from_pipeline(model if model is not None else load_model(model_path))
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        predictions[chunk], lower[chunk], upper[chunk] = forest.predict_interval(rows.iloc[chunk], quantiles)
+    return predictions, lower, upper
+
+
+def explain(data, predictions, rules=None):
+    """Factor and recommendation messages for each row, joined with ``'; '``.
+
+    Returns ``(factors, recommendations)`` lists aligned with ``data``;
+    recommendation rules on sleep time see the predictions.
+    """
+    rules = rules or RuleSet()
+    inputs = rule_inputs(data[RAW_COLUMNS], sleep_time=predictions)
+    factors = rules.explain(inputs, 'factor')
+    strengths = rules.explain(inputs, 'strength')
+    recommendations = rules.explain(inputs, 'recommendation', general=False)
+    return (['; '.join(f or s) for f, s in zip(factors, strengths)],
+            ['; '.join(messages) for messages in recommendations])
+
+
+def attributions(model, data):
+    """Per-field attributions for every row of ``data``, plus the baseline, as a DataFrame."""
+    explainer = TreeExplainer(FlatForest.from_pipeline(model))
+    values = explainer.explain(data)
+    values.columns = [f"{column} attribution" for column in values.columns]
+    values.insert(0, 'baseline sleep time', explainer.expected_value)
+    return values
+
+
+def score(source, model=None, chunk_size=DEFAULT_CHUNK_SIZE, table=None, model_path=DEFAULT_MODEL_PATH,
+          with_explanations=False, with_attributions=False, with_intervals=False,
+          low_confidence_width=LOW_CONFIDENCE_WIDTH):
+    """Score a survey file path or DataFrame.
+
+    Returns ``(frame, report)`` where ``frame`` is the input with an added
+    ``predicted sleep time`` column and ``report`` holds the throughput.
+    ``with_explanations`` also adds ``factors`` and ``recommendations``
+    columns from the shared rule table, and ``with_attributions`` the
+    columns of ``attributions``. ``with_intervals`` predicts with
+    ``predict_interval_batch`` and adds the interval columns from that same
+    pass.
+    """
+    data = source if isinstance(source, pd.DataFrame) else read_survey(source)
+    if model is None and table is None:
+        model = load_model(model_path)
+
+    start = time.perf_counter()
+    if with_intervals:
+        predictions, lower, upper = predict_interval_batch(model, data, chunk_size=chunk_size, table=table,
+                                                           model_path=model_path)
+    else:
+        predictions = predict_batch(model, data, chunk_size=chunk_size, table=table, model_path=model_path)
+    report = BatchReport(rows=len(data), seconds=time.perf_counter() - start)
+
+    scored = data.copy()
+    scored['predicted sleep time'] = predictions
+    if with_intervals:
+        scored['prediction lower'], scored['prediction upper'] = lower, upper
+        scored['low confidence'] = upper - lower > low_confidence_width
+    if with_explanations:
+        scored['factors'], scored['recommendations'] = explain(data, predictions)
+    if with_attributions:
+        scored = scored.join(attributions(model if model is not None else load_model(model_path), data))
+    return scored, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a survey file with the sleep model.")
+    parser.add_argument('input', help="CSV or Parquet file with the Sleep_Analysis.csv columns")
+    parser.add_argument('-o', '--output', help="where to write the scored rows (CSV or Parquet)")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="path to the pickled model pipeline")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="rows per model.predict call")
+    parser.add_argument('--table', help="prediction table from `python -m sleep_analyzer.lookup build`; "
+                                         "rows it covers skip the model")
+    parser.add_argument('--explain', action='store_true',
+                        help="add factors and recommendations columns from the rule table")
+    parser.add_argument('--attributions', action='store_true',
+                        help="add the hours each form field adds or removes from the prediction")
+    parser.add_argument('--intervals', action='store_true',
+                        help="add the 10th-90th percentile of the per-tree predictions and a low-confidence flag")
+    parser.add_argument('--low-confidence-width', type=float, default=LOW_CONFIDENCE_WIDTH,
+                        help="interval width in hours above which a prediction is flagged")
+    args = parser.parse_args(argv)
+
+    table = open_table(args.table, model_path=args.model) if args.table else None
+    scored, report = score(args.input, chunk_size=args.chunk_size, table=table, model_path=args.model,
+                           with_explanations=args.explain, with_attributions=args.attributions,
+                           with_intervals=args.intervals, low_confidence_width=args.low_confidence_width)
+    if args.output:
+        write_predictions(scored, args.output)
+    else:
+        print(scored.to_string(index=False))
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""Benchmarks for the prediction path, with a JSON baseline to catch regressions.
+
+Usage::
+
+    python -m sleep_analyzer.bench -o bench.json                      # record a baseline
+    python -m sleep_analyzer.bench --baseline bench.json               # exits 1 on a regression
+
+Every benchmark runs on profiles drawn with a fixed seed from the survey's
+answer sets (``random_profiles``), so two runs on one machine measure the
+same work:
+
+* ``load_*`` - unpickling ``sleep_model.pkl``, mapping the exported
+  ``sleep_model.flat`` and building a ``ModelRegistry``.
+* ``features_*`` - one profile through the app's original per-row DataFrame
+  code (``dataframe_features``), through ``SleepFeatureTransformer`` and
+  through ``FlatForest.encode_profile``; plus the per-row cost of encoding a
+  whole batch.
+* ``predict_*`` - ``model.predict`` and the flat kernel on one row and on a
+  batch (per row), and a prediction-table lookup.
+* ``app_*`` - a plain rerun and a prediction submit of ``app.py`` under
+  Streamlit's ``AppTest``, after a warm-up run.
+
+Each result holds the median, minimum and p95 of ``repeat`` timings in
+seconds per call (or per row for batches). Runs are compared on the minimum,
+which background load disturbs least: one more than ``tolerance`` slower
+than the baseline's fails the run. Results only mean something against a
+baseline recorded on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+from sleep_analyzer.features import MODEL_COLUMNS, RAW_COLUMNS, SleepFeatureTransformer, random_profiles
+from sleep_analyzer.forest import DEFAULT_EXPORT_PATH, FlatForest
+from sleep_analyzer.lookup import open_table
+from sleep_analyzer.registry import ModelRegistry
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_MODEL_PATH = ROOT / 'sleep_model.pkl'
+DEFAULT_APP_PATH = ROOT / 'app.py'
+DEFAULT_SEED = 42
+DEFAULT_ROWS = 10_000
+DEFAULT_REPEAT = 7
+DEFAULT_TOLERANCE = 0.25
+GROUPS = ('load', 'features', 'predict', 'app')
+
+
+# The original app.py's lookups, copied unchanged (exercise and '2hrs' differ from features.py)
+_ORIGINAL_MEAL_MAPPING = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'more than 5': 6}
+_ORIGINAL_EXERCISE_MAPPING = {'no': 0, 'sometimes': 0.5, 'yes': 1}
+
+
+def _original_screen_time(value):
+    if value == '0-1 hrs':
+        return 0.5
+    elif value == '1-2 hrs':
+        return 1.5
+    elif value == '2-3 hrs':
+        return 2.5
+    elif value == '3-4 hrs':
+        return 3.5
+    elif value == '4-5 hrs':
+        return 4.5
+    else:  # 'more than 5'
+        return 5.5
+
+
+def dataframe_features(profile):
+    """The original app.py feature code: a one-row DataFrame built and mapped column by column.
+
+    Copied with its own lookups rather than the ``features`` mappings, so it
+    measures what the app did before (its values are not the model's). Kept
+    as the reference the vectorized paths are measured against.
+    """
+    input_data = pd.DataFrame(dict({column: [profile[column]] for column in RAW_COLUMNS},
+                                   screen_time_numeric=[0], meals_numeric=[0], exercise_numeric=[0],
+                                   screen_exercise_interaction=[0], meals_screen_interaction=[0]))
+    input_data['screen_time_numeric'] = input_data['screen time'].apply(lambda x: _original_screen_time(x))
+    input_data['meals_numeric'] = input_data['meals/day'].map(_ORIGINAL_MEAL_MAPPING)
+    input_data['physical illness'] = input_data['physical illness'].map({'yes': 1, 'no': 0})
+    input_data['bluelight filter'] = input_data['bluelight filter'].map({'yes': 1, 'no': 0})
+    input_data['smoke/drink'] = input_data['smoke/drink'].map({'yes': 1, 'no': 0})
+    input_data['exercise_numeric'] = input_data['exercise'].map(_ORIGINAL_EXERCISE_MAPPING)
+    input_data['screen_exercise_interaction'] = input_data['screen_time_numeric'] * input_data['exercise_numeric']
+    input_data['meals_screen_interaction'] = input_data['meals_numeric'] * input_data['screen_time_numeric']
+    return input_data[MODEL_COLUMNS]
+
+
+def measure(func, repeat=DEFAULT_REPEAT, number=1, per=1):
+    """Time ``func()`` ``repeat`` times (``number`` calls each); returns seconds per call divided by ``per``."""
+    func()   # warm-up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number / per)
+    timings = np.asarray(timings)
+    return {'median': float(np.median(timings)), 'min': float(timings.min()),
+            'p95': float(np.percentile(timings, 95)), 'repeat': repeat, 'number': number}
+
+
+def autorange(func, target=0.05):
+    """How many calls of ``func`` take about ``target`` seconds, so fast calls are timed in loops."""
+    start = time.perf_counter()
+    func()
+    once = max(time.perf_counter() - start, 1e-7)
+    return max(1, int(target / once))
+
+
+def load_benchmarks(model_path, repeat, flat_path=DEFAULT_EXPORT_PATH):
+    results = {'load_pickle': measure(lambda: joblib.load(model_path), repeat=repeat)}
+    if Path(flat_path).exists():
+        results['load_flat'] = measure(lambda: FlatForest.load(flat_path), repeat=repeat)
+    results['load_registry'] = measure(lambda: ModelRegistry(model_path, flat_path=flat_path), repeat=repeat)
+    return results
+
+
+def feature_benchmarks(profiles, flat, repeat):
+    records = profiles.to_dict('records')
+    profile = records[0]
+    transformer = SleepFeatureTransformer().fit()
+    single = {
+        'features_dataframe_row': lambda: dataframe_features(profile),
+        'features_transformer_row': lambda: transformer.transform(pd.DataFrame([profile], columns=RAW_COLUMNS)),
+        'features_profile_row': lambda: flat.encode_profile(profile),
+    }
+    results = {name: measure(func, repeat=repeat, number=autorange(func)) for name, func in single.items()}
+    n = len(profiles)
+    results['features_batch_per_row'] = measure(lambda: flat.encode(profiles), repeat=repeat, per=n)
+    return results
+
+
+def predict_benchmarks(profiles, model, flat, table, repeat):
+    one = profiles.iloc[:1]
+    profile = one.to_dict('records')[0]
+    x = flat.encode_profile(profile)
+    n = len(profiles)
+    single = {
+        'predict_model_row': lambda: model.predict(one),
+        'predict_flat_row': lambda: flat.predict_vector(x),
+    }
+    if table is not None:
+        single['predict_table_row'] = lambda: table.lookup(profile)
+    results = {name: measure(func, repeat=repeat, number=autorange(func)) for name, func in single.items()}
+    results['predict_model_batch_per_row'] = measure(lambda: model.predict(profiles), repeat=repeat, per=n)
+    results['predict_flat_batch_per_row'] = measure(lambda: flat.predict(profiles), repeat=repeat, per=n)
+    return results
+
+
+@contextmanager
+def _app_environment():
+    """Run the app from the repo root against a throwaway sleep log, without touching the real one."""
+    cwd = os.getcwd()
+    saved = {name: os.environ.get(name) for name in ('SLEEP_ANALYZER_SLEEP_LOG', 'SLEEP_ANALYZER_PROGRESS')}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['SLEEP_ANALYZER_SLEEP_LOG'] = str(Path(tmp) / 'sleep_log.db')
+        os.environ['SLEEP_ANALYZER_PROGRESS'] = '0'
+        os.chdir(ROOT)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def _fill_form(at):
+    """Re-select the default options of widgets with a ``format_func``.
+
+    Streamlit 1.32's ``AppTest`` serializes these by their formatted label
+    and fails to find the index again on the next run; setting the raw
+    option works around it.
+    """
+    for slider in at.select_slider:
+        slider.set_value(slider.value if slider.value in slider.options else slider.options[0])
+    for box in at.selectbox:
+        try:
+            box.index
+        except ValueError:
+            box.set_value(box.options[box.proto.default])
+
+
+def app_benchmarks(app_path, repeat):
+    from streamlit.testing.v1 import AppTest
+
+    with _app_environment():
+        at = AppTest.from_file(str(app_path), default_timeout=120)
+
+        def rerun():
+            _fill_form(at)
+            at.run()
+            if at.exception:
+                raise RuntimeError(f"app raised: {at.exception[0].message}")
+
+        def submit():
+            _fill_form(at)
+            at.button[0].click()
+            at.run()
+            if at.exception:
+                raise RuntimeError(f"app raised: {at.exception[0].message}")
+
+        started = time.perf_counter()
+        at.run()
+        cold = time.perf_counter() - started
+        results = {'app_rerun': measure(rerun, repeat=repeat), 'app_submit': measure(submit, repeat=repeat)}
+    results['app_first_run'] = {'median': cold, 'min': cold, 'p95': cold, 'repeat': 1, 'number': 1}
+    return results
+
+
+def run(groups=GROUPS, rows=DEFAULT_ROWS, seed=DEFAULT_SEED, repeat=DEFAULT_REPEAT, model_path=DEFAULT_MODEL_PATH,
+        app_path=DEFAULT_APP_PATH):
+    """Run the selected benchmark groups; returns ``{'meta': {...}, 'results': {name: timing}}``."""
+    profiles = random_profiles(np.random.default_rng(seed), rows)
+    results = {}
+    if 'load' in groups:
+        results.update(load_benchmarks(model_path, repeat))
+    if 'features' in groups or 'predict' in groups:
+        model = joblib.load(model_path)
+        flat = FlatForest.from_pipeline(model)
+        if 'features' in groups:
+            results.update(feature_benchmarks(profiles, flat, repeat))
+        if 'predict' in groups:
+            results.update(predict_benchmarks(profiles, model, flat, open_table(model_path=model_path), repeat))
+    if 'app' in groups:
+        results.update(app_benchmarks(app_path, repeat))
+    meta = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'rows': rows,
+        'seed': seed,
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'machine': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """``[(name, baseline, current, ratio, regressed), ...]`` for benchmarks present in both runs."""
+    rows = []
+    for name, timing in results['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        ratio = timing['min'] / previous['min'] if previous['min'] > 0 else float('inf')
+        rows.append((name, previous['min'], timing['min'], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def _format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model loading, feature building, prediction and the app.")
+    parser.add_argument('-o', '--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="results JSON to compare against; exits 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown of a best time before it counts as a regression (0.25 = 25%%)")
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=list(GROUPS), help="benchmark groups to run")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="synthetic profiles in a batch")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="timings per benchmark")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="path to the pickled model pipeline")
+    args = parser.parse_args(argv)
+
+    report = run(args.only, rows=args.rows, seed=args.seed, repeat=args.repeat, model_path=args.model)
+    for name, timing in report['results'].items():
+        print(f"{name:<30} {_format_seconds(timing['min']):>10}  (median {_format_seconds(timing['median'])})")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = []
+        print(f"\ncompared with {args.baseline} ({baseline['meta']['created']}):")
+        for name, before, after, ratio, regressed in compare(report, baseline, args.tolerance):
+            print(f"{name:<30} {_format_seconds(before):>10} -> {_format_seconds(after):>10}  {ratio:5.2f}x"
+                  f"{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(name)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}: "
+                  f"{', '.join(regressions)}", file=sys.stderr)
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
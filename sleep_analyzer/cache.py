@@ -0,0 +1,171 @@
+"""Bounded LRU/TTL cache of predictions keyed on the normalized input profile.
+
+Each entry is a ``(prediction, lower, upper)`` tuple: the prediction and the
+interval from the same walk of the trees, so a hit needs no model at all.
+
+One ``PredictionCache`` lives per server process and is shared by every
+session. Entries are keyed on ``canonical_profile`` (so the screen-time
+slider is already bucketed and aliases are resolved) and are only valid for
+the model version they were computed with: the first lookup made with a new
+model hash drops everything cached for the old one in memory.
+
+With ``path`` set, entries are also written to a small SQLite file so a
+restarted process starts warm. Several processes may share the file while a
+new model rolls out, so on disk a process only drops the rows of versions
+first seen before its own (the ``versions`` table records when each model
+hash was first seen); a process still on the old model leaves the new model's
+rows alone. Expired and superseded rows are deleted when the version changes
+and at most once every ``PURGE_INTERVAL`` seconds as entries are written, so
+the file stays bounded by what is still live. ``stats()`` reports hits,
+misses and evictions for sizing ``maxsize``.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sleep_analyzer.features import canonical_profile
+
+# PRAGMA user_version of the on-disk store; a file with another version is cleared
+SCHEMA_VERSION = 2
+# Seconds between sweeps of expired rows from the on-disk store
+PURGE_INTERVAL = 60.0
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with per-entry expiry and optional on-disk backing."""
+
+    def __init__(self, maxsize=10_000, ttl=3600.0, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self._entries = OrderedDict()   # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+        self._db = None
+        self._purged_at = 0.0
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                # Files from before intervals were cached hold bare predictions; they are only a cache
+                self._db.execute("DROP TABLE IF EXISTS predictions")
+                self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions "
+                             "(version TEXT, key TEXT, prediction REAL, lower REAL, upper REAL, expires_at REAL, "
+                             "PRIMARY KEY (version, key))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS versions (version TEXT PRIMARY KEY, first_seen REAL)")
+
+    def get(self, version, profile):
+        """Return the cached ``(prediction, lower, upper)`` for ``profile`` under model ``version``, or ``None``."""
+        key = canonical_profile(profile)
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                self._insert(key, entry)
+                self._stats.hits += 1
+                return entry[0]
+            self._stats.misses += 1
+            return None
+
+    def put(self, version, profile, value):
+        """Cache ``value``, a ``(prediction, lower, upper)`` tuple, for ``profile``."""
+        key = canonical_profile(profile)
+        entry = (tuple(float(v) for v in value), time.time() + self.ttl)
+        with self._lock:
+            self._check_version(version)
+            self._insert(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+                                 (self.version, json.dumps(key), *entry[0], entry[1]))
+                now = time.time()
+                if now - self._purged_at >= PURGE_INTERVAL:
+                    self._purge(now)
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(self._stats.hits, self._stats.misses, self._stats.evictions, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.execute("DELETE FROM versions")
+
+    def _check_version(self, version):
+        """Drop what was computed with another model version (caller holds the lock).
+
+        Memory holds this process's entries only and is cleared. On disk only
+        versions first seen before ``version`` are dropped: they are the ones
+        being replaced.
+        """
+        if version == self.version:
+            return
+        self._entries.clear()
+        self.version = version
+        if self._db is not None:
+            self._db.execute("INSERT OR IGNORE INTO versions VALUES (?, ?)", (version, time.time()))
+            self._purge(time.time())
+
+    def _purge(self, now):
+        """Delete expired rows and rows of versions older than this one from the on-disk store.
+
+        ``versions`` keeps every hash ever seen, so a process still on the old
+        model cannot re-register it as newer than its replacement.
+        """
+        self._db.execute("DELETE FROM predictions WHERE expires_at <= ? OR version IN "
+                         "(SELECT version FROM versions "
+                         "WHERE first_seen < (SELECT first_seen FROM versions WHERE version = ?))",
+                         (now, self.version))
+        self._purged_at = now
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._stats.evictions += 1
+
+    def _disk_get(self, key, now):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT prediction, lower, upper, expires_at FROM predictions "
+                               "WHERE version = ? AND key = ?", (self.version, json.dumps(key))).fetchone()
+        if row is None or row[3] <= now:
+            return None
+        return row[:3], row[3]
+
+
+def cache_from_env():
+    """Build the process cache from ``SLEEP_ANALYZER_PREDICTION_CACHE*`` settings."""
+    return PredictionCache(
+        maxsize=int(os.environ.get('SLEEP_ANALYZER_PREDICTION_CACHE_SIZE', 10_000)),
+        ttl=float(os.environ.get('SLEEP_ANALYZER_PREDICTION_CACHE_TTL', 3600)),
+        path=os.environ.get('SLEEP_ANALYZER_PREDICTION_CACHE') or None,
+    )
@@ -0,0 +1,63 @@
+"""Chart data for the Track Progress tab, bounded to a fixed number of points.
+
+``chart_series`` turns sleep-log entries into one series per resolution
+(daily values, weekly and monthly means) on a ``DatetimeIndex`` and
+downsamples any series longer than the point budget with
+Largest-Triangle-Three-Buckets, which keeps the peaks and dips a plain
+stride would skip. The browser then receives at most ``POINT_BUDGET`` points
+however long the history is; callers cache the result per user, range and
+``SleepLog.revision`` so it is only rebuilt when entries change.
+"""
+import numpy as np
+import pandas as pd
+
+POINT_BUDGET = 400
+RESOLUTIONS = {'daily': None, 'weekly': 'W', 'monthly': 'MS'}
+
+
+def lttb(x, y, threshold):
+    """Indices of the ``threshold`` points LTTB keeps from the series ``(x, y)``."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket edges for the interior points; first and last points are always kept
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def to_series(entries, column='hours'):
+    """``entries[column]`` on a sorted ``DatetimeIndex`` (dates parsed once, here)."""
+    index = pd.DatetimeIndex(pd.to_datetime(entries['date'], format='%Y-%m-%d'), name='date')
+    series = pd.Series(entries[column].to_numpy(dtype=float), index=index, name=column)
+    return series if index.is_monotonic_increasing else series.sort_index()
+
+
+def rollups(series):
+    """The series at every resolution in ``RESOLUTIONS``; empty periods are left out."""
+    return {name: series if freq is None else series.resample(freq).mean().dropna()
+            for name, freq in RESOLUTIONS.items()}
+
+
+def downsample(series, budget=POINT_BUDGET):
+    if len(series) <= budget:
+        return series
+    days = series.index.asi8 / 86_400e9
+    return series.iloc[lttb(days, series.to_numpy(), budget)]
+
+
+def chart_series(entries, column='hours', budget=POINT_BUDGET):
+    """``{resolution: series}`` ready to plot, each at most ``budget`` points long."""
+    return {name: downsample(series, budget) for name, series in rollups(to_series(entries, column)).items()}
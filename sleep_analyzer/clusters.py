@@ -0,0 +1,181 @@
+"""Sleep-pattern clusters: fitted offline, assigned at request time by nearest centroid.
+
+Usage::
+
+    python -m sleep_analyzer.clusters sweep               # inertia/silhouette for k = 1..10
+    python -m sleep_analyzer.clusters fit --k 3           # writes sleep_clusters.npz
+
+The k-sweep fits every candidate in parallel worker processes and scores
+silhouettes on a fixed-size sample, so it stays cheap on large surveys;
+``--minibatch`` switches to ``MiniBatchKMeans`` for those. ``fit`` stores the
+scaler, the centroids and each cluster's mean profile as plain arrays.
+``ClusterModel.assign`` is then a scale and an argmin over a handful of
+centroids, with no fitting or unpickling in the app; sklearn is only imported
+by the functions that fit.
+
+Clusters use ``CLUSTER_FEATURES`` (the notebook's choice); the app passes the
+predicted sleep time where the survey has the measured one.
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sleep_analyzer.features import RAW_COLUMNS
+from sleep_analyzer.rules import rule_inputs
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_DATA_PATH = ROOT / 'Sleep_Analysis.csv'
+DEFAULT_CLUSTERS_PATH = ROOT / 'sleep_clusters.npz'
+CLUSTER_FEATURES = ['screen_time_numeric', 'exercise_numeric', 'meals_numeric', 'sleep time']
+DEFAULT_SEED = 42
+SILHOUETTE_SAMPLE = 10_000
+# Above this many rows the sweep and fit default to MiniBatchKMeans
+MINIBATCH_ROWS = 100_000
+
+
+def cluster_matrix(inputs, features=CLUSTER_FEATURES):
+    """Float matrix of ``features`` from a frame or a dict of arrays."""
+    return np.column_stack([np.asarray(inputs[feature], dtype=float) for feature in features])
+
+
+def survey_inputs(data):
+    """Cluster inputs for raw survey rows with their measured ``sleep time``."""
+    return rule_inputs(data[RAW_COLUMNS], sleep_time=data['sleep time'])
+
+
+def _estimator(k, seed, minibatch):
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if minibatch:
+        return MiniBatchKMeans(n_clusters=k, random_state=seed, batch_size=4096, n_init=3)
+    return KMeans(n_clusters=k, random_state=seed, n_init='auto')
+
+
+def _fit_one(scaled, k, seed, minibatch, sample):
+    from sklearn.metrics import silhouette_score
+
+    kmeans = _estimator(k, seed, minibatch).fit(scaled)
+    score = None
+    if k > 1:
+        score = silhouette_score(scaled, kmeans.labels_, sample_size=min(sample, len(scaled)), random_state=seed)
+    return {'k': k, 'inertia': float(kmeans.inertia_), 'silhouette': score}
+
+
+def sweep(inputs, ks=range(1, 11), seed=DEFAULT_SEED, minibatch=None, n_jobs=-1, sample=SILHOUETTE_SAMPLE):
+    """Fit every ``k`` in parallel; returns ``[{'k', 'inertia', 'silhouette'}, ...]`` in ``ks`` order."""
+    from joblib import Parallel, delayed
+    from sklearn.preprocessing import StandardScaler
+
+    scaled = StandardScaler().fit_transform(cluster_matrix(inputs))
+    if minibatch is None:
+        minibatch = len(scaled) > MINIBATCH_ROWS
+    return Parallel(n_jobs=n_jobs)(delayed(_fit_one)(scaled, k, seed, minibatch, sample) for k in ks)
+
+
+class ClusterModel:
+    """Scaler, centroids and per-cluster mean profiles, as arrays."""
+
+    def __init__(self, mean, scale, centroids, profiles, sizes, features=CLUSTER_FEATURES):
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.centroids = np.asarray(centroids, dtype=float)
+        self.profiles = np.asarray(profiles, dtype=float)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.features = list(features)
+
+    @property
+    def k(self):
+        return len(self.centroids)
+
+    def assign(self, inputs):
+        """Nearest-centroid cluster of each row of ``inputs`` (a frame or a dict of arrays)."""
+        scaled = (cluster_matrix(inputs, self.features) - self.mean) / self.scale
+        distances = ((scaled[:, None, :] - self.centroids[None, :, :]) ** 2).sum(axis=2)
+        return distances.argmin(axis=1)
+
+    def profile(self, cluster):
+        """``{feature: mean}`` of one cluster, in original units."""
+        return dict(zip(self.features, self.profiles[cluster]))
+
+    def best_cluster(self):
+        """The cluster with the longest average sleep."""
+        return int(self.profiles[:, self.features.index('sleep time')].argmax())
+
+    def advice(self, inputs, cluster):
+        """Messages comparing a user's habits with the best-sleeping cluster's averages."""
+        best = self.profile(self.best_cluster())
+        user = {feature: float(np.asarray(inputs[feature])[0]) for feature in self.features}
+        messages = []
+        if user['screen_time_numeric'] > best['screen_time_numeric'] + 0.5:
+            messages.append(f"The best-sleeping group averages {best['screen_time_numeric']:.1f} hours of screen time "
+                            f"before bed, {user['screen_time_numeric'] - best['screen_time_numeric']:.1f} less than you.")
+        if user['exercise_numeric'] < best['exercise_numeric'] - 0.5:
+            messages.append("People in the best-sleeping group exercise more often than you do.")
+        if abs(user['meals_numeric'] - best['meals_numeric']) > 0.75:
+            messages.append(f"The best-sleeping group eats {best['meals_numeric']:.1f} meals a day on average.")
+        if cluster == self.best_cluster() and not messages:
+            messages.append("Your habits match the group that sleeps the longest.")
+        return messages
+
+    def save(self, path=DEFAULT_CLUSTERS_PATH):
+        np.savez(path, mean=self.mean, scale=self.scale, centroids=self.centroids, profiles=self.profiles,
+                 sizes=self.sizes, features=np.asarray(self.features))
+
+    @classmethod
+    def load(cls, path=DEFAULT_CLUSTERS_PATH):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays['mean'], arrays['scale'], arrays['centroids'], arrays['profiles'], arrays['sizes'],
+                       features=arrays['features'].tolist())
+
+
+def fit_clusters(inputs, k=3, seed=DEFAULT_SEED, minibatch=None):
+    """Fit the scaler and ``k`` clusters on cluster inputs; returns a ``ClusterModel``."""
+    from sklearn.preprocessing import StandardScaler
+
+    X = cluster_matrix(inputs)
+    scaler = StandardScaler().fit(X)
+    if minibatch is None:
+        minibatch = len(X) > MINIBATCH_ROWS
+    kmeans = _estimator(k, seed, minibatch).fit(scaler.transform(X))
+    labels = kmeans.labels_
+    profiles = np.array([X[labels == cluster].mean(axis=0) for cluster in range(k)])
+    sizes = np.bincount(labels, minlength=k)
+    return ClusterModel(scaler.mean_, scaler.scale_, kmeans.cluster_centers_, profiles, sizes)
+
+
+def open_clusters(path=DEFAULT_CLUSTERS_PATH):
+    """Load the cluster model if it has been fitted, else return ``None``."""
+    return ClusterModel.load(path) if Path(path).exists() else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit sleep-pattern clusters on the survey.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('sweep', "inertia and silhouette for a range of k"), ('fit', "fit and save clusters")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument('--data', default=DEFAULT_DATA_PATH, help="survey CSV with a 'sleep time' column")
+        command.add_argument('--seed', type=int, default=DEFAULT_SEED)
+        command.add_argument('--minibatch', action='store_true', default=None,
+                             help=f"use MiniBatchKMeans (default above {MINIBATCH_ROWS:,} rows)")
+    sub.choices['sweep'].add_argument('--max-k', type=int, default=10)
+    sub.choices['sweep'].add_argument('--n-jobs', type=int, default=-1, help="parallel fits")
+    sub.choices['fit'].add_argument('--k', type=int, default=3)
+    sub.choices['fit'].add_argument('-o', '--output', default=DEFAULT_CLUSTERS_PATH)
+    args = parser.parse_args(argv)
+
+    inputs = survey_inputs(pd.read_csv(args.data))
+    if args.command == 'sweep':
+        for result in sweep(inputs, range(1, args.max_k + 1), seed=args.seed, minibatch=args.minibatch,
+                            n_jobs=args.n_jobs):
+            silhouette = f"{result['silhouette']:.3f}" if result['silhouette'] is not None else '-'
+            print(f"k={result['k']:>2}  inertia {result['inertia']:12.2f}  silhouette {silhouette}")
+    else:
+        model = fit_clusters(inputs, args.k, seed=args.seed, minibatch=args.minibatch)
+        model.save(args.output)
+        print(f"wrote {model.k} clusters (sizes {model.sizes.tolist()}) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
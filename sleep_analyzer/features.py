@@ -0,0 +1,202 @@
+"""Feature engineering for raw survey rows (the ``Sleep_Analysis.csv`` schema).
+
+This module is the single definition of how survey answers become model
+features. ``SleepFeatureTransformer`` is the first step of the pipeline in
+``sleep_model.pkl``, so the notebook, the app and the batch scorer all feed
+raw answers to the model and share the same lookups.
+
+Nothing here imports sklearn: the transformer class lives in
+``sleep_analyzer.transformer`` and is only imported when it is first
+accessed through this module (as unpickling the model does).
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Columns of a raw survey row, in Sleep_Analysis.csv order (without the target)
+RAW_COLUMNS = ['Age', 'Gender', 'meals/day', 'physical illness', 'screen time',
+               'bluelight filter', 'sleep direction', 'exercise', 'smoke/drink', 'beverage']
+
+# Columns the preprocessor expects, in training order
+MODEL_COLUMNS = ['Age', 'Gender', 'meals_numeric', 'physical illness', 'screen_time_numeric',
+                 'bluelight filter', 'sleep direction', 'exercise_numeric', 'smoke/drink',
+                 'beverage', 'screen_exercise_interaction', 'meals_screen_interaction']
+
+screen_time_mapping = {
+    '0-1 hrs': 0.5,
+    '1-2 hrs': 1.5,
+    '2hrs': 2.0,
+    '2-3 hrs': 2.5,
+    '3-4 hrs': 3.5,
+    '4-5 hrs': 4.5,
+    'more than 5': 6.0
+}
+
+meal_mapping = {
+    'one': 1,
+    'two': 2,
+    'three': 3,
+    'four': 4,
+    'five': 5,
+    'more than 5': 6
+}
+
+exercise_mapping = {
+    'no': 0,
+    'sometimes': 1,
+    'yes': 2
+}
+
+binary_mapping = {'yes': 1, 'no': 0}
+
+# Raw column -> (engineered column, mapping to numbers)
+NUMERIC_LOOKUPS = {
+    'meals/day': ('meals_numeric', meal_mapping),
+    'physical illness': ('physical illness', binary_mapping),
+    'screen time': ('screen_time_numeric', screen_time_mapping),
+    'bluelight filter': ('bluelight filter', binary_mapping),
+    'exercise': ('exercise_numeric', exercise_mapping),
+    'smoke/drink': ('smoke/drink', binary_mapping),
+}
+
+# Raw columns passed through as strings for the one-hot encoder
+CATEGORICAL_COLUMNS = ['Gender', 'sleep direction', 'beverage']
+
+# Survey answers that mean the same thing as a category the model knows
+category_aliases = {'Gender': {'Prefer not to say': 'Other'}}
+
+# Every answer the survey and the app form accept for each categorical field
+field_values = {
+    'Gender': ['Female', 'Male', 'Other'],
+    'meals/day': list(meal_mapping),
+    'physical illness': list(binary_mapping),
+    'screen time': list(screen_time_mapping),
+    'bluelight filter': list(binary_mapping),
+    'sleep direction': ['east', 'north', 'south', 'west'],
+    'exercise': list(exercise_mapping),
+    'smoke/drink': list(binary_mapping),
+    'beverage': ['Coffee', 'Tea', 'Tea and Coffee both', 'none of the above'],
+}
+
+# How each raw field is named to users
+field_labels = {
+    'Age': "Age",
+    'Gender': "Gender",
+    'meals/day': "Meals per day",
+    'physical illness': "Physical illness",
+    'screen time': "Screen time",
+    'bluelight filter': "Blue light filter",
+    'sleep direction': "Sleep direction",
+    'exercise': "Exercise",
+    'smoke/drink': "Smoking/drinking",
+    'beverage': "Beverage",
+}
+
+# Ages the app form accepts (inclusive)
+age_range = (18, 100)
+
+# Slider upper bounds (hours) for each screen-time bucket the form can produce
+screen_time_buckets = [
+    (1.0, '0-1 hrs'),
+    (2.0, '1-2 hrs'),
+    (3.0, '2-3 hrs'),
+    (4.0, '3-4 hrs'),
+    (5.0, '4-5 hrs'),
+]
+
+
+def screen_time_category(hours):
+    """Bucket the app's screen-time slider value into a survey answer."""
+    for upper, label in screen_time_buckets:
+        if hours <= upper:
+            return label
+    return 'more than 5'
+
+
+def random_profiles(rng, n, max_age=60):
+    """``n`` raw survey rows drawn uniformly from ``field_values`` (ages ``age_range[0]`` to ``max_age - 1``)."""
+    rows = pd.DataFrame({column: rng.choice(field_values[column], n) for column in RAW_COLUMNS[1:]})
+    rows.insert(0, 'Age', rng.integers(age_range[0], max_age, n))
+    return rows
+
+
+def canonical_profile(profile):
+    """Normalize a raw profile dict into a hashable tuple in ``RAW_COLUMNS`` order.
+
+    Aliased answers collapse onto the category the model knows and whole
+    ages become ints, so equivalent profiles share one key.
+    """
+    values = []
+    for column in RAW_COLUMNS:
+        value = profile[column]
+        value = category_aliases.get(column, {}).get(value, value)
+        if column == 'Age':
+            value = float(value)
+            value = int(value) if value.is_integer() else value
+        values.append(value)
+    return tuple(values)
+
+
+def compile_lookup(mapping):
+    """Compile a ``{answer: number}`` dict into ``(keys, values)`` arrays.
+
+    ``values`` has one extra trailing NaN so that the ``-1`` code pandas
+    returns for unknown answers gathers a missing value for the imputer.
+    """
+    keys = pd.Index(list(mapping), dtype=object)
+    values = np.append(np.asarray(list(mapping.values()), dtype=float), np.nan)
+    return keys, values
+
+
+def add_interactions(columns):
+    """Add the interaction terms to a dict of numeric columns (arrays or scalars)."""
+    columns['screen_exercise_interaction'] = columns['screen_time_numeric'] * columns['exercise_numeric']
+    columns['meals_screen_interaction'] = columns['meals_numeric'] * columns['screen_time_numeric']
+    return columns
+
+
+def compile_lookups():
+    """``{raw column: (keys, values)}`` for every column in ``NUMERIC_LOOKUPS``."""
+    return {column: compile_lookup(mapping) for column, (_, mapping) in NUMERIC_LOOKUPS.items()}
+
+
+@lru_cache(maxsize=1)
+def _default_lookups():
+    return compile_lookups()
+
+
+def transform_features(X, lookups):
+    """Turn raw survey rows into the frame the model's preprocessor expects.
+
+    With the answer mappings compiled into integer-indexed arrays this is one
+    hash lookup and one array gather per column plus two multiplies for the
+    interaction terms.
+    """
+    X = pd.DataFrame(X, columns=RAW_COLUMNS) if not isinstance(X, pd.DataFrame) else X
+
+    columns = {'Age': pd.to_numeric(X['Age'], errors='coerce').to_numpy(dtype=float)}
+    for column, (name, _) in NUMERIC_LOOKUPS.items():
+        keys, values = lookups[column]
+        columns[name] = values[keys.get_indexer(X[column])]
+    for column in CATEGORICAL_COLUMNS:
+        values = X[column]
+        if column in category_aliases:
+            values = values.replace(category_aliases[column])
+        columns[column] = values.to_numpy(dtype=object)
+
+    add_interactions(columns)
+    return pd.DataFrame(columns, index=X.index, columns=MODEL_COLUMNS)
+
+
+def engineer_features(data):
+    """Build the preprocessor's input frame from raw survey rows."""
+    return transform_features(data, _default_lookups())
+
+
+def __getattr__(name):
+    # The sklearn transformer is imported on first use only; pickled models refer to it by this module
+    if name == 'SleepFeatureTransformer':
+        from sleep_analyzer.transformer import SleepFeatureTransformer
+        return SleepFeatureTransformer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,367 @@
+"""Flat array-based inference for the RandomForest pipeline in ``sleep_model.pkl``.
+
+``FlatForest.from_pipeline`` compiles the fitted pipeline into plain NumPy
+arrays: the feature lookups, the imputer fill values, the one-hot categories
+and every tree's nodes concatenated into contiguous ``feature``,
+``threshold``, ``left``, ``right`` and ``value`` arrays. Prediction then walks
+all trees for a whole batch at once, one vectorized step per tree level, with
+no per-estimator dispatch or input validation.
+
+The kernel reproduces ``model.predict`` bit for bit: inputs are compared in
+float32 like sklearn's trees do, and per-tree outputs are summed in estimator
+order before dividing by the number of trees.
+
+The ``predict_interval*`` methods return the same prediction together with
+quantiles of the per-tree predictions (``DEFAULT_QUANTILES``, an 80%
+interval), taken from the leaf values of the one walk through the trees.
+With 46 training rows the trees often disagree, and an interval wider than
+``LOW_CONFIDENCE_WIDTH`` hours marks a prediction as low-confidence. The
+spread measures how much the trees disagree. It does not promise how often
+the true sleep time falls inside it. ::
+
+    python -m sleep_analyzer.forest export
+
+The export is a ``modelfile`` (a JSON header plus raw arrays) recording the
+SHA-256 of the pickle it came from. ``FlatForest.load`` memory-maps it
+without unpickling anything, so a server can start from it in a few
+milliseconds and without the sklearn version the pickle needs.
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sleep_analyzer import modelfile
+from sleep_analyzer.features import (
+    CATEGORICAL_COLUMNS, NUMERIC_LOOKUPS, RAW_COLUMNS, add_interactions, category_aliases, random_profiles,
+    transform_features,
+)
+from sleep_analyzer.lookup import file_digest
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_MODEL_PATH = ROOT / 'sleep_model.pkl'
+DEFAULT_DATA_PATH = ROOT / 'Sleep_Analysis.csv'
+DEFAULT_EXPORT_PATH = ROOT / 'sleep_model.flat'
+
+# Rows walked through the trees at once; bounds the (trees x rows) work arrays
+BLOCK_SIZE = 8192
+# Quantiles of the per-tree predictions reported as the prediction interval
+DEFAULT_QUANTILES = (0.1, 0.9)
+# Intervals wider than this many hours are flagged as low-confidence
+LOW_CONFIDENCE_WIDTH = 3.0
+# Random survey rows ``verify`` checks when no data is given
+VERIFY_SAMPLE_SIZE = 500
+
+
+def float32_floor(threshold):
+    """Round float64 thresholds down to float32.
+
+    sklearn compares float32 inputs against float64 thresholds; for a float32
+    ``x``, ``x <= t`` holds exactly when ``x <= float32_floor(t)``, so the
+    walk can stay in float32 without changing a single split.
+    """
+    rounded = threshold.astype(np.float32)
+    too_high = rounded.astype(np.float64) > threshold
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+def flatten_trees(estimators):
+    """Concatenate fitted sklearn trees into flat node arrays.
+
+    Leaves point to themselves and test feature 0, so a walk of ``depth``
+    steps from the roots ends on every tree's leaf without masking. Indices
+    are stored as ``intp`` so the arrays can be used (or memory-mapped) as is.
+    """
+    feature, threshold, left, right, value, cover, roots = [], [], [], [], [], [], []
+    offset = 0
+    depth = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+        roots.append(offset)
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+        right.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+        value.append(tree.value[:, 0, 0])
+        cover.append(tree.weighted_n_node_samples)
+        depth = max(depth, tree.max_depth)
+        offset += tree.node_count
+    left = np.concatenate(left).astype(np.intp)
+    right = np.concatenate(right).astype(np.intp)
+    threshold = np.concatenate(threshold).astype(np.float64)
+    return {
+        'feature': np.concatenate(feature).astype(np.intp),
+        'threshold': threshold,
+        'threshold32': float32_floor(threshold),
+        'left': left,
+        'right': right,
+        # Children interleaved so a step is children[2 * node + goes_right]
+        'children': np.stack([left, right], axis=1).reshape(-1),
+        'value': np.concatenate(value).astype(np.float64),
+        # Training weight reaching each node, for tree path attributions (``sleep_analyzer.explain``)
+        'cover': np.concatenate(cover).astype(np.float64),
+        'roots': np.asarray(roots, dtype=np.intp),
+        'depth': np.int32(depth),
+    }
+
+
+def compile_preprocessing(features, preprocessor):
+    """Pull the fitted lookups, fill values and categories out of the pipeline."""
+    transformers = {name: (steps, columns) for name, steps, columns in preprocessor.transformers_
+                    if name != 'remainder'}
+    if set(transformers) != {'num', 'cat'}:
+        raise ValueError(f"unexpected preprocessor layout: {sorted(transformers)}")
+    num_steps, numeric_features = transformers['num']
+    cat_steps, categorical_features = transformers['cat']
+    if list(categorical_features) != CATEGORICAL_COLUMNS:
+        raise ValueError(f"unexpected categorical features: {categorical_features}")
+
+    arrays = {
+        'numeric_features': np.asarray(numeric_features, dtype=str),
+        'numeric_fill': num_steps.named_steps['imputer'].statistics_.astype(np.float64),
+        'categorical_fill': cat_steps.named_steps['imputer'].statistics_.astype(str),
+    }
+    for i, categories in enumerate(cat_steps.named_steps['onehot'].categories_):
+        arrays[f'categories_{i}'] = categories.astype(str)
+    for i, column in enumerate(NUMERIC_LOOKUPS):
+        keys, values = features.lookups_[column]
+        arrays[f'lookup_keys_{i}'] = np.asarray(keys, dtype=str)
+        arrays[f'lookup_values_{i}'] = values
+    return arrays
+
+
+class FlatForest:
+    """The fitted pipeline as plain arrays plus a vectorized evaluator."""
+
+    def __init__(self, arrays, metadata=None):
+        self.arrays = arrays
+        self.metadata = metadata or {}
+        self.numeric_features = [str(name) for name in arrays['numeric_features']]
+        self.numeric_fill = arrays['numeric_fill']
+        self.categorical_fill = [str(value) for value in arrays['categorical_fill']]
+        self.categories = [pd.Index(arrays[f'categories_{i}'].astype(object))
+                           for i in range(len(CATEGORICAL_COLUMNS))]
+
+        self.lookups = {
+            column: (pd.Index(arrays[f'lookup_keys_{i}'].astype(object)), arrays[f'lookup_values_{i}'])
+            for i, column in enumerate(NUMERIC_LOOKUPS)
+        }
+        # Plain dicts for the single-profile path
+        self.lookup_dicts = {
+            column: dict(zip(keys, values[:-1].tolist()))
+            for column, (keys, values) in self.lookups.items()
+        }
+        self.category_positions = [{value: i for i, value in enumerate(index)} for index in self.categories]
+        self.onehot_offsets = np.cumsum([len(self.numeric_features)] + [len(c) for c in self.categories])
+        self.n_features = int(self.onehot_offsets[-1])
+
+        # No copies here, so memory-mapped node arrays stay shared between processes
+        self.feature = np.asarray(arrays['feature'], dtype=np.intp)
+        self.left = np.asarray(arrays['left'], dtype=np.intp)
+        self.right = np.asarray(arrays['right'], dtype=np.intp)
+        self.children = np.asarray(arrays['children'], dtype=np.intp)
+        self.threshold32 = np.asarray(arrays['threshold32'], dtype=np.float32)
+        self.value = np.asarray(arrays['value'], dtype=np.float64)
+        self.roots = np.asarray(arrays['roots'], dtype=np.intp)
+        # Files exported before 0-d arrays round-tripped hold the depth as a 1-element array
+        self.depth = int(arrays['depth'].item())
+        # Missing from exports made before attributions existed
+        self.cover = np.asarray(arrays['cover'], dtype=np.float64) if 'cover' in arrays else None
+
+    @classmethod
+    def from_pipeline(cls, model):
+        steps = model.named_steps
+        arrays = compile_preprocessing(steps['features'], steps['preprocessor'])
+        arrays.update(flatten_trees(steps['regressor'].estimators_))
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, path=DEFAULT_EXPORT_PATH, mmap=True):
+        """Open an exported forest, memory-mapping its arrays unless ``mmap`` is false."""
+        metadata, arrays = modelfile.load(path, mmap=mmap)
+        return cls(arrays, metadata)
+
+    def save(self, path=DEFAULT_EXPORT_PATH, model_sha256=None):
+        """Write the arrays as a model file; ``model_sha256`` records which pickle they came from."""
+        import sklearn
+
+        metadata = dict(self.metadata, n_trees=self.n_trees, numpy=np.__version__, sklearn=sklearn.__version__)
+        if model_sha256 is not None:
+            metadata['model_sha256'] = model_sha256
+        modelfile.save(path, self.arrays, metadata)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def encode(self, data):
+        """Encode raw survey rows into the forest's float32 input matrix."""
+        engineered = transform_features(data, self.lookups)
+        X = np.zeros((len(engineered), self.n_features), dtype=np.float32)
+        for j, name in enumerate(self.numeric_features):
+            column = engineered[name].to_numpy(dtype=float)
+            X[:, j] = np.where(np.isnan(column), self.numeric_fill[j], column)
+        rows = np.arange(len(engineered))
+        for i, (name, index) in enumerate(zip(CATEGORICAL_COLUMNS, self.categories)):
+            # Like SimpleImputer on object columns, only NaN counts as missing
+            column = engineered[name].to_numpy(dtype=object)
+            column = np.where(column != column, self.categorical_fill[i], column)
+            codes = index.get_indexer(column)
+            known = codes >= 0
+            X[rows[known], self.onehot_offsets[i] + codes[known]] = 1.0
+        return X
+
+    def encode_profile(self, profile):
+        """Encode one raw profile dict without going through pandas."""
+        numeric = {'Age': float(profile['Age'])}
+        for column, (name, _) in NUMERIC_LOOKUPS.items():
+            numeric[name] = self.lookup_dicts[column].get(profile[column], np.nan)
+        add_interactions(numeric)
+
+        x = np.zeros(self.n_features, dtype=np.float32)
+        for j, name in enumerate(self.numeric_features):
+            value = numeric[name]
+            x[j] = self.numeric_fill[j] if value != value else value
+        for i, column in enumerate(CATEGORICAL_COLUMNS):
+            value = profile[column]
+            value = category_aliases.get(column, {}).get(value, value)
+            if value != value:
+                value = self.categorical_fill[i]
+            position = self.category_positions[i].get(value)
+            if position is not None:
+                x[self.onehot_offsets[i] + position] = 1.0
+        return x
+
+    def leaf_values(self, X):
+        """Return the (trees, rows) matrix of leaf values for an encoded batch."""
+        n = len(X)
+        flat = X.reshape(-1)
+        row_offsets = np.arange(n, dtype=np.intp) * self.n_features
+        node = np.repeat(self.roots[:, None], n, axis=1)
+        for _ in range(self.depth):
+            index = self.feature.take(node)
+            index += row_offsets
+            goes_right = flat.take(index) > self.threshold32.take(node)
+            node *= 2
+            node += goes_right
+            node = self.children.take(node)
+        return self.value.take(node)
+
+    def predict_encoded(self, X):
+        predictions = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), BLOCK_SIZE):
+            block = X[start:start + BLOCK_SIZE]
+            # Reducing over the leading axis adds tree by tree, in estimator order
+            predictions[start:start + len(block)] = self.leaf_values(block).sum(axis=0) / self.n_trees
+        return predictions
+
+    def predict_interval_encoded(self, X, quantiles=DEFAULT_QUANTILES):
+        """``(predictions, lower, upper)`` arrays for an encoded batch, from one walk of the trees."""
+        predictions = np.empty(len(X), dtype=np.float64)
+        bounds = np.empty((2, len(X)), dtype=np.float64)
+        for start in range(0, len(X), BLOCK_SIZE):
+            block = X[start:start + BLOCK_SIZE]
+            values = self.leaf_values(block)
+            predictions[start:start + len(block)] = values.sum(axis=0) / self.n_trees
+            bounds[:, start:start + len(block)] = np.quantile(values, quantiles, axis=0)
+        return predictions, bounds[0], bounds[1]
+
+    def predict(self, data):
+        """Predict sleep hours for raw survey rows (a DataFrame with ``RAW_COLUMNS``)."""
+        return self.predict_encoded(self.encode(data[RAW_COLUMNS]))
+
+    def predict_interval(self, data, quantiles=DEFAULT_QUANTILES):
+        """``(predictions, lower, upper)`` for raw survey rows."""
+        return self.predict_interval_encoded(self.encode(data[RAW_COLUMNS]), quantiles)
+
+    def predict_profile(self, profile):
+        """Predict sleep hours for one raw profile dict."""
+        return self.predict_vector(self.encode_profile(profile))
+
+    def predict_vector(self, x):
+        """Predict sleep hours for one encoded row from ``encode_profile``.
+
+        With a single row it is cheaper to evaluate every split once and then
+        hop through the resulting next-node array, one gather per level.
+        """
+        return self._mean(self._leaf_vector(x))
+
+    def predict_interval_vector(self, x, quantiles=DEFAULT_QUANTILES):
+        """``(prediction, lower, upper)`` for one encoded row, from one walk of the trees."""
+        values = self._leaf_vector(x)
+        # np.quantile's linear interpolation, without its overhead on a hundred values
+        ordered = np.sort(values).tolist()
+        bounds = []
+        for q in quantiles:
+            position = q * (len(ordered) - 1)
+            below = int(position)
+            above = min(below + 1, len(ordered) - 1)
+            bounds.append(ordered[below] + (ordered[above] - ordered[below]) * (position - below))
+        lower, upper = bounds
+        return self._mean(values), lower, upper
+
+    def _leaf_vector(self, x):
+        next_node = np.where(x.take(self.feature) <= self.threshold32, self.left, self.right)
+        node = self.roots
+        for _ in range(self.depth):
+            node = next_node.take(node)
+        return self.value.take(node)
+
+    def _mean(self, values):
+        # Summed in estimator order, like sklearn
+        total = 0.0
+        for leaf_value in values.tolist():
+            total += leaf_value
+        return total / self.n_trees
+
+
+def verify(forest, model, data=None):
+    """Return True if the kernel matches ``model.predict`` exactly on ``data``.
+
+    ``data`` defaults to ``VERIFY_SAMPLE_SIZE`` random survey rows from a
+    fixed seed, for callers that compile a model without its training CSV.
+    """
+    if data is None:
+        data = random_profiles(np.random.default_rng(0), VERIFY_SAMPLE_SIZE)
+    rows = data[RAW_COLUMNS]
+    expected = model.predict(rows)
+    if not np.array_equal(forest.predict(rows), expected):
+        return False
+    profiles = rows.to_dict('records')
+    return all(forest.predict_profile(p) == e for p, e in zip(profiles, expected))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flatten the model's forest into NumPy arrays.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help="compile, verify against model.predict and write the arrays")
+    export.add_argument('--model', default=DEFAULT_MODEL_PATH, help="path to the pickled model pipeline")
+    export.add_argument('--data', default=DEFAULT_DATA_PATH, help="survey rows to verify the kernel on")
+    export.add_argument('--output', default=DEFAULT_EXPORT_PATH, help="where to write the model file")
+    args = parser.parse_args(argv)
+
+    import joblib
+
+    model = joblib.load(args.model)
+    forest = FlatForest.from_pipeline(model)
+    data = pd.read_csv(args.data)
+    if not verify(forest, model, data):
+        raise SystemExit(f"flattened forest does not reproduce model.predict on {args.data}")
+    forest.save(args.output, model_sha256=file_digest(args.model))
+
+    profile = data[RAW_COLUMNS].iloc[0].to_dict()
+    start = time.perf_counter()
+    for _ in range(1000):
+        forest.predict_profile(profile)
+    single_us = (time.perf_counter() - start) * 1000
+    print(f"wrote {forest.n_trees} trees ({len(forest.value)} nodes) to {args.output}; "
+          f"verified on {len(data)} rows; single prediction {single_us:.0f} µs")
+
+
+if __name__ == '__main__':
+    main()
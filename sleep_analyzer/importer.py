@@ -0,0 +1,189 @@
+"""Bulk import of sleep-tracker exports into the sleep log.
+
+Usage::
+
+    python -m sleep_analyzer.importer USER_ID export.csv
+
+CSV and JSON Lines files are streamed in chunks, so memory stays bounded by
+``chunk_size`` whatever the length of the history; a plain JSON array has to
+be parsed whole and is then processed in the same chunks. Each chunk is
+normalized column-wise (date, hours, quality), invalid rows are dropped,
+duplicate dates keep their last row, and the chunk is written to the
+``SleepLog`` in one transaction.
+
+Trackers name their columns differently, so the first column matching one of
+the ``*_COLUMNS`` aliases below (case-insensitive) is used. Durations may be
+given in hours or minutes; quality may be on the app's 1-5 scale or a 0-100
+sleep score.
+"""
+import argparse
+import json
+import time
+import warnings
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sleep_analyzer.sleeplog import LOG_COLUMNS, SleepLog
+
+DEFAULT_CHUNK_SIZE = 10_000
+DATE_COLUMNS = ['date', 'day', 'night', 'sleep_date', 'calendardate', 'dateofsleep', 'start', 'startdate']
+HOURS_COLUMNS = ['hours', 'sleep_hours', 'hours_slept', 'duration_hours', 'asleep_hours']
+MINUTES_COLUMNS = ['minutes', 'minutesasleep', 'totalminutesasleep', 'duration_minutes', 'asleep_minutes']
+QUALITY_COLUMNS = ['quality', 'sleep_quality', 'score', 'sleep_score', 'overall_score']
+# Used when an export has no quality column at all
+DEFAULT_QUALITY = 3
+MAX_HOURS = 24
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    imported: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    seconds: float = 0.0
+    dates: set = field(default_factory=set, repr=False)
+
+    def __str__(self):
+        return (f"imported {self.imported} nights from {self.rows} rows in {self.seconds:.2f} s "
+                f"({self.invalid} invalid, {self.duplicates} duplicate dates)")
+
+
+def read_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, name=None):
+    """Yield raw DataFrame chunks from a CSV, JSON Lines or JSON array export.
+
+    ``source`` is a path or a binary file object (such as a Streamlit upload);
+    ``name`` overrides the file name used to pick the format.
+    """
+    name = str(name or getattr(source, 'name', source)).lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        yield from pd.read_json(source, lines=True, chunksize=chunk_size)
+    elif name.endswith('.json'):
+        records = _json_records(source)
+        for start in range(0, len(records), chunk_size):
+            yield pd.DataFrame.from_records(records[start:start + chunk_size])
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_size)
+
+
+def _json_records(source):
+    if hasattr(source, 'read'):
+        data = json.load(source)
+    else:
+        with open(source, 'rb') as f:
+            data = json.load(f)
+    if isinstance(data, dict):
+        # Exports such as {"sleep": [...]}: take the first list of records
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+    return data
+
+
+def _find_column(frame, aliases):
+    columns = {str(column).strip().lower(): column for column in frame.columns}
+    return next((columns[alias] for alias in aliases if alias in columns), None)
+
+
+def _parse_date(value):
+    try:
+        timestamp = pd.Timestamp(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return None if pd.isna(timestamp) else timestamp.strftime('%Y-%m-%d')
+
+
+def _parse_dates(values):
+    """Each value's calendar date as an ISO string, ``NaN``/``None`` where it does not parse.
+
+    Timestamps keep their own wall-clock date. An export spanning a DST change
+    mixes UTC offsets, which one ``to_datetime`` call cannot hold in a single
+    column, so such a column is parsed one value at a time.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            dates = pd.to_datetime(values, errors='coerce')
+    except (TypeError, ValueError, OverflowError):
+        dates = None
+    if dates is not None and pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.strftime('%Y-%m-%d')
+    return values.map(_parse_date)
+
+
+def normalize(chunk):
+    """Map one raw chunk to ``LOG_COLUMNS``, dropping rows without a valid date or duration.
+
+    Returns ``(entries, invalid)``; ``entries`` has ISO date strings, float
+    hours and integer 1-5 quality.
+    """
+    date_column = _find_column(chunk, DATE_COLUMNS)
+    if date_column is None:
+        raise ValueError(f"no date column found; expected one of {DATE_COLUMNS}")
+    dates = _parse_dates(chunk[date_column])
+
+    hours_column = _find_column(chunk, HOURS_COLUMNS)
+    minutes_column = _find_column(chunk, MINUTES_COLUMNS)
+    if hours_column is not None:
+        hours = pd.to_numeric(chunk[hours_column], errors='coerce')
+    elif minutes_column is not None:
+        hours = pd.to_numeric(chunk[minutes_column], errors='coerce') / 60
+    else:
+        raise ValueError(f"no duration column found; expected one of {HOURS_COLUMNS + MINUTES_COLUMNS}")
+
+    quality_column = _find_column(chunk, QUALITY_COLUMNS)
+    if quality_column is not None:
+        quality = pd.to_numeric(chunk[quality_column], errors='coerce')
+        # Scores above 5 are on a 0-100 scale
+        quality = quality.where(quality <= 5, np.ceil(quality / 20)).clip(1, 5).fillna(DEFAULT_QUALITY)
+    else:
+        quality = pd.Series(DEFAULT_QUALITY, index=chunk.index)
+
+    valid = dates.notna() & hours.gt(0) & hours.le(MAX_HOURS)
+    entries = pd.DataFrame({
+        'date': dates[valid],
+        'hours': hours[valid].round(2),
+        'quality': quality[valid].round().astype(int),
+    }, columns=LOG_COLUMNS)
+    return entries, int((~valid).sum())
+
+
+def import_export(sleep_log, user_id, source, chunk_size=DEFAULT_CHUNK_SIZE, name=None):
+    """Stream ``source`` into ``sleep_log`` for ``user_id``; returns an ``ImportReport``.
+
+    Within the file the last row for a date wins, as it does against entries
+    already in the log.
+    """
+    report = ImportReport()
+    start = time.perf_counter()
+    for chunk in read_chunks(source, chunk_size=chunk_size, name=name):
+        entries, invalid = normalize(chunk)
+        report.rows += len(chunk)
+        report.invalid += invalid
+
+        entries = entries.drop_duplicates('date', keep='last')
+        seen = entries['date'].isin(report.dates)
+        report.duplicates += (len(chunk) - invalid - len(entries)) + int(seen.sum())
+        report.dates.update(entries['date'])
+
+        sleep_log.add_frame(user_id, entries)
+    report.imported = len(report.dates)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a sleep-tracker export into the sleep log.")
+    parser.add_argument('user', help="user id the nights belong to (the app's ?user= parameter)")
+    parser.add_argument('input', help="CSV, JSON Lines (.jsonl) or JSON export")
+    parser.add_argument('--log', help="sleep-log database (defaults to SLEEP_ANALYZER_SLEEP_LOG)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction")
+    args = parser.parse_args(argv)
+
+    sleep_log = SleepLog(args.log) if args.log else SleepLog()
+    print(import_export(sleep_log, args.user, Path(args.input), chunk_size=args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
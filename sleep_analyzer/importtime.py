@@ -0,0 +1,116 @@
+"""Report how long the app's imports take on a cold interpreter.
+
+Usage::
+
+    python -m sleep_analyzer.importtime                     # heaviest imports of app.py
+    python -m sleep_analyzer.importtime --max-ms 1500 -o imports.json
+
+The top-level imports of ``app.py`` are read from its source and run in a
+fresh ``python -X importtime`` process, so the numbers are what a new server
+process pays before the first line of the script executes. The report lists
+the app's own imports with their cumulative time and the individual modules
+that cost the most.
+
+The app keeps scikit-learn (with joblib and scipy), ``requests`` and PIL out
+of its import path (they are only needed to unpickle a model no exported
+forest matches, and to download images); the run fails if any of them is
+imported, or if the total exceeds ``--max-ms``.
+"""
+import argparse
+import ast
+import json
+import subprocess
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_APP_PATH = ROOT / 'app.py'
+# Heavy packages that must only be imported on the paths that need them
+LAZY_PACKAGES = ('sklearn', 'joblib', 'requests', 'PIL', 'scipy')
+
+
+@dataclass(frozen=True)
+class ImportTime:
+    module: str
+    self_ms: float
+    cumulative_ms: float
+    depth: int
+
+
+def app_imports(path=DEFAULT_APP_PATH):
+    """The modules imported at the top level of the script at ``path``, in order."""
+    modules = []
+    for node in ast.parse(Path(path).read_text(encoding='utf-8')).body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def measure(modules):
+    """Import ``modules`` in a fresh interpreter; one ``ImportTime`` per module it loaded."""
+    code = "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"importing the app's modules failed:\n{result.stderr[-2000:]}")
+    times = []
+    for line in result.stderr.splitlines():
+        # "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2 - 1
+        times.append(ImportTime(name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    return times
+
+
+def report(times, modules, top=15):
+    """Summarise ``measure`` output: total, the app's own imports, the heaviest modules, lazy ones loaded."""
+    loaded = {t.module: t for t in times}
+    return {
+        'total_ms': sum(t.cumulative_ms for t in times if t.depth == 0),
+        'modules': len(times),
+        'app_imports': {module: loaded[module].cumulative_ms for module in modules if module in loaded},
+        'heaviest': [asdict(t) for t in sorted(times, key=lambda t: t.self_ms, reverse=True)[:top]],
+        'lazy_imported': sorted(name for name in loaded if name.split('.')[0] in LAZY_PACKAGES
+                                and '.' not in name),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold import time of the app's modules.")
+    parser.add_argument('--app', default=DEFAULT_APP_PATH, help="script whose top-level imports are measured")
+    parser.add_argument('--top', type=int, default=15, help="number of heaviest modules to list")
+    parser.add_argument('--repeat', type=int, default=3, help="runs to take the fastest of")
+    parser.add_argument('--max-ms', type=float, help="fail if the imports take longer than this")
+    parser.add_argument('-o', '--output', help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    modules = app_imports(args.app)
+    runs = [report(measure(modules), modules, top=args.top) for _ in range(args.repeat)]
+    result = min(runs, key=lambda run: run['total_ms'])
+
+    print(f"{'app import':<48} {'cumulative':>12}")
+    for module, ms in result['app_imports'].items():
+        print(f"{module:<48} {ms:>9.1f} ms")
+    print(f"\n{'heaviest module':<48} {'self':>12} {'cumulative':>12}")
+    for t in result['heaviest']:
+        print(f"{t['module']:<48} {t['self_ms']:>9.1f} ms {t['cumulative_ms']:>9.1f} ms")
+    print(f"\n{result['modules']} modules imported in {result['total_ms']:.0f} ms (fastest of {args.repeat})")
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2) + "\n")
+
+    failures = []
+    if result['lazy_imported']:
+        failures.append(f"imported at startup: {', '.join(result['lazy_imported'])}")
+    if args.max_ms is not None and result['total_ms'] > args.max_ms:
+        failures.append(f"imports took {result['total_ms']:.0f} ms, over the {args.max_ms:.0f} ms budget")
+    if failures:
+        raise SystemExit("; ".join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Precomputed predictions for every profile the survey can produce.
+
+Apart from ``Age`` every model input is categorical, so the reachable input
+space is finite (about four million profiles). ``build_table`` runs the model
+over all of them once and stores each prediction with its interval (the
+per-tree quantiles ``FlatForest.predict_interval`` reports) as a
+``(profiles, 3)`` float16 ``.npy`` array indexed by a mixed-radix key, next to
+a small JSON header::
+
+    python -m sleep_analyzer.lookup build
+
+``PredictionTable`` memory-maps that array, so a prediction and its interval
+are a key computation plus one array read. float16 keeps the table around
+24 MB while staying within 0.004 hours of the model's answer.
+"""
+import argparse
+import hashlib
+import json
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sleep_analyzer.features import RAW_COLUMNS, age_range, category_aliases, field_values
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_MODEL_PATH = ROOT / 'sleep_model.pkl'
+DEFAULT_TABLE_PATH = ROOT / 'prediction_table.npy'
+TABLE_VERSION = 2
+
+
+def table_fields():
+    """Return ``[(column, values), ...]`` in key order, Age first."""
+    ages = list(range(age_range[0], age_range[1] + 1))
+    return [('Age', ages)] + [(column, field_values[column]) for column in RAW_COLUMNS[1:]]
+
+
+def file_digest(path):
+    """SHA-256 of a file, used to tie a table to the model that built it."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def header_path(table_path):
+    return Path(table_path).with_suffix('.json')
+
+
+def build_table(model, model_path=DEFAULT_MODEL_PATH, path=DEFAULT_TABLE_PATH, chunk_size=1 << 18):
+    """Predict every profile in the input space and write the table to ``path``.
+
+    Returns the number of profiles written.
+    """
+    from sleep_analyzer.forest import FlatForest
+
+    # The compiled forest gives model.predict's exact answer and the interval in one walk
+    forest = FlatForest.from_pipeline(model)
+    fields = table_fields()
+    radices = [len(values) for _, values in fields]
+    size = int(np.prod(radices))
+    vocab = [np.asarray(values, dtype=object if column != 'Age' else np.int64)
+             for column, values in fields]
+
+    table = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16, shape=(size, 3))
+    for start in range(0, size, chunk_size):
+        keys = np.arange(start, min(start + chunk_size, size))
+        digits = np.unravel_index(keys, radices)
+        rows = pd.DataFrame({column: values[d] for (column, _), values, d in zip(fields, vocab, digits)},
+                            columns=RAW_COLUMNS)
+        table[start:start + len(keys)] = np.column_stack(forest.predict_interval(rows))
+    table.flush()
+    del table
+
+    header = {
+        'version': TABLE_VERSION,
+        'model_sha256': file_digest(model_path),
+        'fields': [[column, values] for column, values in fields],
+    }
+    header_path(path).write_text(json.dumps(header))
+    return size
+
+
+class PredictionTable:
+    """Read-only view over a table written by ``build_table``."""
+
+    def __init__(self, path=DEFAULT_TABLE_PATH):
+        header = json.loads(header_path(path).read_text())
+        if header.get('version') != TABLE_VERSION:
+            raise ValueError(f"unsupported prediction table version {header.get('version')!r}")
+        self.model_sha256 = header['model_sha256']
+        self.fields = [(column, values) for column, values in header['fields']]
+        self.radices = [len(values) for _, values in self.fields]
+        self.indexes = {column: pd.Index(values) for column, values in self.fields}
+        self.positions = {column: {value: i for i, value in enumerate(values)}
+                          for column, values in self.fields}
+        self.values = np.load(path, mmap_mode='r')
+        if self.values.shape != (int(np.prod(self.radices)), 3):
+            raise ValueError("prediction table does not match its header")
+
+    def lookup(self, profile):
+        """Return the prediction for one raw profile dict, or ``None`` if it is outside the table."""
+        key = self._key(profile)
+        return None if key is None else float(self.values[key, 0])
+
+    def lookup_interval(self, profile):
+        """``(prediction, lower, upper)`` for one raw profile dict, or ``None`` if it is outside the table."""
+        key = self._key(profile)
+        return None if key is None else tuple(self.values[key].tolist())
+
+    def _key(self, profile):
+        digits = []
+        for column, _ in self.fields:
+            value = profile[column]
+            value = category_aliases.get(column, {}).get(value, value)
+            if column == 'Age':
+                value = int(value) if float(value).is_integer() else None
+            index = self.positions[column].get(value)
+            if index is None:
+                return None
+            digits.append(index)
+        return np.ravel_multi_index(digits, self.radices)
+
+    def predict(self, data):
+        """Vectorized lookup for raw survey rows; rows outside the table get NaN."""
+        return self._rows(data)[:, 0]
+
+    def predict_interval(self, data):
+        """``(predictions, lower, upper)`` arrays for raw survey rows; rows outside the table get NaN."""
+        rows = self._rows(data)
+        return rows[:, 0], rows[:, 1], rows[:, 2]
+
+    def _rows(self, data):
+        digits = []
+        valid = np.ones(len(data), dtype=bool)
+        for column, _ in self.fields:
+            values = data[column]
+            if column in category_aliases:
+                values = values.replace(category_aliases[column])
+            if column == 'Age':
+                ages = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+                values = np.where(np.mod(ages, 1) == 0, ages, np.nan)
+            index = self.indexes[column].get_indexer(values)
+            valid &= index >= 0
+            digits.append(np.where(index >= 0, index, 0))
+
+        rows = np.full((len(data), 3), np.nan)
+        keys = np.ravel_multi_index(digits, self.radices)
+        rows[valid] = self.values[keys[valid]]
+        return rows
+
+
+def open_table(path=DEFAULT_TABLE_PATH, model_path=DEFAULT_MODEL_PATH, model_sha256=None):
+    """Open the table if it exists and was built from the current model, else return ``None``.
+
+    Callers that already know the model's digest pass ``model_sha256`` instead
+    of having ``model_path`` hashed again.
+    """
+    if not Path(path).exists() or not header_path(path).exists():
+        return None
+    try:
+        table = PredictionTable(path)
+    except ValueError as e:
+        warnings.warn(f"ignoring {path} ({e}); rebuild it with `python -m sleep_analyzer.lookup build`")
+        return None
+    if table.model_sha256 != (model_sha256 or file_digest(model_path)):
+        warnings.warn(f"{path} was built from a different model; rebuild it with "
+                      "`python -m sleep_analyzer.lookup build`")
+        return None
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute predictions for the whole survey input space.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="run the model over every profile and write the table")
+    build.add_argument('--model', default=DEFAULT_MODEL_PATH, help="path to the pickled model pipeline")
+    build.add_argument('--output', default=DEFAULT_TABLE_PATH, help="where to write the .npy table")
+    args = parser.parse_args(argv)
+
+    import joblib
+
+    start = time.perf_counter()
+    size = build_table(joblib.load(args.model), model_path=args.model, path=args.output)
+    print(f"wrote {size:,} predictions to {args.output} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
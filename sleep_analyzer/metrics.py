@@ -0,0 +1,272 @@
+"""Process-wide request metrics, exported in the Prometheus text format.
+
+One ``Metrics`` registry lives per server process, like the prediction cache.
+The app feeds it the ``StageTimer`` of every prediction submit and tracker
+render (``record``) and counts predictions by where they came from. Each
+latency is kept two ways:
+
+* a cumulative histogram (``*_seconds_bucket``/``_sum``/``_count``), which
+  Prometheus can aggregate across processes and alert on with
+  ``histogram_quantile``;
+* a summary of the p50/p95/p99 over the most recent ``window`` samples, for
+  reading a load test straight off the endpoint.
+
+Values that other components already track, such as ``PredictionCache.stats()``,
+are read at export time through ``collect`` instead of being counted twice.
+
+The text is served at ``/metrics`` on ``SLEEP_ANALYZER_METRICS_PORT`` and/or
+rewritten every ``SLEEP_ANALYZER_METRICS_INTERVAL`` seconds to
+``SLEEP_ANALYZER_METRICS_FILE`` (e.g. for node_exporter's textfile collector).
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'sleep_analyzer_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Upper bounds in seconds; a prediction submit normally finishes in the low milliseconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+DEFAULT_WINDOW = 1024
+
+DESCRIPTIONS = {
+    'requests_total': "App runs that went through an instrumented path.",
+    'predictions_total': "Predictions served, by source (cache, table, model, service or demo).",
+    'low_confidence_predictions_total': "Predictions whose per-tree interval was wider than the low-confidence width.",
+    'demo_fallbacks_total': "Runs that fell back to demo mode because the model could not be loaded.",
+    'service_errors_total': "Predictions that failed because the prediction service could not be reached.",
+    'stage_seconds': "Duration of each stage of a request.",
+    'request_seconds': "Total duration of a request.",
+    'batches_total': "Batches the micro-batching scheduler ran through the model.",
+    'batch_size': "Requests coalesced into each model batch.",
+    'batch_queue_seconds': "Time a request waited in the micro-batching queue before its batch ran.",
+    'batch_predict_seconds': "Duration of one batched model call.",
+    'prediction_cache_hits_total': "Prediction cache lookups answered from the cache.",
+    'prediction_cache_misses_total': "Prediction cache lookups that had to be computed.",
+    'prediction_cache_evictions_total': "Entries dropped from the prediction cache to stay under its size.",
+    'prediction_cache_entries': "Profiles currently held in the prediction cache.",
+}
+
+
+class Histogram:
+    """Cumulative bucket counts plus a ring of the most recent samples."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[np.searchsorted(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self, quantiles=QUANTILES):
+        """``{q: seconds}`` over the recent samples (NaN before the first one)."""
+        if not self.recent:
+            return {q: float('nan') for q in quantiles}
+        return dict(zip(quantiles, np.quantile(np.fromiter(self.recent, dtype=float), quantiles).tolist()))
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms keyed on a name and labels."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> Histogram
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._exporter = None
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=None, **labels):
+        """Add ``value`` to a histogram; ``buckets`` overrides the latency buckets when it is created."""
+        with self._lock:
+            self._histogram(name, buckets, **labels).observe(value)
+
+    def record(self, timer, request):
+        """Observe every stage of a finished ``StageTimer`` and its total under ``request``."""
+        with self._lock:
+            for stage, seconds in timer.durations.items():
+                self._histogram('stage_seconds', request=request, stage=stage).observe(seconds)
+            self._histogram('request_seconds', request=request).observe(timer.total)
+            key = ('requests_total', _labels({'request': request}))
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def collect(self, collector):
+        """Register ``collector() -> [(name, type, labels, value), ...]``, read at every export."""
+        self._collectors.append(collector)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, _labels(labels)), 0)
+
+    def latency(self, name, **labels):
+        """``{'count', 'sum', 0.5, 0.95, 0.99}`` of one histogram, or ``None`` if never observed."""
+        with self._lock:
+            histogram = self._histograms.get((name, _labels(labels)))
+            if histogram is None:
+                return None
+            return {'count': histogram.count, 'sum': histogram.sum, **histogram.quantiles()}
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        families = {}
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                families.setdefault(name, ('counter', []))[1].append((name, labels, value))
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                samples = families.setdefault(name, ('histogram', []))[1]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    samples.append((f'{name}_bucket', labels + (('le', _number(bound)),), cumulative))
+                samples.append((f'{name}_sum', labels, histogram.sum))
+                samples.append((f'{name}_count', labels, histogram.count))
+                recent = families.setdefault(f'{name}_recent', ('summary', []))[1]
+                for q, seconds in histogram.quantiles().items():
+                    recent.append((f'{name}_recent', labels + (('quantile', _number(q)),), seconds))
+                recent.append((f'{name}_recent_sum', labels, sum(histogram.recent)))
+                recent.append((f'{name}_recent_count', labels, len(histogram.recent)))
+        for collector in self._collectors:
+            for name, kind, labels, value in collector():
+                families.setdefault(name, (kind, []))[1].append((name, _labels(labels), value))
+
+        lines = []
+        for family, (kind, samples) in families.items():
+            if family.endswith('_recent'):
+                description = f"p50/p95/p99 of the last {self.window} {family[:-len('_recent')]} samples."
+            else:
+                description = DESCRIPTIONS.get(family, family.replace('_', ' '))
+            lines.append(f"# HELP {PREFIX}{family} {description}")
+            lines.append(f"# TYPE {PREFIX}{family} {kind}")
+            for name, labels, value in samples:
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write ``render()`` to ``path`` atomically, so scrapers never read half a file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f'{path.suffix}.{os.getpid()}.tmp')
+        tmp.write_text(self.render(), encoding='utf-8')
+        os.replace(tmp, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve ``/metrics`` from a daemon thread; returns the server (``port=0`` picks a free port)."""
+        if self._server is None:
+            self._server = ThreadingHTTPServer((host, port), _handler(self))
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True).start()
+        return self._server
+
+    def export_to(self, path, interval=15.0):
+        """Rewrite ``path`` every ``interval`` seconds from a daemon thread."""
+        if self._exporter is None:
+            self._exporter = threading.Thread(target=self._export, args=(path, interval),
+                                              name='metrics-exporter', daemon=True)
+            self._exporter.start()
+
+    def _export(self, path, interval):
+        while True:
+            try:
+                self.write(path)
+            except OSError:
+                logger.exception("failed to write metrics to %s", path)
+            time.sleep(interval)
+
+    def _histogram(self, name, buckets=None, **labels):
+        """The histogram for ``name`` and ``labels``, created on first use (caller holds the lock)."""
+        key = (name, _labels(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets or self.buckets, self.window)
+        return histogram
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _handler(metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+def cache_collector(cache):
+    """A ``collect`` callback exporting a ``PredictionCache``'s own hit/miss/eviction counts."""
+    def collect():
+        stats = cache.stats()
+        return [
+            ('prediction_cache_hits_total', 'counter', {}, stats.hits),
+            ('prediction_cache_misses_total', 'counter', {}, stats.misses),
+            ('prediction_cache_evictions_total', 'counter', {}, stats.evictions),
+            ('prediction_cache_entries', 'gauge', {}, stats.size),
+        ]
+    return collect
+
+
+def metrics_from_env():
+    """Build the process registry and start the exports configured by ``SLEEP_ANALYZER_METRICS_*``.
+
+    A port that is already taken (e.g. by a second server process) is logged
+    and skipped rather than failing the app.
+    """
+    metrics = Metrics()
+    port = os.environ.get('SLEEP_ANALYZER_METRICS_PORT')
+    if port:
+        try:
+            metrics.serve(int(port), host=os.environ.get('SLEEP_ANALYZER_METRICS_HOST', '127.0.0.1'))
+        except OSError as e:
+            logger.warning("metrics endpoint not started on port %s: %s", port, e)
+    path = os.environ.get('SLEEP_ANALYZER_METRICS_FILE')
+    if path:
+        metrics.export_to(path, interval=float(os.environ.get('SLEEP_ANALYZER_METRICS_INTERVAL', 15)))
+    return metrics
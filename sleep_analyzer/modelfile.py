@@ -0,0 +1,118 @@
+"""A versioned, non-executable file format for named NumPy arrays.
+
+The compiled model (``FlatForest``) is plain numbers and strings, so it does
+not need pickle. A model file is::
+
+    b'SLEEPARR'                      8-byte magic
+    uint32 little-endian             length of the JSON header
+    JSON header                      format version, metadata, and per array
+                                     its dtype, shape and byte offset
+    array data                       C-contiguous, each aligned to 64 bytes
+
+``load`` maps the file read-only and returns ``np.ndarray`` views straight
+onto the mapped pages: nothing is copied, nothing is unpickled, and only
+numeric, boolean and fixed-width string dtypes are accepted, so a swapped
+file can at worst produce wrong numbers, never run code. Every server
+process that opens the same file shares its pages.
+
+The header's ``metadata`` records where the arrays came from (for a model,
+the SHA-256 of the source pickle and the library versions that exported it).
+"""
+import json
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b'SLEEPARR'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# Array kinds a file may contain: bool, signed/unsigned int, float, unicode
+ALLOWED_KINDS = frozenset('biufU')
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save(path, arrays, metadata=None):
+    """Write ``{name: array}`` and ``metadata`` (JSON-serializable) to ``path`` atomically."""
+    # np.require keeps 0-d arrays 0-d, where ascontiguousarray would make them 1-d
+    arrays = {name: np.require(array, requirements='C') for name, array in arrays.items()}
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        if array.dtype.kind not in ALLOWED_KINDS:
+            raise TypeError(f"array {name!r} has unsupported dtype {array.dtype}")
+        offset = _aligned(offset)
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header = json.dumps({'version': FORMAT_VERSION, 'metadata': metadata or {}, 'arrays': entries}).encode('utf-8')
+    # Array offsets are relative to the data section, which starts aligned after the header
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+
+    path = Path(path)
+    tmp = path.with_suffix(f'{path.suffix}.{os.getpid()}.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+
+
+def read_header(path):
+    """The parsed header of a model file, without touching the array data."""
+    with open(path, 'rb') as f:
+        return _parse_header(f.read(len(MAGIC) + 4), f, path)[0]
+
+
+def load(path, mmap=True):
+    """Return ``(metadata, {name: array})`` from a file written by ``save``.
+
+    With ``mmap`` the arrays are read-only views of the mapped file;
+    otherwise the file is read into memory once.
+    """
+    with open(path, 'rb') as f:
+        header, data_start = _parse_header(f.read(len(MAGIC) + 4), f, path)
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    else:
+        buffer = np.frombuffer(Path(path).read_bytes(), dtype=np.uint8)
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        try:
+            dtype = np.dtype(entry['dtype'])
+            shape = tuple(int(n) for n in entry['shape'])
+            offset = int(entry['offset'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: array {name!r} has a malformed header entry") from e
+        if dtype.kind not in ALLOWED_KINDS or dtype.hasobject:
+            raise ValueError(f"{path}: array {name!r} has unsupported dtype {entry['dtype']!r}")
+        if any(n < 0 for n in shape):
+            raise ValueError(f"{path}: array {name!r} has a negative dimension")
+        start = data_start + offset
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        if start < data_start or start + nbytes > len(buffer):
+            raise ValueError(f"{path}: array {name!r} runs past the end of the file")
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=start)
+    return header['metadata'], arrays
+
+
+def _parse_header(prefix, f, path):
+    if len(prefix) < len(MAGIC) + 4 or prefix[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a sleep-analyzer model file")
+    (length,) = struct.unpack('<I', prefix[len(MAGIC):])
+    try:
+        header = json.loads(f.read(length).decode('utf-8'))
+    except ValueError as e:
+        raise ValueError(f"{path}: unreadable model file header") from e
+    if not isinstance(header, dict):
+        raise ValueError(f"{path}: malformed model file header")
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported model file version {header.get('version')!r}")
+    if not isinstance(header.get('metadata'), dict) or not isinstance(header.get('arrays'), dict):
+        raise ValueError(f"{path}: malformed model file header")
+    return header, _aligned(len(MAGIC) + 4 + length)
@@ -0,0 +1,203 @@
+"""Process-wide registry for the served model, with warm-up and hot reload.
+
+``ModelRegistry`` loads ``sleep_model.pkl`` once, compiles it into a
+``FlatForest`` and opens the matching prediction table, then runs a warm-up
+prediction so the first real request pays no lazy initialisation. A
+background thread watches the model file; when it changes, the new version
+is loaded and warmed up completely before ``current()`` starts returning it,
+so requests never see a half-loaded model.
+
+The compiled arrays are read from a ``modelfile`` (see ``forest export``)
+and memory-mapped: every server worker process maps the same pages read-only
+instead of holding a private copy. ``sleep_model.flat`` is used when its
+header names the SHA-256 of the current pickle; otherwise the pickle is
+compiled once per model version into the shared cache directory, and workers
+that find the cache already populated never unpickle the sklearn pipeline.
+A compiled forest is only written to the cache once ``forest.verify`` has
+checked it against ``model.predict``; a model the kernel cannot reproduce
+fails to load instead.
+``SLEEP_ANALYZER_MODEL`` may also point straight at a ``.flat`` file, in which
+case no pickle is needed at all.
+
+Each version also compiles a ``TreeExplainer`` (about 20 ms) so per-prediction
+attributions cost no set-up on the request path; a ``.flat`` exported
+before node covers were recorded loads without one (``explainer`` is
+``None``).
+
+``load_in_background`` builds the registry on a daemon thread and returns a
+``Future``, so a caller can render its first output while the model loads.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from io import BytesIO
+from pathlib import Path
+
+from sleep_analyzer import modelfile
+from sleep_analyzer.explain import TreeExplainer
+from sleep_analyzer.features import RAW_COLUMNS
+from sleep_analyzer.forest import DEFAULT_EXPORT_PATH, FlatForest, verify
+from sleep_analyzer.lookup import DEFAULT_TABLE_PATH, file_digest, open_table
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_MODEL_PATH = Path(os.environ.get('SLEEP_ANALYZER_MODEL', ROOT / 'sleep_model.pkl'))
+DEFAULT_SHARED_DIR = Path(os.environ.get('SLEEP_ANALYZER_MODEL_CACHE', ROOT / '.cache' / 'models'))
+
+# Profile used to warm up a freshly loaded model
+WARMUP_PROFILE = dict(zip(RAW_COLUMNS, [30, 'Male', 'three', 'no', '1-2 hrs', 'no', 'north', 'sometimes',
+                                        'no', 'none of the above']))
+
+logger = logging.getLogger(__name__)
+
+
+class ModelVersion:
+    """One loaded version of the model; immutable once published."""
+
+    def __init__(self, path, sha256, flat, table, model=None, explainer=None):
+        self.path = Path(path)
+        self.sha256 = sha256
+        self.flat = flat
+        self.table = table
+        self.explainer = explainer
+        self.loaded_at = time.time()
+        self._model = model
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """The sklearn pipeline, unpickled on first use when the version came from the shared cache."""
+        if self._model is None:
+            if self.path.suffix == '.flat':
+                raise RuntimeError(f"{self.path} is an exported forest; there is no sklearn pipeline to load")
+            with self._model_lock:
+                if self._model is None:
+                    import joblib
+
+                    self._model = joblib.load(self.path)
+        return self._model
+
+    def predict_profile(self, profile):
+        """Predict one raw profile, from the prediction table when it covers it."""
+        prediction = self.table.lookup(profile) if self.table is not None else None
+        return prediction if prediction is not None else self.flat.predict_profile(profile)
+
+
+class ModelRegistry:
+    """Holds the current ``ModelVersion`` and swaps it when the model file changes."""
+
+    def __init__(self, path=DEFAULT_MODEL_PATH, table_path=DEFAULT_TABLE_PATH, shared_dir=DEFAULT_SHARED_DIR,
+                 poll_interval=5.0, flat_path=DEFAULT_EXPORT_PATH):
+        self.path = Path(path)
+        self.flat_path = Path(flat_path)
+        self.table_path = Path(table_path)
+        self.shared_dir = Path(shared_dir)
+        self.poll_interval = poll_interval
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stat = self._file_stat()
+        self._current = self._load()
+
+    def current(self):
+        return self._current
+
+    def reload(self, force=False):
+        """Publish a new version if the model or table file changed; return True if one was."""
+        with self._reload_lock:
+            stat = self._file_stat()
+            if not force and stat == self._stat:
+                return False
+            self._current = self._load()
+            self._stat = stat
+            logger.info("switched to model %s", self._current.sha256[:12])
+            return True
+
+    def start_watching(self):
+        """Poll the model file in a daemon thread and reload it when it changes."""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.reload()
+            except Exception:
+                # Keep serving the previous version; a half-written file will be retried next poll
+                logger.exception("failed to reload %s", self.path)
+
+    @staticmethod
+    def _open_flat(sha256, candidates):
+        """The first exported forest compiled from the pickle with digest ``sha256``, or ``None``."""
+        for path in candidates:
+            if not path.exists():
+                continue
+            try:
+                header = modelfile.read_header(path)
+                # Exports without node covers predate attributions; recompile rather than serve without them
+                if header['metadata'].get('model_sha256') == sha256 and 'cover' in header['arrays']:
+                    return FlatForest.load(path)
+            except ValueError:
+                logger.warning("ignoring unreadable model file %s", path)
+        return None
+
+    def _file_stat(self):
+        """What the watcher compares: the model file, plus the prediction table if there is one."""
+        stats = [self.path.stat()]
+        if self.table_path.exists():
+            stats.append(self.table_path.stat())
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+    def _load(self):
+        model = None
+        if self.path.suffix == '.flat':
+            flat = FlatForest.load(self.path)
+            sha256 = flat.metadata.get('model_sha256') or file_digest(self.path)
+        else:
+            # Hash and compile the same bytes, so the version id always matches the model
+            content = self.path.read_bytes()
+            sha256 = hashlib.sha256(content).hexdigest()
+            shared = self.shared_dir / f"flat-{sha256[:16]}.flat"
+            flat = self._open_flat(sha256, (self.flat_path, shared))
+            if flat is None:
+                # The only path that needs sklearn: compile a pickle no exported forest matches yet
+                import joblib
+
+                model = joblib.load(BytesIO(content))
+                compiled = FlatForest.from_pipeline(model)
+                if not verify(compiled, model):
+                    raise ValueError(f"flattened forest does not reproduce model.predict for {self.path}")
+                self.shared_dir.mkdir(parents=True, exist_ok=True)
+                compiled.save(shared, model_sha256=sha256)
+                flat = FlatForest.load(shared)
+        table = open_table(self.table_path, model_sha256=sha256)
+        try:
+            explainer = TreeExplainer(flat)
+        except ValueError as e:
+            logger.warning("serving %s without attributions: %s", self.path, e)
+            explainer = None
+        version = ModelVersion(self.path, sha256, flat, table, model=model, explainer=explainer)
+        version.predict_profile(WARMUP_PROFILE)
+        if explainer is not None:
+            explainer.explain_profile(WARMUP_PROFILE)
+        return version
+
+
+def load_in_background(**kwargs):
+    """Build a watching ``ModelRegistry(**kwargs)`` on a daemon thread; returns a ``Future`` of it."""
+    future = Future()
+
+    def load():
+        try:
+            registry = ModelRegistry(**kwargs)
+            registry.start_watching()
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(registry)
+
+    threading.Thread(target=load, name='model-loader', daemon=True).start()
+    return future
@@ -0,0 +1,249 @@
+"""Declarative rules for the factors and recommendations shown with a prediction.
+
+Each ``Rule`` is data: a kind, ``all``/``any`` clauses of the form
+``(column, op, value)`` over the engineered feature columns, a plain-text
+message and, for recommendations, the card contents. ``RuleSet`` compiles
+the clauses into vectorized masks, so a whole batch of profiles is evaluated
+with one comparison per clause, and renders every rule's HTML once up front.
+The app, the notebook and the batch scorer all use ``RULES``.
+
+Kinds:
+
+* ``factor`` - something likely hurting sleep.
+* ``strength`` - a good habit, listed only when no factor applies.
+* ``recommendation`` - a suggestion card.
+
+Clauses on a column the caller does not provide (for example ``sleep time``,
+which only the notebook and batch jobs know) never match.
+"""
+import operator
+from dataclasses import dataclass, field
+from html import escape
+from string import Formatter
+
+import numpy as np
+
+from sleep_analyzer.features import NUMERIC_LOOKUPS, engineer_features
+
+CAFFEINATED = ['Coffee', 'Tea and Coffee both']
+KINDS = ('factor', 'strength', 'recommendation')
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    'in': lambda values, options: np.isin(values, options),
+}
+
+
+@dataclass
+class Rule:
+    name: str
+    kind: str
+    message: str  # may reference input columns, e.g. ``{screen_time_numeric}``
+    all: list = field(default_factory=list)
+    any: list = field(default_factory=list)
+    severity: str = 'medium'
+    icon: str = ''
+    title: str = ''
+    tips: list = field(default_factory=list)
+    html: str = field(init=False, repr=False)
+    fields: list = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if self.kind not in KINDS:
+            raise ValueError(f"unknown rule kind {self.kind!r}")
+        for _, op, _ in self.all + self.any:
+            if op not in OPERATORS:
+                raise ValueError(f"unknown operator {op!r} in rule {self.name!r}")
+        # Input columns the message interpolates; most messages are static
+        self.fields = [name for _, name, _, _ in Formatter().parse(self.message) if name]
+        self.html = render_card(self) if self.kind == 'recommendation' else f"<li>{escape(self.message)}</li>"
+
+    @property
+    def columns(self):
+        return {column for column, _, _ in self.all + self.any}
+
+    @property
+    def general(self):
+        """True for advice shown to everyone (a rule without conditions)."""
+        return not self.all and not self.any
+
+    def mask(self, inputs, n):
+        """Boolean array of the ``n`` rows of ``inputs`` the rule applies to."""
+        if any(column not in inputs for column in self.columns):
+            return np.zeros(n, dtype=bool)
+        result = np.ones(n, dtype=bool)
+        for column, op, value in self.all:
+            result &= OPERATORS[op](np.asarray(inputs[column]), value)
+        if self.any:
+            matched = np.zeros(n, dtype=bool)
+            for column, op, value in self.any:
+                matched |= OPERATORS[op](np.asarray(inputs[column]), value)
+            result &= matched
+        return result
+
+    def texts(self, inputs, rows):
+        """The message for each of ``rows``, formatted only when it interpolates inputs."""
+        if not self.fields:
+            return [self.message] * len(rows)
+        values = {name: np.asarray(inputs[name])[rows] for name in self.fields}
+        return [self.message.format(**{name: values[name][i] for name in self.fields}) for i in range(len(rows))]
+
+    def render(self, inputs, row=0):
+        """The rule's HTML fragment for one row; static rules return the pre-rendered copy."""
+        if self.kind == 'recommendation' or not self.fields:
+            return self.html
+        return f"<li>{escape(self.texts(inputs, [row])[0])}</li>"
+
+
+def render_card(rule):
+    tips = ''.join(f"<li>{escape(tip)}</li>" for tip in rule.tips)
+    return (f'<div class="recommendation-card">'
+            f'<div style="font-size: 24px; margin-bottom: 10px;">{rule.icon}</div>'
+            f'<h3 style="margin-top: 0;">{escape(rule.title)}</h3>'
+            f'<ul>{tips}</ul>'
+            f'</div>')
+
+
+RULES = [
+    Rule('high_screen_time', 'factor', "High screen time ({screen_time_numeric} hours) before bed",
+         all=[('screen_time_numeric', '>', 3)], severity='high'),
+    Rule('smoke_drink', 'factor', "Smoking or alcohol consumption",
+         all=[('smoke/drink', '==', 1)], severity='high'),
+    Rule('no_exercise', 'factor', "Lack of regular exercise",
+         all=[('exercise_numeric', '==', 0)]),
+    Rule('no_bluelight_filter', 'factor', "Extended screen use without blue light filter",
+         all=[('bluelight filter', '==', 0), ('screen_time_numeric', '>', 2)]),
+    Rule('evening_caffeine', 'factor', "Evening caffeine consumption",
+         all=[('beverage', 'in', CAFFEINATED)]),
+
+    Rule('regular_exercise', 'strength', "Regular exercise is helping your sleep quality",
+         all=[('exercise_numeric', '==', 2)], severity='low'),
+    Rule('bluelight_filter', 'strength', "Using blue light filter is beneficial",
+         all=[('bluelight filter', '==', 1)], severity='low'),
+    Rule('low_screen_time', 'strength', "Limited screen time before bed is ideal",
+         all=[('screen_time_numeric', '<', 2)], severity='low'),
+
+    Rule('short_sleep', 'recommendation', "Your sleep duration is below the recommended 7-9 hours for adults.",
+         all=[('sleep time', '<', 6)], severity='high', icon='⏰', title="Protect Your Sleep Window",
+         tips=["Set a fixed bedtime that allows 7-9 hours in bed",
+               "Keep the same wake-up time on weekends",
+               "Wind down for 30 minutes before lights out"]),
+    Rule('reduce_screen_time', 'recommendation',
+         "Reduce screen time before bed. Consider using blue light filters consistently.",
+         all=[('screen_time_numeric', '>', 2)], icon='📱', title="Reduce Screen Time",
+         tips=["Aim to put devices away 1 hour before bed",
+               "Enable night mode/blue light filters",
+               "Try reading a physical book instead"]),
+    Rule('increase_activity', 'recommendation', "Increasing physical activity may improve sleep quality.",
+         all=[('exercise_numeric', '!=', 2)], icon='🏃', title="Increase Physical Activity",
+         tips=["Start with 20-30 minutes daily",
+               "Morning exercise can improve sleep quality",
+               "Even light activities like walking help"]),
+    Rule('adjust_eating', 'recommendation',
+         "Having fewer, more balanced meals and avoiding evening caffeine might help with sleep quality.",
+         any=[('meals_numeric', '>', 3), ('beverage', 'in', CAFFEINATED)], icon='🍽️',
+         title="Adjust Eating Habits",
+         tips=["Finish dinner 2-3 hours before bed",
+               "Avoid caffeine after 2 PM",
+               "Consider lighter evening meals"]),
+    Rule('limit_substances', 'recommendation', "Reducing alcohol/tobacco consumption may improve sleep quality.",
+         all=[('smoke/drink', '==', 1)], severity='high', icon='🚭', title="Limit Substances",
+         tips=["Reduce alcohol, especially before bed",
+               "Avoid smoking near bedtime",
+               "Consider herbal tea alternatives"]),
+    Rule('sleep_environment', 'recommendation', "Keep a cool, dark bedroom and a consistent sleep schedule.",
+         severity='low', icon='🛏️', title="Sleep Environment",
+         tips=["Keep bedroom cool (65-68°F/18-20°C)",
+               "Use blackout curtains for darkness",
+               "Maintain a consistent sleep schedule"]),
+]
+
+
+class RuleSet:
+    """A compiled list of rules, evaluated column-wise over many profiles."""
+
+    def __init__(self, rules=RULES):
+        self.rules = list(rules)
+        self.by_kind = {kind: [rule for rule in self.rules if rule.kind == kind] for kind in KINDS}
+
+    def evaluate(self, inputs):
+        """``{rule name: boolean mask}`` for a frame (or dict of arrays) of rule inputs.
+
+        Strengths are masked out on rows where any factor applies.
+        """
+        n = len(next(iter(inputs.values()))) if isinstance(inputs, dict) else len(inputs)
+        masks = {rule.name: rule.mask(inputs, n) for rule in self.rules}
+        any_factor = np.zeros(n, dtype=bool)
+        for rule in self.by_kind['factor']:
+            any_factor |= masks[rule.name]
+        for rule in self.by_kind['strength']:
+            masks[rule.name] &= ~any_factor
+        return masks
+
+    def matches(self, inputs):
+        """Per row, the matching rules of each kind: ``[{kind: [Rule, ...]}, ...]``."""
+        masks = self.evaluate(inputs)
+        n = len(next(iter(masks.values()))) if masks else 0
+        rows = [{kind: [] for kind in KINDS} for _ in range(n)]
+        for rule in self.rules:
+            for i in np.flatnonzero(masks[rule.name]):
+                rows[i][rule.kind].append(rule)
+        return rows
+
+    def explain(self, inputs, kind, general=True):
+        """Plain-text messages of the matching ``kind`` rules, one list per row.
+
+        ``general=False`` leaves out advice that applies to everyone.
+        """
+        masks = self.evaluate(inputs)
+        n = len(next(iter(masks.values()))) if masks else 0
+        messages = [[] for _ in range(n)]
+        for rule in self.by_kind[kind]:
+            if rule.general and not general:
+                continue
+            rows = np.flatnonzero(masks[rule.name])
+            for i, text in zip(rows, rule.texts(inputs, rows)):
+                messages[i].append(text)
+        return messages
+
+
+def rule_inputs(data, screen_hours=None, sleep_time=None):
+    """Engineered feature columns of raw survey rows, as the rules expect them.
+
+    ``screen_hours`` replaces the bucketed screen time with exact hours (the
+    app's slider) and ``sleep_time`` adds the actual or predicted duration.
+    """
+    inputs = engineer_features(data)
+    if screen_hours is not None:
+        inputs['screen_time_numeric'] = np.asarray(screen_hours, dtype=float)
+    if sleep_time is not None:
+        inputs['sleep time'] = np.asarray(sleep_time, dtype=float)
+    return inputs
+
+
+def profile_inputs(profile, screen_hours=None, sleep_time=None):
+    """``rule_inputs`` for one raw profile dict, as one-element arrays (no DataFrame)."""
+    inputs = {name: np.array([mapping.get(profile[column], np.nan)], dtype=float)
+              for column, (name, mapping) in NUMERIC_LOOKUPS.items()}
+    inputs['beverage'] = np.array([profile['beverage']], dtype=object)
+    if screen_hours is not None:
+        inputs['screen_time_numeric'] = np.array([screen_hours], dtype=float)
+    if sleep_time is not None:
+        inputs['sleep time'] = np.array([sleep_time], dtype=float)
+    return inputs
+
+
+def recommendations_text(rules, inputs):
+    """The notebook's summary string for each row; general advice is left out."""
+    texts = []
+    for messages in rules.explain(inputs, 'recommendation', general=False):
+        if not messages:
+            texts.append("Your current habits seem generally good for sleep. Maintain your routine!")
+        else:
+            texts.append("Recommendations:\n- " + "\n- ".join(messages))
+    return texts
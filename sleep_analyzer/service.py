@@ -0,0 +1,398 @@
+"""Standalone prediction service: the model behind a small HTTP/JSON API.
+
+Usage::
+
+    python -m sleep_analyzer.service --port 8765
+    curl -s localhost:8765/predict -d '{"Age": 30, "Gender": "Male", "meals/day": "three", ...}'
+
+Profiles use the form's field vocabulary (``RAW_COLUMNS`` and the answers in
+``field_values``), plus an optional ``"screen hours"`` with the exact slider
+value the factor rules should see. ``POST /predict`` takes one profile object,
+a list of them, or ``{"profiles": [...]}``, and answers with ``{"prediction",
+"interval", "factors", "source"}`` per profile (batches also report the model
+version). ``"interval"`` is ``[lower, upper]`` from the quantiles of the
+per-tree predictions, and ``"low_confidence"`` is true when it is wider than
+``LOW_CONFIDENCE_WIDTH`` hours. When the model has an explainer, each result
+also carries ``"attributions"`` (hours added or removed by each form field)
+and the ``"baseline"`` they start from, which sum to the prediction; they cost
+about a millisecond per distinct profile. Batches are predicted in one
+vectorized pass after the prediction cache and table have answered what they
+can; single profiles can be coalesced across connections by a ``MicroBatcher``
+(``SLEEP_ANALYZER_BATCH_SIZE``).
+
+The server speaks HTTP/1.1 with keep-alive and handles each connection on
+its own thread; ``ModelRegistry`` hot-reloads the model underneath it.
+``GET /health`` reports the model version and ``GET /metrics`` the service's
+Prometheus metrics.
+
+``PredictionClient`` keeps one persistent connection per thread. The app uses
+it instead of loading the model itself when
+``SLEEP_ANALYZER_PREDICTION_SERVICE`` is set to the service URL, so the UI
+and inference can be scaled separately.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from sleep_analyzer.batcher import batcher_from_env
+from sleep_analyzer.cache import cache_from_env
+from sleep_analyzer.features import RAW_COLUMNS, age_range, category_aliases, field_values
+from sleep_analyzer.forest import LOW_CONFIDENCE_WIDTH
+from sleep_analyzer.metrics import Metrics, cache_collector
+from sleep_analyzer.registry import DEFAULT_MODEL_PATH, ModelRegistry
+from sleep_analyzer.rules import RuleSet, profile_inputs, rule_inputs
+from sleep_analyzer.timing import SERVICE_STAGES, StageTimer
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_TIMEOUT = 5.0
+# Largest request the server reads, and most profiles in one batch
+MAX_BODY_BYTES = 8 * 1024 * 1024
+MAX_BATCH = 10_000
+# Idle keep-alive connections are closed after this many seconds
+IDLE_TIMEOUT = 60
+SCREEN_HOURS = 'screen hours'
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileError(ValueError):
+    """A profile is missing a field or has an answer outside the form's vocabulary."""
+
+
+class ServiceError(RuntimeError):
+    """The prediction service could not be reached or rejected a request."""
+
+
+def parse_profile(data):
+    """Validate one JSON profile; returns ``(profile, screen_hours or None)``."""
+    if not isinstance(data, dict):
+        raise ProfileError("a profile must be a JSON object")
+    missing = [column for column in RAW_COLUMNS if column not in data]
+    if missing:
+        raise ProfileError(f"missing fields: {', '.join(missing)}")
+    age = data['Age']
+    if isinstance(age, bool) or not isinstance(age, (int, float)) or not age_range[0] <= age <= age_range[1]:
+        raise ProfileError(f"Age must be a number from {age_range[0]} to {age_range[1]}")
+    profile = {'Age': age}
+    for column in RAW_COLUMNS[1:]:
+        value = data[column]
+        # Answers are strings; anything else (lists, objects) could not even be looked up
+        if not isinstance(value, str):
+            raise ProfileError(f"{column!r} must be one of {field_values[column]}, not {value!r}")
+        if value not in field_values[column] and value not in category_aliases.get(column, {}):
+            raise ProfileError(f"{column!r} must be one of {field_values[column]}, not {value!r}")
+        profile[column] = value
+    screen_hours = data.get(SCREEN_HOURS)
+    if screen_hours is not None and (isinstance(screen_hours, bool) or not isinstance(screen_hours, (int, float))
+                                     or screen_hours < 0):
+        raise ProfileError(f"{SCREEN_HOURS!r} must be a non-negative number")
+    return profile, screen_hours
+
+
+class PredictionService:
+    """Predictions and factor messages for batches of profiles, from a ``ModelRegistry``."""
+
+    def __init__(self, registry, cache=None, rules=None, metrics=None, batcher=None):
+        self.registry = registry
+        self.cache = cache
+        self.rules = rules or RuleSet()
+        self.metrics = metrics
+        self.batcher = batcher
+
+    def predict(self, profiles, screen_hours=None, timer=None, version=None):
+        """One ``{"prediction", "interval", "low_confidence", "factors", "source"}`` dict per validated profile.
+
+        With an explainer on the model version, ``"attributions"`` and
+        ``"baseline"`` are added.
+
+        ``screen_hours`` is a list aligned with ``profiles`` (``None`` where
+        the bucketed answer should be used). ``version`` defaults to the
+        registry's current model.
+        """
+        timer = timer or StageTimer(SERVICE_STAGES)
+        version = version or self.registry.current()
+        n = len(profiles)
+        with timer.stage('predict'):
+            # Columns: prediction, lower, upper; the cache and table store the interval with the prediction
+            answers = np.full((n, 3), np.nan)
+            sources = np.full(n, 'model', dtype=object)
+            if self.cache is not None:
+                for i, profile in enumerate(profiles):
+                    cached = self.cache.get(version.sha256, profile)
+                    if cached is not None:
+                        answers[i], sources[i] = cached, 'cache'
+            # A single profile skips pandas entirely, like the app's submit path
+            frame = pd.DataFrame(profiles, columns=RAW_COLUMNS) if n > 1 else None
+            pending = np.flatnonzero(np.isnan(answers[:, 0]))
+            if len(pending) and version.table is not None:
+                if frame is None:
+                    found = version.table.lookup_interval(profiles[0])
+                    if found is not None:
+                        answers[0] = found
+                else:
+                    answers[pending] = np.column_stack(version.table.predict_interval(frame.iloc[pending]))
+                sources[pending[~np.isnan(answers[pending, 0])]] = 'table'
+                pending = np.flatnonzero(np.isnan(answers[:, 0]))
+            # Only the profiles nothing else answered walk the trees, once for the prediction and its interval
+            if frame is None and len(pending):
+                encoded = version.flat.encode_profile(profiles[0])
+                if self.batcher is not None:
+                    # Concurrent single-profile requests share one model call
+                    answers[0] = self.batcher((version.flat, encoded))
+                else:
+                    answers[0] = version.flat.predict_interval_vector(encoded)
+            elif len(pending):
+                answers[pending] = np.column_stack(version.flat.predict_interval(frame.iloc[pending]))
+            if self.cache is not None:
+                for i in np.flatnonzero(sources != 'cache'):
+                    self.cache.put(version.sha256, profiles[i], answers[i].tolist())
+            predictions, lower, upper = answers.T
+
+        with timer.stage('explain'):
+            inputs = rule_inputs(frame) if frame is not None else profile_inputs(profiles[0])
+            if screen_hours is not None:
+                exact = np.array([np.nan if hours is None else hours for hours in screen_hours], dtype=float)
+                inputs['screen_time_numeric'] = np.where(np.isnan(exact), inputs['screen_time_numeric'], exact)
+            factors = self.rules.explain(inputs, 'factor')
+            strengths = self.rules.explain(inputs, 'strength')
+
+        results = [{'prediction': float(prediction), 'interval': [low, high],
+                    'low_confidence': high - low > LOW_CONFIDENCE_WIDTH, 'factors': f or s, 'source': source}
+                   for prediction, low, high, f, s, source
+                   in zip(predictions.tolist(), lower.tolist(), upper.tolist(), factors, strengths, sources)]
+        if version.explainer is not None:
+            with timer.stage('attribute'):
+                if frame is None:
+                    attributions = [version.explainer.explain_profile(profiles[0])]
+                else:
+                    attributions = version.explainer.explain(frame).to_dict('records')
+                for result, attribution in zip(results, attributions):
+                    result['attributions'] = attribution
+                    result['baseline'] = version.explainer.expected_value
+
+        if self.metrics is not None:
+            for source, count in zip(*np.unique(sources, return_counts=True)):
+                self.metrics.inc('predictions_total', int(count), source=source)
+            low_confidence = int((upper - lower > LOW_CONFIDENCE_WIDTH).sum())
+            if low_confidence:
+                self.metrics.inc('low_confidence_predictions_total', low_confidence)
+        return results
+
+    def handle(self, body):
+        """Answer a decoded ``/predict`` request body; raises ``ProfileError`` on bad input."""
+        timer = StageTimer(SERVICE_STAGES)
+        with timer.stage('parse'):
+            single = isinstance(body, dict) and 'profiles' not in body
+            items = [body] if single else body.get('profiles') if isinstance(body, dict) else body
+            if not isinstance(items, list) or not items:
+                raise ProfileError("expected a profile, a list of profiles or {\"profiles\": [...]}")
+            if len(items) > MAX_BATCH:
+                raise ProfileError(f"at most {MAX_BATCH} profiles per request")
+            profiles, screen_hours = [], []
+            for i, item in enumerate(items):
+                try:
+                    profile, hours = parse_profile(item)
+                except ProfileError as e:
+                    raise ProfileError(str(e) if single else f"profile {i}: {e}") from None
+                profiles.append(profile)
+                screen_hours.append(hours)
+        # Read once, so the reported version is the one that answered even across a hot reload
+        version = self.registry.current()
+        results = self.predict(profiles, screen_hours, timer=timer, version=version)
+        if self.metrics is not None:
+            self.metrics.record(timer, 'service')
+        if single:
+            return results[0]
+        return {'model': version.sha256, 'predictions': results}
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for bursts of new connections while the handler threads start
+    request_queue_size = 128
+
+
+def _handler(service):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        timeout = IDLE_TIMEOUT
+        # Headers and body go out in separate writes; don't let Nagle hold the body back
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/health':
+                version = service.registry.current()
+                self._send(200, {'status': 'ok', 'model': version.sha256, 'loaded_at': version.loaded_at})
+            elif path == '/metrics' and service.metrics is not None:
+                self._send(200, service.metrics.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+            else:
+                self._send(404, {'error': f"no such endpoint: {path}"})
+
+        def do_POST(self):
+            if self.path.split('?')[0] != '/predict':
+                self._send(404, {'error': f"no such endpoint: {self.path}"})
+                return
+            if self.headers.get('Content-Length') is None:
+                self._send(411, {'error': "Content-Length is required"}, close=True)
+                return
+            try:
+                length = int(self.headers['Content-Length'])
+            except ValueError:
+                length = -1
+            if length < 0:
+                # The body cannot be delimited, so the connection cannot be reused either
+                self._send(400, {'error': "Content-Length must be a non-negative integer"}, close=True)
+                return
+            if length > MAX_BODY_BYTES:
+                self._send(413, {'error': f"request body over {MAX_BODY_BYTES} bytes"}, close=True)
+                return
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                self._send(400, {'error': f"invalid JSON: {e}"})
+                return
+            try:
+                result = service.handle(body)
+            except ProfileError as e:
+                self._send(400, {'error': str(e)})
+            except Exception:
+                logger.exception("prediction failed")
+                self._send(500, {'error': "prediction failed"})
+            else:
+                self._send(200, result)
+
+        def _send(self, status, payload, content_type='application/json', close=False):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if close:
+                self.send_header('Connection', 'close')
+                self.close_connection = True
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return PredictionHandler
+
+
+def serve(service, port=DEFAULT_PORT, host=DEFAULT_HOST):
+    """Start serving ``service`` from a daemon thread; returns the server (``port=0`` picks a free port)."""
+    server = PredictionServer((host, port), _handler(service))
+    threading.Thread(target=server.serve_forever, name='prediction-server', daemon=True).start()
+    return server
+
+
+class PredictionClient:
+    """JSON client for a prediction service, with one keep-alive connection per thread."""
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"unsupported prediction service URL {url!r}")
+        self.url = url
+        self.timeout = timeout
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._prefix = parts.path.rstrip('/')
+        self._local = threading.local()
+
+    def predict(self, profile, screen_hours=None):
+        """``{"prediction", "factors", "source"}`` for one raw profile dict."""
+        body = dict(profile) if screen_hours is None else dict(profile, **{SCREEN_HOURS: screen_hours})
+        return self._request('POST', '/predict', body)
+
+    def predict_many(self, profiles):
+        """One result per profile, predicted in a single request."""
+        return self._request('POST', '/predict', {'profiles': list(profiles)})['predictions']
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _request(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = self._connection_class(self._netloc, timeout=self.timeout)
+            try:
+                connection.request(method, self._prefix + path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                # The server closed an idle keep-alive connection; predictions are safe to resend once
+                self.close()
+                if attempt:
+                    raise ServiceError(f"{self.url}: {e}") from e
+                continue
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                raise ServiceError(f"{self.url}: {e}") from e
+            if response.will_close:
+                self.close()
+            try:
+                result = json.loads(data)
+            except ValueError:
+                raise ServiceError(f"{self.url}{path}: HTTP {response.status} with a non-JSON body") from None
+            if response.status != 200:
+                raise ServiceError(f"{self.url}{path}: HTTP {response.status}: {result.get('error')}")
+            return result
+
+
+def client_from_env():
+    """A ``PredictionClient`` for ``SLEEP_ANALYZER_PREDICTION_SERVICE``, or ``None`` when it is unset."""
+    url = os.environ.get('SLEEP_ANALYZER_PREDICTION_SERVICE')
+    if not url:
+        return None
+    return PredictionClient(url, timeout=float(os.environ.get('SLEEP_ANALYZER_PREDICTION_SERVICE_TIMEOUT',
+                                                              DEFAULT_TIMEOUT)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve sleep predictions over HTTP/JSON.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="model pickle or exported .flat file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    try:
+        registry = ModelRegistry(path=args.model)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"cannot load the model: {e}")
+    registry.start_watching()
+    cache = cache_from_env()
+    metrics = Metrics()
+    metrics.collect(cache_collector(cache))
+    service = PredictionService(registry, cache, metrics=metrics, batcher=batcher_from_env(metrics))
+    server = PredictionServer((args.host, args.port), _handler(service))
+    logger.info("serving model %s on http://%s:%d", registry.current().sha256[:12], *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
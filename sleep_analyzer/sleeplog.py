@@ -0,0 +1,264 @@
+"""Durable per-user sleep log backed by SQLite.
+
+Entries live in one table whose primary key is ``(user_id, date)``, so every
+query the Track Progress tab makes (a user's entries in a date window, their
+latest date, aggregates over a window) is a range scan of that index rather
+than a pass over the whole history. The database runs in WAL mode and each
+thread gets its own connection: writers append without blocking the readers
+rendering other sessions.
+
+Dates are stored as ISO ``YYYY-MM-DD`` strings, which sort chronologically.
+
+Aggregates are maintained incrementally: triggers keep a per-user row of
+running totals in ``sleep_totals`` (and a revision counter for cache keys in
+``sleep_revisions``) up to date on every insert, update and delete, so the
+all-time figures are one primary-key read. The rolling 7/30/90-day windows
+with their week-over-week deltas come from one index range scan over at most
+the longest window, which the app caches per revision. Neither cost depends
+on how long a user's history is.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_LOG_PATH = Path(os.environ.get('SLEEP_ANALYZER_SLEEP_LOG', ROOT / '.cache' / 'sleep_log.db'))
+LOG_COLUMNS = ['date', 'hours', 'quality']
+# Nights at or above this many hours count as good sleep
+GOOD_NIGHT_HOURS = 7
+ROLLING_WINDOWS = (7, 30, 90)
+
+# Shown to users who have not logged anything yet; never written to the store
+SAMPLE_ENTRIES = [
+    {'date': '2025-03-24', 'hours': 6.2, 'quality': 3},
+    {'date': '2025-03-25', 'hours': 6.5, 'quality': 3},
+    {'date': '2025-03-26', 'hours': 6.8, 'quality': 4},
+    {'date': '2025-03-27', 'hours': 7.0, 'quality': 4},
+    {'date': '2025-03-28', 'hours': 7.2, 'quality': 4},
+    {'date': '2025-03-29', 'hours': 7.5, 'quality': 5},
+    {'date': '2025-03-30', 'hours': 7.3, 'quality': 4},
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sleep_log (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    hours REAL NOT NULL,
+    quality INTEGER NOT NULL,
+    PRIMARY KEY (user_id, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sleep_totals (
+    user_id TEXT PRIMARY KEY,
+    nights INTEGER NOT NULL,
+    hours REAL NOT NULL,
+    quality INTEGER NOT NULL,
+    good_nights INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS sleep_log_insert AFTER INSERT ON sleep_log BEGIN
+    INSERT INTO sleep_totals VALUES (NEW.user_id, 1, NEW.hours, NEW.quality, NEW.hours >= {good})
+    ON CONFLICT (user_id) DO UPDATE SET
+        nights = nights + 1, hours = hours + NEW.hours, quality = quality + NEW.quality,
+        good_nights = good_nights + (NEW.hours >= {good});
+END;
+
+CREATE TRIGGER IF NOT EXISTS sleep_log_update AFTER UPDATE ON sleep_log BEGIN
+    UPDATE sleep_totals SET
+        hours = hours - OLD.hours + NEW.hours, quality = quality - OLD.quality + NEW.quality,
+        good_nights = good_nights - (OLD.hours >= {good}) + (NEW.hours >= {good})
+    WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS sleep_log_delete AFTER DELETE ON sleep_log BEGIN
+    UPDATE sleep_totals SET
+        nights = nights - 1, hours = hours - OLD.hours, quality = quality - OLD.quality,
+        good_nights = good_nights - (OLD.hours >= {good})
+    WHERE user_id = OLD.user_id;
+END;
+
+CREATE TABLE IF NOT EXISTS sleep_revisions (
+    user_id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS sleep_log_insert_revision AFTER INSERT ON sleep_log BEGIN
+    INSERT INTO sleep_revisions VALUES (NEW.user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS sleep_log_update_revision AFTER UPDATE ON sleep_log BEGIN
+    UPDATE sleep_revisions SET revision = revision + 1 WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS sleep_log_delete_revision AFTER DELETE ON sleep_log BEGIN
+    UPDATE sleep_revisions SET revision = revision + 1 WHERE user_id = OLD.user_id;
+END;
+""".format(good=GOOD_NIGHT_HOURS)
+
+# Totals for databases created before sleep_totals existed
+BACKFILL = f"""
+INSERT OR IGNORE INTO sleep_totals
+SELECT user_id, COUNT(*), SUM(hours), SUM(quality), SUM(hours >= {GOOD_NIGHT_HOURS})
+FROM sleep_log GROUP BY user_id
+"""
+
+
+def iso_date(value):
+    """Normalize a date, datetime or string to ``YYYY-MM-DD``."""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10]).isoformat()
+    if hasattr(value, 'date'):
+        value = value.date()
+    return value.isoformat()
+
+
+class SleepLog:
+    """Thread-safe handle on the sleep-log database; share one per process."""
+
+    def __init__(self, path=DEFAULT_LOG_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        db = self._connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        with db:
+            backfill = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sleep_totals'").fetchone() is None
+            db.executescript(SCHEMA)
+            if backfill:
+                db.execute(BACKFILL)
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(str(self.path), timeout=30)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def add(self, user_id, day, hours, quality):
+        """Record one night, replacing any earlier entry for the same date."""
+        self.add_many(user_id, [{'date': day, 'hours': hours, 'quality': quality}])
+
+    def add_many(self, user_id, entries):
+        """Insert or replace many entries in a single transaction; return how many were written."""
+        rows = [(user_id, iso_date(entry['date']), float(entry['hours']), int(entry['quality']))
+                for entry in entries]
+        return self._upsert(rows)
+
+    def add_frame(self, user_id, frame):
+        """Like ``add_many`` for an already normalized frame with ``LOG_COLUMNS`` (ISO date strings)."""
+        rows = zip(itertools.repeat(user_id), frame['date'].tolist(), frame['hours'].astype(float).tolist(),
+                   frame['quality'].astype(int).tolist())
+        return self._upsert(list(rows))
+
+    def _upsert(self, rows):
+        with self._connection() as db:
+            # An upsert rather than INSERT OR REPLACE, so the update trigger sees the old values
+            db.executemany("INSERT INTO sleep_log VALUES (?, ?, ?, ?) ON CONFLICT (user_id, date) "
+                           "DO UPDATE SET hours = excluded.hours, quality = excluded.quality", rows)
+        return len(rows)
+
+    def entries(self, user_id, start=None, end=None):
+        """A user's entries between ``start`` and ``end`` (inclusive) as a date-sorted DataFrame."""
+        query, params = self._window(user_id, start, end)
+        rows = self._connection().execute(
+            f"SELECT date, hours, quality FROM sleep_log WHERE {query} ORDER BY date", params).fetchall()
+        return pd.DataFrame(rows, columns=LOG_COLUMNS)
+
+    def latest_date(self, user_id):
+        """The most recent logged date for ``user_id``, or ``None`` if they have no entries."""
+        row = self._connection().execute(
+            "SELECT MAX(date) FROM sleep_log WHERE user_id = ?", (user_id,)).fetchone()
+        return date.fromisoformat(row[0]) if row[0] is not None else None
+
+    def revision(self, user_id):
+        """Counter bumped by every write to ``user_id``'s entries, for cache keys."""
+        row = self._connection().execute(
+            "SELECT revision FROM sleep_revisions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def totals(self, user_id):
+        """All-time aggregates for ``user_id``, read from the running totals."""
+        row = self._connection().execute(
+            "SELECT nights, hours, quality, good_nights FROM sleep_totals WHERE user_id = ?", (user_id,)).fetchone()
+        nights, hours, quality, good_nights = row if row is not None else (0, 0.0, 0, 0)
+        return _summary(nights, hours, quality, good_nights)
+
+    def rolling(self, user_id, windows=ROLLING_WINDOWS):
+        """Summaries of the last ``days`` days for each window, plus week-over-week deltas.
+
+        Windows end at the user's latest entry. Returns ``{days: summary}``, with
+        the 7-day summary's ``delta_*`` keys comparing it to the 7 days before.
+        ``None`` if the user has no entries.
+        """
+        end = self.latest_date(user_id)
+        if end is None:
+            return None
+        spans = {days: (end - timedelta(days=days - 1), end) for days in windows}
+        spans['previous'] = (end - timedelta(days=13), end - timedelta(days=7))
+        columns = []
+        params = []
+        for start, stop in spans.values():
+            inside = "date BETWEEN ? AND ?"
+            columns.append(f"COUNT(CASE WHEN {inside} THEN 1 END), SUM(CASE WHEN {inside} THEN hours END), "
+                           f"SUM(CASE WHEN {inside} THEN quality END), "
+                           f"COUNT(CASE WHEN {inside} AND hours >= {GOOD_NIGHT_HOURS} THEN 1 END)")
+            params += [start.isoformat(), stop.isoformat()] * 4
+        first = min(start for start, _ in spans.values())
+        row = self._connection().execute(
+            f"SELECT {', '.join(columns)} FROM sleep_log WHERE user_id = ? AND date >= ?",
+            params + [user_id, first.isoformat()]).fetchone()
+        summaries = {name: _summary(*row[i * 4:i * 4 + 4]) for i, name in enumerate(spans)}
+
+        previous = summaries.pop('previous')
+        week = summaries.get(7)
+        if week is not None:
+            week.update(_deltas(week, previous))
+        return summaries
+
+    def window(self, user_id, days=None):
+        """``(start, end)`` covering the last ``days`` days up to the user's latest entry.
+
+        ``days=None`` covers the whole history (``start`` is ``None``).
+        """
+        end = self.latest_date(user_id)
+        if end is None or days is None:
+            return None, end
+        return end - timedelta(days=days - 1), end
+
+    @staticmethod
+    def _window(user_id, start, end):
+        query, params = "user_id = ?", [user_id]
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(iso_date(start))
+        if end is not None:
+            query += " AND date <= ?"
+            params.append(iso_date(end))
+        return query, params
+
+
+def _summary(nights, hours, quality, good_nights):
+    return {
+        'nights': nights,
+        'avg_hours': hours / nights if nights else None,
+        'avg_quality': quality / nights if nights else None,
+        'good_nights': good_nights or 0,
+    }
+
+
+def _deltas(current, previous):
+    """Change from ``previous`` to ``current``; ``None`` where either period is empty."""
+    if not current['nights'] or not previous['nights']:
+        return {'delta_hours': None, 'delta_quality': None, 'delta_good_nights': None}
+    return {
+        'delta_hours': current['avg_hours'] - previous['avg_hours'],
+        'delta_quality': current['avg_quality'] - previous['avg_quality'],
+        'delta_good_nights': current['good_nights'] - previous['good_nights'],
+    }
@@ -0,0 +1,74 @@
+"""Wall-clock timing of the named stages of one app run."""
+import os
+import time
+from contextlib import contextmanager
+
+# Stages of a prediction submit, with the label shown while each one runs
+PREDICTION_STAGES = {
+    'features': "Building features",
+    'preprocess': "Preprocessing",
+    'predict': "Running the model",
+    'explain': "Explaining the prediction",
+    'whatif': "Exploring habit changes",
+    'render': "Rendering recommendations",
+}
+
+# Stages of a Track Progress render (timed for metrics, no progress bar)
+TRACKER_STAGES = {
+    'load': "Reading the sleep log",
+    'chart': "Drawing the chart",
+    'stats': "Computing sleep stats",
+}
+
+# Stages of a request to the prediction service (timed for metrics)
+SERVICE_STAGES = {
+    'parse': "Reading the request",
+    'predict': "Running the model",
+    'explain': "Matching factor rules",
+    'attribute': "Attributing the prediction",
+}
+
+
+def progress_enabled():
+    """The progress bar can be switched off (e.g. for load tests) with SLEEP_ANALYZER_PROGRESS=0."""
+    return os.environ.get('SLEEP_ANALYZER_PROGRESS', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+class StageTimer:
+    """Record how long each stage takes and report progress as stages finish.
+
+    ``on_progress(fraction, next_label)`` is called after every stage with the
+    share of stages done and the label of the next one (``None`` at the end).
+    """
+
+    def __init__(self, stages=PREDICTION_STAGES, on_progress=None):
+        self.stages = dict(stages)
+        self.on_progress = on_progress
+        self.durations = {}
+        self._started = {}
+
+    def start(self, name):
+        self._started[name] = time.perf_counter()
+
+    def stop(self, name):
+        self.durations[name] = time.perf_counter() - self._started.pop(name)
+        if self.on_progress is not None:
+            pending = [label for stage, label in self.stages.items() if stage not in self.durations]
+            self.on_progress(len(self.durations) / len(self.stages), pending[0] if pending else None)
+
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    @property
+    def total(self):
+        return sum(self.durations.values())
+
+    def summary(self):
+        """One line such as ``"1.2 ms (features 0.1 ms · predict 0.9 ms · ...)"``."""
+        parts = " · ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.durations.items())
+        return f"{self.total * 1000:.1f} ms ({parts})"
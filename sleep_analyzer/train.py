@@ -0,0 +1,385 @@
+"""Reproducible training of the sleep model, replacing the notebook's cells.
+
+Usage::
+
+    python -m sleep_analyzer.train --data Sleep_Analysis.csv --n-jobs -1 --install
+
+Builds the same pipeline as ``main.ipynb`` (``SleepFeatureTransformer``,
+imputing/one-hot preprocessor, ``RandomForestRegressor``), runs a
+cross-validated grid search whose candidate fits are spread over a joblib
+process pool, refits the best parameters with multi-threaded tree fitting
+and writes a versioned artifact directory::
+
+    artifacts/<version>/sleep_model.pkl
+    artifacts/<version>/manifest.json   # data hash, params, CV and test metrics
+
+Every random choice (split, folds, forests) is seeded by ``--seed``, so a
+rerun on the same data gives the same model. ``--install`` then replaces
+``sleep_model.pkl`` atomically, which running apps pick up through
+``ModelRegistry``.
+
+For survey files larger than memory, ``--streaming`` reads the CSV in
+chunks and grows the forest incrementally: each chunk adds
+``--trees-per-chunk`` trees fitted on that chunk alone (``warm_start``), so
+memory is bounded by the chunk size and the result is an ordinary pipeline
+the flat kernel, prediction table and registry all accept. The model stays
+bounded too: streaming trees are limited by ``STREAMING_TREE_PARAMS`` (leaf
+count, leaf size and depth), and once the forest holds ``--max-trees``
+trees each new chunk's trees replace the oldest ones. The one-hot
+categories come from the survey's known answers and the imputer medians from
+the first chunk. ``--benchmark ROWS`` compares both modes on a synthetic
+survey of that size.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import GridSearchCV, KFold, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+from sleep_analyzer.features import (CATEGORICAL_COLUMNS, MODEL_COLUMNS, RAW_COLUMNS, SleepFeatureTransformer,
+                                     field_values, random_profiles)
+from sleep_analyzer.forest import DEFAULT_EXPORT_PATH, FlatForest, verify
+from sleep_analyzer.lookup import file_digest
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_DATA_PATH = ROOT / 'Sleep_Analysis.csv'
+DEFAULT_OUTPUT_DIR = ROOT / 'artifacts'
+DEFAULT_MODEL_PATH = ROOT / 'sleep_model.pkl'
+TARGET = 'sleep time'
+DEFAULT_SEED = 42
+TEST_SIZE = 0.2
+
+# Searched unless --no-search; the notebook's parameters are the first candidate
+PARAM_GRID = {
+    'regressor__n_estimators': [100, 200],
+    'regressor__max_depth': [None, 5, 10],
+    'regressor__min_samples_leaf': [1, 2, 4],
+}
+NOTEBOOK_PARAMS = {'regressor__n_estimators': 100, 'regressor__max_depth': None, 'regressor__min_samples_leaf': 1}
+DEFAULT_CHUNK_SIZE = 100_000
+DEFAULT_TREES_PER_CHUNK = 10
+# Streaming fits keep at most this many trees, each within these limits, however much data they see
+DEFAULT_MAX_TREES = 100
+STREAMING_TREE_PARAMS = {
+    'regressor__max_leaf_nodes': 1024,
+    'regressor__min_samples_leaf': 5,
+    'regressor__max_depth': 20,
+}
+# Rows held out across all chunks for the streaming test metrics
+HOLDOUT_ROWS = 50_000
+
+
+def build_pipeline(seed=DEFAULT_SEED, n_jobs=None, known_categories=False):
+    """The model pipeline, unfitted, exactly as the notebook builds it.
+
+    ``known_categories`` fixes the one-hot columns to every survey answer
+    instead of those seen in the training data (needed when fitting on a
+    sample, as streaming training does).
+    """
+    numerical_features = [column for column in MODEL_COLUMNS if column not in CATEGORICAL_COLUMNS]
+    categories = [field_values[column] for column in CATEGORICAL_COLUMNS] if known_categories else 'auto'
+    preprocessor = ColumnTransformer(transformers=[
+        ('num', Pipeline(steps=[('imputer', SimpleImputer(strategy='median'))]), numerical_features),
+        ('cat', Pipeline(steps=[
+            ('imputer', SimpleImputer(strategy='most_frequent')),
+            ('onehot', OneHotEncoder(categories=categories, handle_unknown='ignore')),
+        ]), CATEGORICAL_COLUMNS),
+    ])
+    return Pipeline(steps=[
+        ('features', SleepFeatureTransformer()),
+        ('preprocessor', preprocessor),
+        ('regressor', RandomForestRegressor(n_estimators=100, random_state=seed, n_jobs=n_jobs)),
+    ])
+
+
+def load_data(path=DEFAULT_DATA_PATH):
+    data = pd.read_csv(path)
+    return data[RAW_COLUMNS], data[TARGET]
+
+
+def search(X, y, seed=DEFAULT_SEED, cv=5, n_jobs=-1, param_grid=PARAM_GRID):
+    """Cross-validated grid search; candidate fits run in parallel worker processes.
+
+    Forests are single-threaded inside the search so the pool is not
+    oversubscribed. Returns the fitted ``GridSearchCV`` (not refitted).
+    """
+    folds = KFold(n_splits=cv, shuffle=True, random_state=seed)
+    grid = GridSearchCV(build_pipeline(seed, n_jobs=1), param_grid, cv=folds, scoring='neg_mean_absolute_error',
+                        n_jobs=n_jobs, refit=False)
+    grid.fit(X, y)
+    return grid
+
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield ``(X, y)`` chunks of a survey CSV without loading the whole file."""
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        yield chunk[RAW_COLUMNS], chunk[TARGET]
+
+
+def fit_streaming(chunks, seed=DEFAULT_SEED, n_jobs=-1, trees_per_chunk=DEFAULT_TREES_PER_CHUNK,
+                  params=None, holdout_fraction=TEST_SIZE, holdout_rows=HOLDOUT_ROWS, max_trees=DEFAULT_MAX_TREES):
+    """Grow a forest chunk by chunk; returns ``(model, X_holdout, y_holdout, rows_seen)``.
+
+    A seeded ``holdout_fraction`` of each chunk (up to ``holdout_rows`` in
+    total) is kept aside for evaluation; the rest trains that chunk's trees.
+    Trees are limited by ``STREAMING_TREE_PARAMS`` (``params`` may override
+    them) and the forest never holds more than ``max_trees``: past that, a
+    chunk's trees replace the oldest ones.
+    """
+    if trees_per_chunk > max_trees:
+        raise ValueError(f"trees_per_chunk ({trees_per_chunk}) is larger than max_trees ({max_trees})")
+    rng = np.random.default_rng(seed)
+    model = build_pipeline(seed, n_jobs=n_jobs, known_categories=True)
+    model.set_params(**STREAMING_TREE_PARAMS)
+    if params:
+        model.set_params(**{name: value for name, value in params.items() if name != 'regressor__n_estimators'})
+    features, preprocessor, regressor = (step for _, step in model.steps)
+    regressor.set_params(warm_start=True, n_estimators=0)
+    features.fit()
+
+    holdout_X, holdout_y, held, rows = [], [], 0, 0
+    for X, y in chunks:
+        rows += len(X)
+        keep = rng.random(len(X)) < holdout_fraction if held < holdout_rows else np.zeros(len(X), dtype=bool)
+        keep &= np.cumsum(keep) <= holdout_rows - held
+        if keep.any():
+            holdout_X.append(X[keep])
+            holdout_y.append(y[keep])
+            held += int(keep.sum())
+        X, y = X[~keep], y[~keep]
+
+        engineered = features.transform(X)
+        if regressor.n_estimators == 0:
+            preprocessor.fit(engineered)
+        grown = len(getattr(regressor, 'estimators_', []))
+        if grown + trees_per_chunk > max_trees:
+            # Drop the oldest trees so warm_start refills the forest to max_trees with this chunk's
+            regressor.estimators_ = regressor.estimators_[grown + trees_per_chunk - max_trees:]
+            regressor.n_estimators = max_trees
+        else:
+            regressor.n_estimators = grown + trees_per_chunk
+        # A fresh seed per chunk, so trees refitted into a freed slot do not reuse its seed
+        regressor.set_params(random_state=int(rng.integers(2 ** 31)))
+        regressor.fit(preprocessor.transform(engineered), y)
+
+    regressor.set_params(warm_start=False)
+    empty = pd.DataFrame(columns=RAW_COLUMNS)
+    X_holdout = pd.concat(holdout_X, ignore_index=True) if holdout_X else empty
+    y_holdout = pd.concat(holdout_y, ignore_index=True) if holdout_y else pd.Series(dtype=float)
+    return model, X_holdout, y_holdout, rows
+
+
+def train(data_path=DEFAULT_DATA_PATH, output_dir=DEFAULT_OUTPUT_DIR, seed=DEFAULT_SEED, n_jobs=-1, cv=5,
+          run_search=True, streaming=False, chunk_size=DEFAULT_CHUNK_SIZE, trees_per_chunk=DEFAULT_TREES_PER_CHUNK,
+          max_trees=DEFAULT_MAX_TREES):
+    """Train, evaluate and write a versioned artifact; returns ``(artifact_dir, manifest)``.
+
+    ``streaming`` trains out of core with ``fit_streaming`` (no search).
+    """
+    started = time.perf_counter()
+    cv_results = None
+    params = dict(NOTEBOOK_PARAMS)
+    if streaming:
+        model, X_test, y_test, rows = fit_streaming(read_chunks(data_path, chunk_size), seed=seed, n_jobs=n_jobs,
+                                                    trees_per_chunk=trees_per_chunk, max_trees=max_trees)
+        regressor = model.named_steps['regressor']
+        params = {'regressor__n_estimators': regressor.n_estimators,
+                  **{name: regressor.get_params()[name.split('__')[1]] for name in STREAMING_TREE_PARAMS},
+                  'streaming_chunk_size': chunk_size, 'streaming_trees_per_chunk': trees_per_chunk,
+                  'streaming_max_trees': max_trees}
+    else:
+        X, y = load_data(data_path)
+        rows = len(X)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=seed)
+        if run_search:
+            grid = search(X_train, y_train, seed=seed, cv=cv, n_jobs=n_jobs)
+            params = grid.best_params_
+            cv_results = {
+                'best_mae': -grid.best_score_,
+                'candidates': len(grid.cv_results_['params']),
+                'folds': cv,
+            }
+        model = build_pipeline(seed, n_jobs=n_jobs).set_params(**params)
+        model.fit(X_train, y_train)
+
+    y_pred = model.predict(X_test)
+    # Serve single rows without spinning up a thread pool per prediction
+    model.set_params(regressor__n_jobs=None)
+
+    created = datetime.now(timezone.utc)
+    artifact_dir = Path(output_dir) / f"{created:%Y%m%dT%H%M%SZ}"
+    artifact_dir.mkdir(parents=True, exist_ok=False)
+    model_path = artifact_dir / 'sleep_model.pkl'
+    joblib.dump(model, model_path)
+
+    manifest = {
+        'version': artifact_dir.name,
+        'created': created.isoformat(),
+        'model_sha256': file_digest(model_path),
+        'data': {'path': str(data_path), 'sha256': file_digest(data_path), 'rows': rows},
+        'seed': seed,
+        'params': {name: value for name, value in params.items()},
+        'cv': cv_results,
+        'test': {
+            'rows': len(X_test),
+            'mae': mean_absolute_error(y_test, y_pred),
+            'r2': r2_score(y_test, y_pred),
+        },
+        'train_seconds': time.perf_counter() - started,
+        'versions': {'python': platform.python_version(), 'sklearn': sklearn.__version__,
+                     'numpy': np.__version__, 'pandas': pd.__version__},
+    }
+    (artifact_dir / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+    return artifact_dir, manifest
+
+
+def synthetic_survey(path, rows, seed=DEFAULT_SEED, model_path=DEFAULT_MODEL_PATH, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write a survey CSV of ``rows`` random profiles, labelled by the current model plus noise."""
+    rng = np.random.default_rng(seed)
+    model = joblib.load(model_path)
+    with open(path, 'w', newline='') as f:
+        for start in range(0, rows, chunk_size):
+            n = min(chunk_size, rows - start)
+            chunk = random_profiles(rng, n)
+            chunk[TARGET] = (model.predict(chunk) + rng.normal(0, 0.5, n)).round(1)
+            chunk.to_csv(f, index=False, header=start == 0)
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process, or ``None`` where ``resource`` is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _benchmark_run(mode, data_path, seed, n_jobs, chunk_size, trees_per_chunk, max_trees, queue):
+    started = time.perf_counter()
+    if mode == 'full-batch':
+        X, y = load_data(data_path)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=seed)
+        model = build_pipeline(seed, n_jobs=n_jobs).fit(X_train, y_train)
+    else:
+        model, X_test, y_test, _ = fit_streaming(read_chunks(data_path, chunk_size), seed=seed, n_jobs=n_jobs,
+                                                 trees_per_chunk=trees_per_chunk, max_trees=max_trees)
+    seconds = time.perf_counter() - started
+    # Score both modes on the same rows: the first HOLDOUT_ROWS of the file
+    X_eval, y_eval = next(read_chunks(data_path, HOLDOUT_ROWS))
+    queue.put({
+        'mode': mode,
+        'seconds': seconds,
+        'own_holdout_mae': mean_absolute_error(y_test, model.predict(X_test)),
+        'first_rows_mae': mean_absolute_error(y_eval, model.predict(X_eval)),
+        'trees': model.named_steps['regressor'].n_estimators,
+        'nodes': sum(tree.tree_.node_count for tree in model.named_steps['regressor'].estimators_),
+        'depth': max(tree.tree_.max_depth for tree in model.named_steps['regressor'].estimators_),
+        'peak_rss_mb': _peak_rss_mb(),
+    })
+
+
+def benchmark(rows, seed=DEFAULT_SEED, n_jobs=-1, chunk_size=DEFAULT_CHUNK_SIZE,
+              trees_per_chunk=DEFAULT_TREES_PER_CHUNK, max_trees=DEFAULT_MAX_TREES):
+    """Full-batch vs streaming training on a synthetic survey; returns one result dict per mode.
+
+    Each mode runs in a fresh process so peak RSS is comparable. The
+    ``first_rows_mae`` of the full-batch run is optimistic: it trained on
+    most of those rows.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = Path(tmp) / 'survey.csv'
+        synthetic_survey(data_path, rows, seed=seed)
+        context = multiprocessing.get_context('spawn')
+        for mode in ('full-batch', 'streaming'):
+            queue = context.Queue()
+            process = context.Process(target=_benchmark_run,
+                                      args=(mode, data_path, seed, n_jobs, chunk_size, trees_per_chunk, max_trees,
+                                            queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+    return results
+
+
+def install(artifact_dir, model_path=DEFAULT_MODEL_PATH, flat_path=DEFAULT_EXPORT_PATH):
+    """Copy an artifact's model over ``model_path`` atomically.
+
+    The exported forest is written first, so running apps that pick up the
+    new pickle find arrays for it and never unpickle it. Nothing is
+    published unless the forest reproduces ``model.predict``.
+    """
+    artifact = Path(artifact_dir) / 'sleep_model.pkl'
+    model = joblib.load(artifact)
+    forest = FlatForest.from_pipeline(model)
+    if not verify(forest, model):
+        raise ValueError(f"flattened forest does not reproduce model.predict for {artifact}; not installing it")
+    forest.save(flat_path, model_sha256=file_digest(artifact))
+    tmp = Path(model_path).with_suffix(f'.{os.getpid()}.tmp')
+    shutil.copyfile(artifact, tmp)
+    os.replace(tmp, model_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the sleep model and write a versioned artifact.")
+    parser.add_argument('--data', default=DEFAULT_DATA_PATH, help="survey CSV with the Sleep_Analysis.csv columns")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_DIR, help="directory for versioned artifacts")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="seed for the split, CV folds and forests")
+    parser.add_argument('--n-jobs', type=int, default=-1,
+                        help="worker processes for the search and threads for the final fit (-1: all cores)")
+    parser.add_argument('--cv', type=int, default=5, help="cross-validation folds")
+    parser.add_argument('--no-search', action='store_true', help="train the notebook's parameters only")
+    parser.add_argument('--install', action='store_true', help="replace sleep_model.pkl with the new model")
+    parser.add_argument('--streaming', action='store_true', help="train out of core, one chunk at a time")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per streaming chunk")
+    parser.add_argument('--trees-per-chunk', type=int, default=DEFAULT_TREES_PER_CHUNK,
+                        help="trees each streaming chunk adds to the forest")
+    parser.add_argument('--max-trees', type=int, default=DEFAULT_MAX_TREES,
+                        help="most trees a streaming forest keeps; later chunks replace the oldest")
+    parser.add_argument('--benchmark', type=int, metavar='ROWS',
+                        help="compare full-batch and streaming training on a synthetic survey of ROWS rows")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        for result in benchmark(args.benchmark, seed=args.seed, n_jobs=args.n_jobs, chunk_size=args.chunk_size,
+                                trees_per_chunk=args.trees_per_chunk, max_trees=args.max_trees):
+            rss = f", peak RSS {result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else ""
+            print(f"{result['mode']:>10}: {result['seconds']:7.1f} s, {result['trees']} trees "
+                  f"({result['nodes']} nodes, depth {result['depth']}), "
+                  f"holdout MAE {result['own_holdout_mae']:.3f} h, "
+                  f"first-rows MAE {result['first_rows_mae']:.3f} h{rss}")
+        return
+
+    artifact_dir, manifest = train(args.data, args.output, seed=args.seed, n_jobs=args.n_jobs, cv=args.cv,
+                                   run_search=not args.no_search, streaming=args.streaming,
+                                   chunk_size=args.chunk_size, trees_per_chunk=args.trees_per_chunk,
+                                   max_trees=args.max_trees)
+    print(f"wrote {artifact_dir} in {manifest['train_seconds']:.1f} s: "
+          f"test MAE {manifest['test']['mae']:.3f} h, R² {manifest['test']['r2']:.3f}")
+    if args.install:
+        try:
+            install(artifact_dir)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"installed {manifest['model_sha256'][:12]} as {DEFAULT_MODEL_PATH.name}")
+
+
+if __name__ == '__main__':
+    main()
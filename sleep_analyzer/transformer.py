@@ -0,0 +1,32 @@
+"""The sklearn step that runs ``features.transform_features`` inside the model pipeline.
+
+It is kept out of ``sleep_analyzer.features`` so that building features (in
+the app, the rules and the flat kernel) never imports sklearn. The class is
+published as ``sleep_analyzer.features.SleepFeatureTransformer``, the name
+existing pickles refer to.
+"""
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from sleep_analyzer.features import MODEL_COLUMNS, compile_lookups, transform_features
+
+
+class SleepFeatureTransformer(BaseEstimator, TransformerMixin):
+    """Turn raw survey rows into the frame the model's preprocessor expects.
+
+    ``fit`` compiles the answer mappings into integer-indexed arrays, so
+    ``transform`` is one hash lookup and one array gather per column plus
+    two multiplies for the interaction terms.
+    """
+
+    __module__ = 'sleep_analyzer.features'
+
+    def fit(self, X=None, y=None):
+        self.lookups_ = compile_lookups()
+        return self
+
+    def transform(self, X):
+        return transform_features(X, self.lookups_)
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(MODEL_COLUMNS, dtype=object)
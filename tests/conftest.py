@@ -0,0 +1,24 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from sleep_analyzer.features import RAW_COLUMNS, random_profiles
+from sleep_analyzer.forest import DEFAULT_DATA_PATH, DEFAULT_MODEL_PATH, FlatForest
+
+
+@pytest.fixture(scope='session')
+def model():
+    return joblib.load(DEFAULT_MODEL_PATH)
+
+
+@pytest.fixture(scope='session')
+def forest(model):
+    return FlatForest.from_pipeline(model)
+
+
+@pytest.fixture(scope='session')
+def survey():
+    """The survey rows plus seeded random profiles covering every answer."""
+    rows = pd.read_csv(DEFAULT_DATA_PATH)[RAW_COLUMNS]
+    return pd.concat([rows, random_profiles(np.random.default_rng(0), 300)], ignore_index=True)
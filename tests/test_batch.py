@@ -0,0 +1,11 @@
+import numpy as np
+
+from sleep_analyzer.batch import predict_interval_batch
+
+
+def test_interval_batch_matches_the_compiled_forest(model, forest, survey):
+    predictions, lower, upper = predict_interval_batch(model, survey, chunk_size=100)
+    expected = forest.predict_interval(survey)
+    assert np.array_equal(predictions, model.predict(survey))
+    for actual, wanted in zip((predictions, lower, upper), expected):
+        assert np.array_equal(actual, wanted)
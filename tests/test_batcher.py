@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from sleep_analyzer.batcher import MicroBatcher
+
+
+def recording_batcher(**kwargs):
+    sizes = []
+
+    def double(items):
+        sizes.append(len(items))
+        return [item * 2 for item in items]
+    return MicroBatcher(double, **kwargs), sizes
+
+
+def test_rows_queued_within_max_wait_share_one_batch():
+    batcher, sizes = recording_batcher(max_batch=16, max_wait=0.2)
+    try:
+        assert batcher(1, timeout=5) == 2
+        # A lone request first must not stop later ones arriving within max_wait from being grouped
+        futures = []
+        for i in range(3):
+            futures.append(batcher.submit(i))
+            time.sleep(0.02)
+        assert [future.result(5) for future in futures] == [0, 2, 4]
+    finally:
+        batcher.close()
+    assert sizes == [1, 3]
+
+
+def test_full_batch_runs_without_waiting():
+    batcher, sizes = recording_batcher(max_batch=3, max_wait=10)
+    try:
+        futures = [batcher.submit(i) for i in range(6)]
+        assert [future.result(5) for future in futures] == [0, 2, 4, 6, 8, 10]
+    finally:
+        batcher.close()
+    assert sizes == [3, 3]
+
+
+def test_short_result_list_fails_every_future():
+    batcher = MicroBatcher(lambda items: items[:-1], max_batch=4, max_wait=0.2)
+    try:
+        futures = [batcher.submit(i) for i in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="2 results for 3 items"):
+                future.result(5)
+    finally:
+        batcher.close()
+
+
+def test_batch_function_errors_reach_every_caller():
+    def fail(items):
+        raise ValueError("boom")
+    batcher = MicroBatcher(fail, max_wait=0)
+    try:
+        with pytest.raises(ValueError, match="boom"):
+            batcher(1, timeout=5)
+    finally:
+        batcher.close()
@@ -0,0 +1,88 @@
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+
+from sleep_analyzer.cache import PredictionCache
+from sleep_analyzer.features import random_profiles
+
+
+@pytest.fixture
+def profiles():
+    return random_profiles(np.random.default_rng(0), 4).to_dict('records')
+
+
+def disk_rows(path):
+    with sqlite3.connect(path) as db:
+        return sorted(db.execute("SELECT version, count(*) FROM predictions GROUP BY version").fetchall())
+
+
+def test_hit_and_miss(profiles):
+    cache = PredictionCache()
+    assert cache.get('v1', profiles[0]) is None
+    cache.put('v1', profiles[0], (7.0, 6.0, 8.0))
+    assert cache.get('v1', profiles[0]) == (7.0, 6.0, 8.0)
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+
+def test_aliased_answers_share_an_entry(profiles):
+    cache = PredictionCache()
+    cache.put('v1', dict(profiles[0], Age=30), (7.0, 6.0, 8.0))
+    assert cache.get('v1', dict(profiles[0], Age=30.0)) == (7.0, 6.0, 8.0)
+
+
+def test_entries_expire_after_ttl(profiles):
+    cache = PredictionCache(ttl=0.05)
+    cache.put('v1', profiles[0], (7.0, 6.0, 8.0))
+    time.sleep(0.1)
+    assert cache.get('v1', profiles[0]) is None
+
+
+def test_least_recently_used_entry_is_evicted(profiles):
+    cache = PredictionCache(maxsize=2)
+    for i, profile in enumerate(profiles[:2]):
+        cache.put('v1', profile, (i, i, i))
+    cache.get('v1', profiles[0])
+    cache.put('v1', profiles[2], (2, 2, 2))
+    assert cache.get('v1', profiles[1]) is None
+    assert cache.get('v1', profiles[0]) == (0.0, 0.0, 0.0)
+    assert cache.stats().evictions == 1
+
+
+def test_new_version_drops_the_old_entries(profiles):
+    cache = PredictionCache()
+    cache.put('v1', profiles[0], (7.0, 6.0, 8.0))
+    assert cache.get('v2', profiles[0]) is None
+    assert cache.get('v1', profiles[0]) is None
+
+
+def test_disk_store_survives_a_restart(tmp_path, profiles):
+    path = tmp_path / 'cache.sqlite'
+    PredictionCache(path=path).put('v1', profiles[0], (7.0, 6.0, 8.0))
+    assert PredictionCache(path=path).get('v1', profiles[0]) == (7.0, 6.0, 8.0)
+
+
+def test_old_version_process_keeps_the_new_versions_rows(tmp_path, profiles):
+    path = tmp_path / 'cache.sqlite'
+    old, new = PredictionCache(path=path), PredictionCache(path=path)
+    old.put('old', profiles[0], (7.0, 6.0, 8.0))
+    time.sleep(0.01)
+    new.put('new', profiles[0], (6.0, 5.0, 7.0))
+    # A process still on the old model writes during the rollout
+    old.put('old', profiles[1], (7.0, 6.0, 8.0))
+    assert disk_rows(path) == [('new', 1), ('old', 1)]
+    assert PredictionCache(path=path).get('new', profiles[0]) == (6.0, 5.0, 7.0)
+    # The newer version's next sweep drops the superseded rows
+    assert disk_rows(path) == [('new', 1)]
+
+
+def test_expired_rows_are_deleted_from_disk(tmp_path, profiles, monkeypatch):
+    monkeypatch.setattr('sleep_analyzer.cache.PURGE_INTERVAL', 0.0)
+    path = tmp_path / 'cache.sqlite'
+    cache = PredictionCache(path=path, ttl=0.05)
+    cache.put('v1', profiles[0], (7.0, 6.0, 8.0))
+    time.sleep(0.1)
+    cache.put('v1', profiles[1], (7.0, 6.0, 8.0))
+    assert disk_rows(path) == [('v1', 1)]
@@ -0,0 +1,66 @@
+from itertools import combinations
+from math import factorial
+
+import numpy as np
+import pytest
+
+from sleep_analyzer.explain import TreeExplainer
+from sleep_analyzer.features import RAW_COLUMNS
+from sleep_analyzer.forest import FlatForest
+from sleep_analyzer.train import build_pipeline, load_data
+
+
+@pytest.fixture(scope='module')
+def explainer(forest):
+    return TreeExplainer(forest)
+
+
+def test_attributions_add_up_to_the_prediction(explainer, forest, survey):
+    values = explainer.explain(survey)
+    assert list(values.columns) == RAW_COLUMNS
+    np.testing.assert_allclose(explainer.expected_value + values.sum(axis=1), forest.predict(survey), atol=1e-9)
+
+
+def test_profile_attributions_match_the_batch(explainer, survey):
+    values = explainer.explain(survey.iloc[:20])
+    for (_, row), profile in zip(values.iterrows(), survey.iloc[:20].to_dict('records')):
+        assert explainer.explain_profile(profile) == pytest.approx(row.to_dict(), abs=1e-12)
+
+
+def _expectation(tree, x, known, node=0):
+    """Path-dependent expected output of ``tree`` when only the ``known`` features of ``x`` are given."""
+    if tree.children_left[node] == -1:
+        return tree.value[node, 0, 0]
+    left, right = tree.children_left[node], tree.children_right[node]
+    if tree.feature[node] in known:
+        return _expectation(tree, x, known, left if x[tree.feature[node]] <= tree.threshold[node] else right)
+    weight = tree.weighted_n_node_samples
+    return (weight[left] * _expectation(tree, x, known, left)
+            + weight[right] * _expectation(tree, x, known, right)) / weight[node]
+
+
+def _brute_force_shap(trees, x, n_features):
+    """Exact Shapley values of the forest's path-dependent expectation, over every feature subset."""
+    used = sorted({int(f) for tree in trees for f in tree.feature if f >= 0})
+    m = len(used)
+    values = np.zeros(n_features)
+    for i in used:
+        others = [f for f in used if f != i]
+        for size in range(m):
+            weight = factorial(size) * factorial(m - size - 1) / factorial(m)
+            for subset in combinations(others, size):
+                known = set(subset)
+                gain = sum(_expectation(t, x, known | {i}) - _expectation(t, x, known) for t in trees)
+                values[i] += weight * gain / len(trees)
+    return values
+
+
+def test_matches_brute_force_shapley_values_on_a_small_forest(survey):
+    model = build_pipeline(n_jobs=1).set_params(regressor__n_estimators=3, regressor__max_depth=3)
+    model.fit(*load_data())
+    forest = FlatForest.from_pipeline(model)
+    explainer = TreeExplainer(forest)
+    trees = [estimator.tree_ for estimator in model.named_steps['regressor'].estimators_]
+    X = forest.encode(survey.iloc[:10])
+    expected = np.array([_brute_force_shap(trees, x, forest.n_features) for x in X])
+    np.testing.assert_allclose(explainer.shap_values(X), expected, atol=1e-9)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from sleep_analyzer.forest import FlatForest, verify
+
+
+def test_predict_matches_the_pipeline_bit_for_bit(model, forest, survey):
+    assert np.array_equal(forest.predict(survey), model.predict(survey))
+
+
+def test_single_row_kernels_match_the_batch_kernel(forest, survey):
+    expected = forest.predict(survey)
+    profiles = survey.to_dict('records')
+    assert [forest.predict_profile(profile) for profile in profiles] == expected.tolist()
+    for profile, wanted in zip(profiles[:50], zip(*forest.predict_interval(survey.iloc[:50]))):
+        assert forest.predict_interval_vector(forest.encode_profile(profile)) == tuple(wanted)
+
+
+def test_interval_brackets_the_per_tree_spread(forest, survey):
+    predictions, lower, upper = forest.predict_interval(survey)
+    assert np.array_equal(predictions, forest.predict(survey))
+    assert (lower <= upper).all()
+    leaves = forest.leaf_values(forest.encode(survey))
+    assert (lower >= leaves.min(axis=0)).all() and (upper <= leaves.max(axis=0)).all()
+
+
+def test_saved_forest_loads_identically(tmp_path, model, forest, survey):
+    path = tmp_path / 'model.flat'
+    forest.save(path, model_sha256='abc')
+    loaded = FlatForest.load(path)
+    assert loaded.metadata['model_sha256'] == 'abc'
+    assert np.array_equal(loaded.predict(survey), model.predict(survey))
+
+
+def test_verify_rejects_a_forest_that_drifts(model, forest):
+    assert verify(forest, model)
+    drifted = FlatForest(dict(forest.arrays, value=forest.arrays['value'] * 1.01))
+    assert not verify(drifted, model)
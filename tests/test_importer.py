@@ -0,0 +1,60 @@
+import io
+
+import pandas as pd
+import pytest
+
+from sleep_analyzer.importer import DEFAULT_QUALITY, import_export, normalize
+from sleep_analyzer.sleeplog import SleepLog
+
+
+def test_mixed_utc_offsets_keep_each_nights_local_date(tmp_path):
+    export = io.BytesIO(b"start,minutesAsleep\n"
+                        b"2020-03-07 23:00:00 -0500,420\n"
+                        b"2020-03-09 23:00:00 -0400,450\n"
+                        b"not a date,400\n")
+    log = SleepLog(tmp_path / 'log.sqlite')
+    report = import_export(log, 'u', export, name='export.csv')
+    assert (report.imported, report.invalid) == (2, 1)
+    assert log.entries('u')['date'].tolist() == ['2020-03-07', '2020-03-09']
+
+
+def test_normalize_parses_mixed_offsets_per_value():
+    chunk = pd.DataFrame({'start': ['2020-03-07T23:00:00-05:00', '2020-03-09T23:00:00-04:00'], 'hours': [7, 8]})
+    entries, invalid = normalize(chunk)
+    assert invalid == 0
+    assert entries['date'].tolist() == ['2020-03-07', '2020-03-09']
+
+
+def test_minutes_become_hours_and_scores_become_the_1_to_5_scale():
+    chunk = pd.DataFrame({
+        'dateOfSleep': ['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04'],
+        'minutesAsleep': [450, 390, 0, 1500],
+        'sleep_score': [83, 4, 50, 70],
+    })
+    entries, invalid = normalize(chunk)
+    assert invalid == 2   # no sleep, and more than 24 hours
+    assert entries['hours'].tolist() == [7.5, 6.5]
+    assert entries['quality'].tolist() == [5, 4]
+
+
+def test_hours_column_wins_and_missing_quality_defaults():
+    chunk = pd.DataFrame({'Date': ['2024-01-01'], 'hours': [7.25], 'minutes': [999]})
+    entries, _ = normalize(chunk)
+    assert entries['hours'].tolist() == [7.25]
+    assert entries['quality'].tolist() == [DEFAULT_QUALITY]
+
+
+def test_exports_without_a_date_or_duration_are_refused():
+    with pytest.raises(ValueError, match="no date column"):
+        normalize(pd.DataFrame({'hours': [7]}))
+    with pytest.raises(ValueError, match="no duration column"):
+        normalize(pd.DataFrame({'date': ['2024-01-01']}))
+
+
+def test_last_row_for_a_date_wins_across_chunks(tmp_path):
+    export = io.BytesIO(b'[{"date": "2024-01-01", "hours": 6}, {"date": "2024-01-02", "hours": 7},'
+                        b' {"date": "2024-01-01", "hours": 8}]')
+    log = SleepLog(tmp_path / 'log.sqlite')
+    report = import_export(log, 'u', export, chunk_size=2, name='export.json')
+    assert (report.imported, report.duplicates) == (2, 1)
+    assert log.entries('u')['hours'].tolist() == [8, 7]
@@ -0,0 +1,88 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from sleep_analyzer import modelfile
+
+ARRAYS = {
+    'feature': np.array([0, 3, -1], dtype=np.int32),
+    'threshold': np.array([0.5, 1.25, np.nan]),
+    'mask': np.array([[True, False], [False, True]]),
+    'labels': np.array(['yes', 'no', 'sometimes']),
+    'depth': np.int32(7),
+}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'arrays.flat'
+    modelfile.save(path, ARRAYS, {'model_sha256': 'abc'})
+    return path
+
+
+def write_header(path, header):
+    encoded = json.dumps(header).encode('utf-8')
+    path.write_bytes(modelfile.MAGIC + struct.pack('<I', len(encoded)) + encoded)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(path, mmap):
+    metadata, arrays = modelfile.load(path, mmap=mmap)
+    assert metadata == {'model_sha256': 'abc'}
+    assert arrays.keys() == ARRAYS.keys()
+    for name, array in ARRAYS.items():
+        np.testing.assert_array_equal(arrays[name], array)
+        assert arrays[name].dtype == array.dtype
+        assert arrays[name].shape == np.shape(array)
+
+
+def test_header_is_read_without_the_data(path):
+    header = modelfile.read_header(path)
+    assert header['metadata'] == {'model_sha256': 'abc'}
+    assert header['arrays']['mask']['shape'] == [2, 2]
+
+
+def test_object_arrays_are_refused_on_save(tmp_path):
+    with pytest.raises(TypeError):
+        modelfile.save(tmp_path / 'bad.flat', {'objects': np.array([{}, []], dtype=object)})
+
+
+def test_truncated_data_is_refused(path):
+    path.write_bytes(path.read_bytes()[:-8])
+    with pytest.raises(ValueError, match="runs past the end"):
+        modelfile.load(path)
+
+
+def test_truncated_header_is_refused(path):
+    path.write_bytes(path.read_bytes()[:20])
+    with pytest.raises(ValueError, match="unreadable model file header"):
+        modelfile.load(path)
+
+
+@pytest.mark.parametrize('content', [b'', b'SLEEP', b'PK\x03\x04' + b'\0' * 32])
+def test_other_files_are_refused(tmp_path, content):
+    path = tmp_path / 'other.flat'
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match="not a sleep-analyzer model file"):
+        modelfile.load(path)
+
+
+@pytest.mark.parametrize('header, message', [
+    ([1], "malformed model file header"),
+    ({'version': 2, 'metadata': {}, 'arrays': {}}, "unsupported model file version"),
+    ({'version': 1, 'metadata': {}}, "malformed model file header"),
+    ({'version': 1, 'metadata': {}, 'arrays': {'a': {'dtype': '<f8', 'shape': [2]}}}, "malformed header entry"),
+    ({'version': 1, 'metadata': {}, 'arrays': {'a': {'dtype': '|O', 'shape': [2], 'offset': 0}}},
+     "unsupported dtype"),
+    ({'version': 1, 'metadata': {}, 'arrays': {'a': {'dtype': '<f8', 'shape': [-1], 'offset': 0}}},
+     "negative dimension"),
+    ({'version': 1, 'metadata': {}, 'arrays': {'a': {'dtype': '<f8', 'shape': [2], 'offset': -64}}},
+     "runs past the end"),
+])
+def test_corrupt_headers_are_refused(tmp_path, header, message):
+    path = tmp_path / 'corrupt.flat'
+    write_header(path, header)
+    with pytest.raises(ValueError, match=message):
+        modelfile.load(path)
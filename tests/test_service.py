@@ -0,0 +1,84 @@
+import http.client
+import json
+
+import pandas as pd
+import pytest
+
+from sleep_analyzer.registry import WARMUP_PROFILE, ModelRegistry
+from sleep_analyzer.service import MAX_BODY_BYTES, PredictionService, serve
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    shared = tmp_path_factory.mktemp('models')
+    registry = ModelRegistry(table_path=shared / 'no-table.npy', shared_dir=shared)
+    server = serve(PredictionService(registry), port=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    try:
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_predicts_one_profile(server, model):
+    status, result = request(server, 'POST', '/predict', WARMUP_PROFILE)
+    assert status == 200
+    assert result['prediction'] == model.predict(pd.DataFrame([WARMUP_PROFILE]))[0]
+    assert result['source'] == 'model'
+    lower, upper = result['interval']
+    assert lower <= upper
+
+
+def test_batches_report_the_model_version(server):
+    status, result = request(server, 'POST', '/predict', {'profiles': [WARMUP_PROFILE, WARMUP_PROFILE]})
+    assert status == 200
+    assert len(result['predictions']) == 2
+    assert len(result['model']) == 64
+
+
+@pytest.mark.parametrize('body, message', [
+    ('{"Age": ', "invalid JSON"),
+    ([], "expected a profile"),
+    ('"text"', "expected a profile"),
+    ({k: v for k, v in WARMUP_PROFILE.items() if k != 'Gender'}, "missing fields: Gender"),
+    (dict(WARMUP_PROFILE, Age=500), "Age must be a number"),
+    (dict(WARMUP_PROFILE, Age=True), "Age must be a number"),
+    (dict(WARMUP_PROFILE, exercise='daily'), "'exercise' must be one of"),
+    (dict(WARMUP_PROFILE, exercise=['yes']), "'exercise' must be one of"),
+    (dict(WARMUP_PROFILE, **{'screen hours': -1}), "'screen hours' must be a non-negative number"),
+    ([WARMUP_PROFILE, dict(WARMUP_PROFILE, Gender=None)], "profile 1: 'Gender' must be one of"),
+])
+def test_bad_requests_get_400_with_the_reason(server, body, message):
+    status, result = request(server, 'POST', '/predict', body)
+    assert status == 400
+    assert message in result['error']
+
+
+@pytest.mark.parametrize('length, status', [('abc', 400), ('-5', 400), (str(MAX_BODY_BYTES + 1), 413)])
+def test_bad_content_length_is_refused(server, length, status):
+    assert request(server, 'POST', '/predict', b'{}', headers={'Content-Length': length})[0] == status
+
+
+def test_missing_content_length_is_refused(server):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    try:
+        connection.putrequest('POST', '/predict')
+        connection.endheaders()
+        assert connection.getresponse().status == 411
+    finally:
+        connection.close()
+
+
+def test_unknown_endpoint_is_404(server):
+    assert request(server, 'GET', '/nope')[0] == 404
+    assert request(server, 'POST', '/nope', {})[0] == 404
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from sleep_analyzer.features import random_profiles
+from sleep_analyzer.train import fit_streaming
+
+
+def chunks(n_chunks, rows=40, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_chunks):
+        X = random_profiles(rng, rows)
+        yield X, pd.Series(rng.uniform(4, 9, rows))
+
+
+def test_streaming_cap_that_is_not_a_multiple_of_the_chunk_trees():
+    model, _, _, rows = fit_streaming(chunks(6), n_jobs=1, trees_per_chunk=30, max_trees=100, holdout_fraction=0)
+    regressor = model.named_steps['regressor']
+    assert rows == 240
+    assert regressor.n_estimators == len(regressor.estimators_) == 100
+
+
+def test_streaming_forest_grows_by_trees_per_chunk_below_the_cap():
+    model, _, _, _ = fit_streaming(chunks(3), n_jobs=1, trees_per_chunk=30, max_trees=100, holdout_fraction=0)
+    assert len(model.named_steps['regressor'].estimators_) == 90